@@ -16,9 +16,14 @@ MODEL_DEFAULT_TAG = "dev"
 
 EMD_MODELS_LOCAL_DIR_TEMPLATE = "emd_models/{model_id}"
 EMD_MODELS_S3_KEY_TEMPLATE = EMD_MODELS_LOCAL_DIR_TEMPLATE
+# written next to the model files in s3, see pipeline/utils/model_manifest.py
+EMD_MODEL_MANIFEST_FILE_NAME = ".emd_manifest.json"
 
 EMD_DEFAULT_PROFILE_PARH = "~/.emd_default_profile"
 
+EMD_LOCAL_CACHE_DIR = "~/.emd"
+EMD_ENDPOINT_CACHE_PATH = f"{EMD_LOCAL_CACHE_DIR}/endpoint_cache.json"
+
 EMD_DEFAULT_CONTAINER_PREFIX = "emd"
 
 MODEL_TAG_PATTERN = r'^[a-z0-9]([a-z0-9-_]{0,61}[a-z0-9])?$'
@@ -1,6 +1,6 @@
 from . import Engine
 from .utils.constants import EngineType
-from typing import Union
+from typing import Union,List
 
 class OpenAICompitableEngine(Engine):
     api_key:Union[str,None] = None
@@ -9,6 +9,25 @@ class OpenAICompitableEngine(Engine):
     default_cli_args: str = ""
     custom_gpu_num: Union[int,None] = None
     custom_neuron_core_num: Union[int,None] = None
+    # relay the raw request/response bytes to the engine server instead of re-serializing them
+    enable_passthrough: bool = False
+    # serve the engine on a unix domain socket instead of its tcp port, if the engine supports it (vllm --uds)
+    server_uds_path: Union[str,None] = None
+    http_keepalive_expiry: float = 60
+    # synthetic requests run through the engine server before the container reports healthy,
+    # one streaming and one non-streaming request for each prompt length and max_tokens
+    enable_warmup: bool = True
+    warmup_prompt_lengths: List[int] = [16, 512]
+    warmup_max_tokens: List[int] = [1, 64]
+    # polling of the engine server readiness, doubling the interval from min to max
+    readiness_poll_min_interval: float = 0.1
+    readiness_poll_max_interval: float = 2
+    # restarts of a crashed engine server before the container is left unhealthy
+    max_server_restarts: int = 5
+    # independent engine servers, each on its own port and an equal share of the gpus (data parallelism)
+    num_replicas: int = 1
+    # requests sharing a session or prompt prefix stick to one replica, unless it has this many outstanding requests
+    affinity_max_outstanding: int = 64
 
 
 class VllmEngine(OpenAICompitableEngine):
@@ -39,6 +58,8 @@ class HuggingFaceWhisperEngine(Engine):
 class HuggingFaceLLMEngine(Engine):
     pretrained_model_init_kwargs: Union[dict,None] = None
     pretrained_tokenizer_init_kwargs: Union[dict,None] = None
+    # load each shard of a sharded checkpoint as soon as it is downloaded
+    stream_model_load: bool = True
 
 class ComfyuiEngine(Engine):
     pass
@@ -5,9 +5,21 @@ from .utils.constants import FrameworkType
 class FastAPIFramework(Framework):
     limit_concurrency: int = 1000
     timeout_keep_alive: int = 60
+    # seconds to drain in-flight requests on SIGTERM before the engine server is stopped
+    timeout_graceful_shutdown: int = 30
     uvicorn_log_level: str = "info"
-
-
+    # micro-batching of embedding/rerank requests, off with a max_batch_size of 1
+    max_batch_size: int = 1
+    batch_window_ms: float = 5
+    # admission control per route, max_in_flight of 0 disables it
+    max_in_flight: int = 0
+    max_queue_size: int = 100
+    max_queue_time: float = 30
+    retry_after: float = 1
+    priority_header: str = "X-EMD-Priority"
+    # route requests of a session, or sharing a system prompt, to the same engine replica
+    enable_affinity: bool = True
+    session_header: str = "X-EMD-Session-Id"
 
 
 fastapi_framework = FastAPIFramework(
@@ -15,7 +27,17 @@ fastapi_framework = FastAPIFramework(
     framework_type=FrameworkType.FASTAPI,
     limit_concurrency = 1000,
     timeout_keep_alive = 60,
-    uvicorn_log_level = "info"
+    timeout_graceful_shutdown = 30,
+    uvicorn_log_level = "info",
+    max_batch_size = 1,
+    batch_window_ms = 5,
+    max_in_flight = 0,
+    max_queue_size = 100,
+    max_queue_time = 30,
+    retry_after = 1,
+    priority_header = "X-EMD-Priority",
+    enable_affinity = True,
+    session_header = "X-EMD-Session-Id"
 )
 
 custom_framework = Framework(
@@ -85,6 +85,12 @@ class Engine(ModelBase):
     # this field is used to modify the model fields like qwen2 yarn config
     model_files_modify_hook: Union[str,None] = None
     model_files_modify_hook_kwargs: Union[dict,None] = None
+    # download of the model files from s3 in the container, in parts fetched in parallel,
+    # 2 connections per vcpu of the instance by default
+    model_fetch_concurrency: Union[int,None] = None
+    model_fetch_part_size_mb: int = 64
+    # check the files against the sha256 of the manifest written by prepare_model
+    verify_model_files: bool = True
     description:str = ""
     support_inf2_instance: bool = False
 
@@ -169,6 +175,7 @@ class Model(ModelBase,Generic[T]):
     # allow_china_region_ecs: bool = False
     huggingface_model_id: str = ""
     huggingface_endpoints: List[str] = ["https://huggingface.co","https://hf-mirror.com"]
+    # download large files over one connection instead of in ranged parts, like hf_transfer
     disable_hf_transfer:bool = False
 
     huggingface_model_download_kwargs: dict = Field(default_factory=dict)
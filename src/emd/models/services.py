@@ -73,7 +73,8 @@ ecs_service = Service(
         "Region": "region",
         "ContainerCpu": "container_cpu",
         "ContainerMemory": "container_memory",
-        "ContainerGpu":"instance_gpu_num"
+        "ContainerGpu":"instance_gpu_num",
+        "ModelCacheMaxSizeGB": ValueWithDefault(name="model_cache_max_size_gb",default=100)
     },
     name = "Amazon ECS",
     service_type=ServiceType.ECS,
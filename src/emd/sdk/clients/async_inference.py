@@ -0,0 +1,418 @@
+import io
+import json
+import math
+import posixpath
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from boto3.s3.transfer import TransferConfig
+from botocore.exceptions import ClientError
+
+from emd.utils.line_iterator import iter_json_stream
+from emd.utils.serializers import json_dumps, json_loads
+from emd.utils.logger_utils import get_logger
+
+logger = get_logger(__name__)
+
+MB = 1024 * 1024
+
+# multipart transfers of the inputs and results, parts are uploaded/downloaded
+# in parallel and at most max_concurrency parts are kept in memory
+S3_TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=16 * MB,
+    multipart_chunksize=16 * MB,
+    max_concurrency=8
+)
+
+RESULT_FORMATS = ("json", "json_stream", "bytes", "stream", "file")
+
+READ_CHUNK_SIZE = 1 * MB
+
+
+def _parse_s3_url(url:str):
+    bucket, _, key = url[len("s3://"):].partition("/")
+    return bucket, key
+
+
+class JsonPayloadReader(io.RawIOBase):
+    """
+    A file-like object of the compact json encoding of `payload`, encoded while it is
+    read, e.g. by `upload_fileobj`. The values of a dict payload are encoded one by one,
+    so the memory is bounded by the largest value instead of the whole payload.
+    """
+
+    def __init__(self, payload:Any):
+        self._chunks = self._iter_chunks(payload)
+        self._chunk = memoryview(b"")
+
+    @staticmethod
+    def _iter_chunks(payload:Any) -> Iterator[bytes]:
+        if not isinstance(payload, dict):
+            yield json_dumps(payload)
+            return
+        separator = b"{"
+        for key, value in payload.items():
+            yield separator + json_dumps(str(key)) + b":"
+            yield json_dumps(value)
+            separator = b","
+        yield b"{}" if separator == b"{" else b"}"
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while not self._chunk:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                return 0
+            self._chunk = memoryview(chunk)
+        size = min(len(buffer), len(self._chunk))
+        buffer[:size] = self._chunk[:size]
+        self._chunk = self._chunk[size:]
+        return size
+
+
+def open_json_payload(payload:Any) -> io.BufferedReader:
+    """`JsonPayloadReader` of `payload`, buffered so that reads return full parts."""
+    return io.BufferedReader(JsonPayloadReader(payload), buffer_size=READ_CHUNK_SIZE)
+
+
+def _iter_json_documents(body) -> Iterator[Any]:
+    try:
+        yield from iter_json_stream(body.iter_chunks(READ_CHUNK_SIZE))
+    finally:
+        body.close()
+
+
+def read_result(body, result_format:str = "json") -> Any:
+    """
+    Read the body of an async inference result in `result_format`:
+
+    - json: the decoded json document
+    - json_stream: an iterator of the json documents of a json lines or server-sent
+      events result, decoded while the body is downloaded in chunks
+    - bytes: the raw bytes
+    - stream: the body itself, a file-like object the caller reads and closes
+    """
+    if result_format == "stream":
+        return body
+    if result_format == "json_stream":
+        return _iter_json_documents(body)
+    try:
+        data = body.read()
+    finally:
+        body.close()
+    if result_format == "bytes":
+        return data
+    return json_loads(data)
+
+
+class NotificationSource:
+    """A source of the S3 locations of finished async inference requests, e.g. the
+    SNS success/error topics of the endpoint delivered to a SQS queue."""
+
+    def receive(self, wait_time:float) -> List[str]:
+        """Block up to `wait_time` seconds and return the locations notified in the meantime."""
+        raise NotImplementedError
+
+
+class SQSNotificationSource(NotificationSource):
+    """Notifications of the async inference endpoint (`SuccessTopic`/`ErrorTopic`)
+    subscribed to the SQS queue `queue_url`, with or without raw message delivery."""
+
+    def __init__(self, sqs_client, queue_url:str):
+        self.sqs_client = sqs_client
+        self.queue_url = queue_url
+
+    @staticmethod
+    def _get_locations(body:str) -> List[str]:
+        try:
+            message = json.loads(body)
+            if "Message" in message and "TopicArn" in message:
+                # sns envelope
+                message = json.loads(message["Message"])
+        except (TypeError, ValueError):
+            return []
+        response_parameters = message.get("responseParameters") or {}
+        return [
+            value for value in response_parameters.values()
+            if isinstance(value, str) and value.startswith("s3://")
+        ]
+
+    def receive(self, wait_time:float) -> List[str]:
+        response = self.sqs_client.receive_message(
+            QueueUrl=self.queue_url,
+            MaxNumberOfMessages=10,
+            # long polling, at most 20 seconds
+            WaitTimeSeconds=max(1, min(20, math.ceil(wait_time)))
+        )
+        messages = response.get("Messages", [])
+        locations = []
+        for message in messages:
+            locations.extend(self._get_locations(message["Body"]))
+        if messages:
+            self.sqs_client.delete_message_batch(
+                QueueUrl=self.queue_url,
+                Entries=[
+                    {"Id": str(i), "ReceiptHandle": message["ReceiptHandle"]}
+                    for i, message in enumerate(messages)
+                ]
+            )
+        return locations
+
+
+class LocalNotificationSource(NotificationSource):
+    """In-process notifications, e.g. to test without SNS and SQS."""
+
+    def __init__(self):
+        self._queue = queue.Queue()
+
+    def publish(self, location:str):
+        self._queue.put(location)
+
+    def receive(self, wait_time:float) -> List[str]:
+        try:
+            locations = [self._queue.get(timeout=max(wait_time, 0))]
+        except queue.Empty:
+            return []
+        while True:
+            try:
+                locations.append(self._queue.get_nowait())
+            except queue.Empty:
+                return locations
+
+
+class _PendingRequest:
+    def __init__(
+            self,
+            output_path:str,
+            failure_path:Optional[str],
+            timeout:Optional[float],
+            fetch_result:Optional[Callable[[str], Any]]
+        ):
+        self.output_path = output_path
+        self.failure_path = failure_path
+        self.timeout = timeout
+        self.fetch_result = fetch_result
+        self.deadline = time.monotonic() + timeout if timeout is not None else float("inf")
+        self.future = Future()
+
+
+class AsyncInferenceResultCollector:
+    """
+    Waits for the results of all async inference requests of a process in one
+    background thread, instead of a waiter thread per request.
+
+    Every poll, the pending output and failure objects are grouped by their S3
+    prefix, and each prefix is listed with ListObjectsV2, which finds the results
+    of up to 1000 requests per call. If listing a prefix takes more pages than it has
+    pending objects, e.g. because old results are kept there, listing stops there and the
+    objects are checked with HeadObject instead, on this and later polls. The interval between polls grows from `min_interval` to
+    `max_interval` while nothing finishes, and is reset when a result is found or a
+    request is added.
+
+    With a `notification_source`, results are collected as soon as they are notified
+    and S3 is only polled every `max_interval` seconds, in case a notification is lost.
+    """
+
+    def __init__(
+            self,
+            s3_client,
+            handle_response,
+            notification_source:Optional[NotificationSource] = None,
+            min_interval:float = 0.5,
+            max_interval:float = 15,
+            backoff_factor:float = 1.5,
+            max_fetch_workers:int = 8
+        ):
+        self.s3_client = s3_client
+        self.handle_response = handle_response
+        self.notification_source = notification_source
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff_factor = backoff_factor
+        self.max_fetch_workers = max_fetch_workers
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        # s3 location (output or failure) -> pending request
+        self._pending: Dict[str, _PendingRequest] = {}
+        # (bucket, prefix) -> number of pages of the last listing
+        self._list_pages: Dict[tuple, int] = {}
+        self._thread = None
+        self._fetch_executor = None
+        self._interval = min_interval
+
+    def watch(
+            self,
+            output_path:str,
+            failure_path:Optional[str] = None,
+            timeout:Optional[float] = None,
+            fetch_result:Optional[Callable[[str], Any]] = None
+        ) -> Future:
+        """The future of the result of an async inference request. It raises
+        `AsyncInferenceModelError` if the request failed and `PollingTimeoutError` if
+        there is no result after `timeout` seconds.
+
+        The result is read by `fetch_result(output_path)` if provided, otherwise the
+        output object is passed to `handle_response`."""
+        request = _PendingRequest(output_path, failure_path, timeout, fetch_result)
+        with self._lock:
+            self._pending[output_path] = request
+            if failure_path is not None:
+                self._pending[failure_path] = request
+            # cut a backed off sleep short, a burst of requests wakes the poller once
+            wakeup = self._interval > self.min_interval
+            self._interval = self.min_interval
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="emd-async-inference-collector", daemon=True)
+                self._thread.start()
+        if wakeup:
+            self._wakeup.set()
+        return request.future
+
+    def _run(self):
+        last_s3_poll = 0
+        while True:
+            with self._lock:
+                if not self._pending:
+                    # the next watch starts a new thread
+                    self._thread = None
+                    return
+                interval = self._interval
+            try:
+                if self.notification_source is not None:
+                    if time.monotonic() - last_s3_poll >= self.max_interval:
+                        last_s3_poll = time.monotonic()
+                        self._poll_s3()
+                    wait_time = max(1, self.max_interval - (time.monotonic() - last_s3_poll))
+                    self._collect(self.notification_source.receive(wait_time))
+                else:
+                    self._poll_s3()
+                    self._wakeup.wait(interval)
+                    self._wakeup.clear()
+            except Exception as e:
+                logger.warning(f"failed to poll async inference results: {e!r}")
+                time.sleep(interval)
+            self._expire()
+
+    def _poll_s3(self):
+        with self._lock:
+            locations = list(self._pending)
+        groups = {}
+        for location in locations:
+            bucket, key = _parse_s3_url(location)
+            prefix = posixpath.dirname(key)
+            prefix = f"{prefix}/" if prefix else ""
+            groups.setdefault((bucket, prefix), set()).add(key)
+
+        found = []
+        for (bucket, prefix), keys in groups.items():
+            if self._list_pages.get((bucket, prefix), 0) > len(keys):
+                found.extend(self._head_objects(bucket, keys))
+            else:
+                found.extend(self._list_objects(bucket, prefix, keys))
+        self._collect(found)
+
+    def _list_objects(self, bucket:str, prefix:str, keys:set) -> List[str]:
+        found = []
+        remaining = set(keys)
+        pages = 0
+        paginator = self.s3_client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+            pages += 1
+            for obj in page.get("Contents", []):
+                if obj["Key"] in remaining:
+                    remaining.discard(obj["Key"])
+                    found.append(f"s3://{bucket}/{obj['Key']}")
+            if pages > len(keys) and remaining:
+                # the prefix holds the results of many requests, one HeadObject per key is cheaper
+                self._list_pages[(bucket, prefix)] = pages
+                return found + self._head_objects(bucket, remaining)
+        self._list_pages[(bucket, prefix)] = pages
+        return found
+
+    def _head_objects(self, bucket:str, keys:set) -> List[str]:
+        found = []
+        for key in keys:
+            try:
+                self.s3_client.head_object(Bucket=bucket, Key=key)
+                found.append(f"s3://{bucket}/{key}")
+            except ClientError as e:
+                if e.response["Error"]["Code"] not in ("404", "NoSuchKey", "NotFound"):
+                    raise
+        return found
+
+    def _collect(self, locations:List[str]):
+        """Resolve the requests of the finished `locations`."""
+        finished = []
+        with self._lock:
+            for location in locations:
+                request = self._pending.get(location)
+                if request is None:
+                    continue
+                self._pending.pop(request.output_path, None)
+                if request.failure_path is not None:
+                    self._pending.pop(request.failure_path, None)
+                finished.append((request, location))
+            if finished:
+                self._interval = self.min_interval
+            else:
+                self._interval = min(self.max_interval, self._interval * self.backoff_factor)
+            if finished and self._fetch_executor is None:
+                self._fetch_executor = ThreadPoolExecutor(
+                    max_workers=self.max_fetch_workers, thread_name_prefix="emd-async-inference-fetch"
+                )
+        for request, location in finished:
+            self._fetch_executor.submit(self._fetch, request, location)
+
+    def _fetch(self, request:_PendingRequest, location:str):
+        from .sagemaker_client import AsyncInferenceModelError
+        try:
+            if location == request.output_path and request.fetch_result is not None:
+                request.future.set_result(request.fetch_result(location))
+                return
+            bucket, key = _parse_s3_url(location)
+            result = self.handle_response(self.s3_client.get_object(Bucket=bucket, Key=key))
+            if location == request.output_path:
+                request.future.set_result(result)
+            else:
+                request.future.set_exception(AsyncInferenceModelError(message=result))
+        except Exception as e:
+            request.future.set_exception(e)
+
+    def _expire(self):
+        from .sagemaker_client import PollingTimeoutError
+        now = time.monotonic()
+        expired = []
+        with self._lock:
+            for location, request in list(self._pending.items()):
+                if request.deadline <= now:
+                    del self._pending[location]
+                    if location == request.output_path:
+                        expired.append(request)
+        for request in expired:
+            request.future.set_exception(PollingTimeoutError(
+                message="Inference could still be running",
+                output_path=request.output_path,
+                seconds=request.timeout
+            ))
+
+
+_collectors = {}
+_collectors_lock = threading.Lock()
+
+
+def get_result_collector(s3_client, handle_response, notification_source:Optional[NotificationSource] = None) -> AsyncInferenceResultCollector:
+    """The collector shared by the clients using the same s3 client and notification source."""
+    key = (id(s3_client), id(notification_source))
+    with _collectors_lock:
+        collector = _collectors.get(key)
+        if collector is None:
+            collector = AsyncInferenceResultCollector(
+                s3_client, handle_response, notification_source=notification_source
+            )
+            _collectors[key] = collector
+        return collector
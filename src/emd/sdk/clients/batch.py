@@ -0,0 +1,296 @@
+import asyncio
+import json
+import os
+import queue
+import random
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, Iterator, Optional
+
+from botocore.exceptions import ClientError
+
+from emd.utils.logger_utils import get_logger
+
+logger = get_logger(__name__)
+
+# error codes of sagemaker runtime worth retrying
+RETRYABLE_ERROR_CODES = {
+    "ThrottlingException",
+    "Throttling",
+    "TooManyRequestsException",
+    "ServiceUnavailable",
+    "ServiceUnavailableException",
+}
+# http status codes worth retrying, the emd serving container returns them when it sheds load
+RETRYABLE_STATUS_CODES = {429, 503}
+
+
+@dataclass
+class BatchResult:
+    """The result of one payload of a batch, `error` is set if the payload failed."""
+    index: int
+    result: Any = None
+    error: Optional[Exception] = None
+    attempts: int = 0
+    # the result was loaded from the checkpoint instead of invoking the model
+    from_checkpoint: bool = False
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+def is_retryable_error(error:Exception) -> bool:
+    if isinstance(error, ClientError):
+        code = error.response.get("Error", {}).get("Code")
+        status_code = error.response.get("ResponseMetadata", {}).get("HTTPStatusCode")
+        return code in RETRYABLE_ERROR_CODES or status_code in RETRYABLE_STATUS_CODES
+    status_code = getattr(error, "status_code", None)
+    if status_code is None:
+        status_code = getattr(getattr(error, "response", None), "status_code", None)
+    if status_code in RETRYABLE_STATUS_CODES:
+        return True
+    try:
+        import httpx
+    except ImportError:
+        return False
+    # connection resets, timeouts etc.
+    return isinstance(error, httpx.TransportError)
+
+
+class AsyncRateLimiter:
+    """Token bucket of `rate` requests per second, which allows bursts of `burst` requests."""
+
+    def __init__(self, rate:float, burst:Optional[float]=None):
+        if rate <= 0:
+            raise ValueError(f"rate_limit should be positive, got {rate}")
+        self.rate = rate
+        self.capacity = burst or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class BatchCheckpoint:
+    """JSONL file with one line per finished payload: `{"index": 0, "result": ...}` or
+    `{"index": 0, "error": "..."}`. Payloads with a result are skipped when the batch is
+    resumed from the file, failed ones are invoked again."""
+
+    def __init__(self, path:str):
+        self.path = path
+        self._file = None
+
+    def load(self) -> Dict[int, Any]:
+        results = {}
+        if not os.path.exists(self.path):
+            return results
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # the last line may be cut off if the previous run was killed
+                    continue
+                if "result" in record:
+                    results[record["index"]] = record["result"]
+        return results
+
+    def open(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._file = open(self.path, "a+", encoding="utf-8")
+        # terminate a cut off last line, otherwise it would swallow the next record
+        if self._file.tell() > 0:
+            self._file.seek(self._file.tell() - 1)
+            if self._file.read(1) != "\n":
+                self._file.write("\n")
+
+    def write(self, batch_result:BatchResult):
+        if batch_result.ok:
+            record = {"index": batch_result.index, "result": batch_result.result}
+        else:
+            record = {"index": batch_result.index, "error": repr(batch_result.error)}
+        try:
+            line = json.dumps(record, ensure_ascii=False)
+        except (TypeError, ValueError) as e:
+            # recorded as an error, a resumed batch invokes the payload again
+            logger.warning(f"failed to checkpoint the result of payload {batch_result.index}: {e}")
+            line = json.dumps({"index": batch_result.index, "error": repr(e)}, ensure_ascii=False)
+        self._file.write(line + "\n")
+        self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+async def _invoke_with_retry(
+        invoke:Callable,
+        index:int,
+        payload:dict,
+        rate_limiter:Optional[AsyncRateLimiter],
+        max_retries:int,
+        backoff_base:float,
+        max_backoff:float
+    ) -> BatchResult:
+    attempt = 0
+    while True:
+        attempt += 1
+        if rate_limiter is not None:
+            await rate_limiter.acquire()
+        try:
+            if payload.get("stream", False):
+                raise ValueError("streaming payloads are not supported by invoke_batch")
+            return BatchResult(index=index, result=await invoke(payload), attempts=attempt)
+        except Exception as e:
+            if attempt > max_retries or not is_retryable_error(e):
+                return BatchResult(index=index, error=e, attempts=attempt)
+            # full jitter, so that throttled requests do not retry in lockstep
+            delay = random.uniform(0, min(max_backoff, backoff_base * 2 ** (attempt - 1)))
+            logger.debug(f"payload {index} failed with {e!r}, retry in {delay:.2f}s ({attempt}/{max_retries})")
+            await asyncio.sleep(delay)
+
+
+async def aiter_batch(
+        invoke:Callable,
+        payloads:Iterable[dict],
+        max_concurrency:int=16,
+        rate_limit:Optional[float]=None,
+        max_retries:int=5,
+        backoff_base:float=0.5,
+        max_backoff:float=20,
+        checkpoint_path:Optional[str]=None
+    ) -> AsyncIterator[BatchResult]:
+    """Invoke `invoke` on each payload with at most `max_concurrency` requests in flight
+    and yield the results as they complete. `payloads` is consumed lazily, so it can be a
+    generator over a large file."""
+    if max_concurrency < 1:
+        raise ValueError(f"max_concurrency should be at least 1, got {max_concurrency}")
+    checkpoint = None
+    finished = {}
+    if checkpoint_path is not None:
+        checkpoint = BatchCheckpoint(checkpoint_path)
+        finished = checkpoint.load()
+        if finished:
+            logger.info(f"resume batch from {checkpoint_path}, {len(finished)} payloads finished")
+        checkpoint.open()
+    for index, result in sorted(finished.items()):
+        yield BatchResult(index=index, result=result, from_checkpoint=True)
+
+    rate_limiter = AsyncRateLimiter(rate_limit) if rate_limit else None
+    items = enumerate(payloads)
+    # bounded, so that the workers wait for a slow consumer
+    results = asyncio.Queue(maxsize=max_concurrency * 2)
+    done = object()
+
+    async def worker():
+        try:
+            # all workers share the iterator, the event loop never interleaves next() calls
+            for index, payload in items:
+                if index in finished:
+                    continue
+                batch_result = await _invoke_with_retry(
+                    invoke, index, payload, rate_limiter, max_retries, backoff_base, max_backoff
+                )
+                if checkpoint is not None:
+                    checkpoint.write(batch_result)
+                await results.put(batch_result)
+        finally:
+            await results.put(done)
+
+    workers = [asyncio.ensure_future(worker()) for _ in range(max_concurrency)]
+    try:
+        remaining = len(workers)
+        while remaining:
+            batch_result = await results.get()
+            if batch_result is done:
+                remaining -= 1
+                continue
+            yield batch_result
+        # raise the errors of iterating the payloads
+        for w in workers:
+            w.result()
+    finally:
+        for w in workers:
+            w.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        if checkpoint is not None:
+            checkpoint.close()
+
+
+def iter_in_thread(create_aiter:Callable[[], AsyncIterator], max_buffered:int=1024) -> Iterator:
+    """Iterate an async iterator from synchronous code. The iterator runs on its own event
+    loop in a background thread, which also works if the caller has a running event loop,
+    e.g. in notebooks."""
+    buffer = queue.Queue(maxsize=max_buffered)
+    done = object()
+
+    class _Error:
+        def __init__(self, error):
+            self.error = error
+
+    async def _put(item):
+        while True:
+            try:
+                buffer.put_nowait(item)
+                return
+            except queue.Full:
+                await asyncio.sleep(0.01)
+
+    async def _run():
+        try:
+            async for item in create_aiter():
+                await _put(item)
+        except asyncio.CancelledError:
+            raise
+        except BaseException as e:
+            await _put(_Error(e))
+        else:
+            await _put(done)
+
+    loop = asyncio.new_event_loop()
+    task = loop.create_task(_run())
+
+    def _run_loop():
+        try:
+            loop.run_until_complete(task)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            loop.close()
+
+    thread = threading.Thread(target=_run_loop, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = buffer.get()
+            if item is done:
+                return
+            if isinstance(item, _Error):
+                raise item.error
+            yield item
+    finally:
+        if thread.is_alive():
+            try:
+                loop.call_soon_threadsafe(task.cancel)
+            except RuntimeError:
+                # the loop was closed in the meantime
+                pass
+            # unblock a pending put
+            while thread.is_alive():
+                try:
+                    buffer.get(timeout=0.05)
+                except queue.Empty:
+                    pass
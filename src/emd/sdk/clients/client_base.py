@@ -1,6 +1,10 @@
-from pydantic import BaseModel,Field
-from typing import Optional
+from pydantic import BaseModel,Field,PrivateAttr
+from typing import Optional,Any,AsyncIterator,Iterable,Iterator,List
+import asyncio
 import os
+from .batch import BatchResult,aiter_batch,iter_in_thread
+from .response_cache import is_successful_response
+from emd.utils.serializers import DEFAULT_SERIALIZER,Serializer
 
 class ClientBase(BaseModel):
     model_id: Optional[str] = None
@@ -12,14 +16,172 @@ class ClientBase(BaseModel):
     model_stack_name: Optional[str] = None
     """The name of the model stack deployed by emd."""
 
+    max_async_connections: int = 1000
+    """The maximum number of concurrent connections of `ainvoke`."""
+
+    serializer: Any = None
+    """The `emd.utils.serializers.Serializer` of the requests and responses, compact json by default."""
+
+    response_cache: Any = None
+    """A `emd.sdk.clients.response_cache.ResponseCache` of the responses of deterministic
+    requests, e.g. embeddings or chat with temperature 0. Not cached if None."""
+
+    _async_http_client: Any = PrivateAttr(default=None)
+    _async_http_client_loop: Any = PrivateAttr(default=None)
+
     class Config:
         """Configuration for this pydantic object."""
         extra = "allow"
 
 
+    def get_serializer(self) -> Serializer:
+        return self.serializer or DEFAULT_SERIALIZER
+
+
+    def get_endpoint_key(self) -> str:
+        """Identifies the endpoint in the keys of the response cache."""
+        return f"{type(self).__name__}/{self.model_stack_name}/{self.model_id}/{self.model_tag}"
+
+
+    def _get_cache_key(self, pyload:dict) -> Optional[str]:
+        if self.response_cache is None or not self.response_cache.is_cacheable(pyload):
+            return None
+        return self.response_cache.make_key(self.get_endpoint_key(), pyload)
+
+
     def invoke(self,pyload:dict):
+        cache_key = self._get_cache_key(pyload)
+        if cache_key is None:
+            return self._invoke(pyload)
+        response = self.response_cache.get(cache_key)
+        if response is None:
+            response = self._invoke(pyload)
+            if is_successful_response(response):
+                self.response_cache.set(cache_key, response)
+        return response
+
+
+    def _invoke(self,pyload:dict):
         raise NotImplementedError
 
 
     def invoke_async(self, pyload:dict):
         raise NotADirectoryError
+
+
+    async def ainvoke(self, pyload:dict):
+        """Asynchronous version of `invoke`, streaming requests return an async iterator of chunks."""
+        cache_key = self._get_cache_key(pyload)
+        if cache_key is None:
+            return await self._ainvoke(pyload)
+        response = self.response_cache.get(cache_key)
+        if response is None:
+            response = await self._ainvoke(pyload)
+            if is_successful_response(response):
+                self.response_cache.set(cache_key, response)
+        return response
+
+
+    async def _ainvoke(self, pyload:dict):
+        raise NotImplementedError
+
+
+    async def astream(self, pyload:dict):
+        """Yield the chunks of a streaming request."""
+        iterator = await self.ainvoke({**pyload, "stream": True})
+        async for chunk in iterator:
+            yield chunk
+
+
+    async def ainvoke_batch_as_completed(
+            self,
+            payloads:Iterable[dict],
+            max_concurrency:int=16,
+            rate_limit:Optional[float]=None,
+            max_retries:int=5,
+            checkpoint_path:Optional[str]=None
+        ) -> AsyncIterator[BatchResult]:
+        """Invoke the model on each payload and yield a `BatchResult` per payload as it completes.
+
+        Args:
+            payloads: The payloads of `invoke`, consumed lazily. Streaming is not supported.
+            max_concurrency: The maximum number of requests in flight.
+            rate_limit: The maximum number of requests per second, unlimited if None.
+            max_retries: How many times a throttled payload (ThrottlingException, 429, 503)
+                is retried with jittered exponential backoff before it fails.
+            checkpoint_path: A JSONL file the results are appended to. Payloads with a result
+                in the file are not invoked again, so an interrupted batch can be resumed.
+        """
+        async for batch_result in aiter_batch(
+            self.ainvoke,
+            payloads,
+            max_concurrency=max_concurrency,
+            rate_limit=rate_limit,
+            max_retries=max_retries,
+            checkpoint_path=checkpoint_path
+        ):
+            yield batch_result
+
+
+    async def ainvoke_batch(self, payloads:Iterable[dict], **kwargs) -> List[BatchResult]:
+        """Like `ainvoke_batch_as_completed`, but return the results in the order of `payloads`."""
+        batch_results = [r async for r in self.ainvoke_batch_as_completed(payloads, **kwargs)]
+        return sorted(batch_results, key=lambda r: r.index)
+
+
+    def invoke_batch_as_completed(self, payloads:Iterable[dict], **kwargs) -> Iterator[BatchResult]:
+        """Synchronous version of `ainvoke_batch_as_completed`."""
+        async def _aiter():
+            try:
+                async for batch_result in self.ainvoke_batch_as_completed(payloads, **kwargs):
+                    yield batch_result
+            finally:
+                # the connections belong to the event loop of the batch, which is closed afterwards
+                await self._aclose_for_loop(asyncio.get_running_loop())
+        return iter_in_thread(_aiter)
+
+
+    def invoke_batch(self, payloads:Iterable[dict], **kwargs) -> List[BatchResult]:
+        """Invoke the model on each payload concurrently and return a `BatchResult` per payload,
+        in the order of `payloads`. See `ainvoke_batch_as_completed` for the arguments.
+
+        Example:
+            results = client.invoke_batch(payloads, max_concurrency=64, checkpoint_path="out.jsonl")
+            failed = [r for r in results if not r.ok]
+        """
+        return sorted(self.invoke_batch_as_completed(payloads, **kwargs), key=lambda r: r.index)
+
+
+    def get_async_http_client(self):
+        """The httpx.AsyncClient of the running event loop, connections can not be shared across loops."""
+        try:
+            import httpx
+        except ImportError:
+            raise ImportError(
+                "Could not import httpx python package. "
+                "Please install it with `pip install httpx`."
+            )
+        loop = asyncio.get_running_loop()
+        if self._async_http_client is None or self._async_http_client_loop is not loop:
+            self._async_http_client = httpx.AsyncClient(
+                timeout=httpx.Timeout(600, connect=10),
+                limits=httpx.Limits(
+                    max_connections=self.max_async_connections,
+                    max_keepalive_connections=self.max_async_connections
+                )
+            )
+            self._async_http_client_loop = loop
+        return self._async_http_client
+
+
+    async def _aclose_for_loop(self, loop):
+        """Close the http client if it belongs to `loop`."""
+        if self._async_http_client_loop is loop:
+            await self.aclose()
+
+
+    async def aclose(self):
+        if self._async_http_client is not None:
+            await self._async_http_client.aclose()
+            self._async_http_client = None
+            self._async_http_client_loop = None
@@ -14,10 +14,11 @@ from botocore.exceptions import WaiterError
 from botocore.exceptions import ClientError
 
 from .client_base import ClientBase
-from emd.utils.aws_service_utils import check_stack_exists,get_model_stack_info
+from emd.utils.endpoint_resolver import endpoint_resolver
 from emd.models import Model
 from emd.constants import MODEL_DEFAULT_TAG
 from emd.utils.logger_utils import get_logger
+from emd.utils.line_iterator import LineIterator,AsyncLineIterator,iter_json_stream,aiter_json_stream
 from emd.utils.framework_utils import get_model_specific_path
 import requests
 
@@ -25,62 +26,20 @@ import requests
 logger = get_logger(__name__)
 
 
-class LineIterator:
-    """
-    A helper class for parsing the byte stream input.
-
-    The output of the model will be in the following format:
-
-    b'{"outputs": [" a"]}\n'
-    b'{"outputs": [" challenging"]}\n'
-    b'{"outputs": [" problem"]}\n'
-    ...
-
-
-    This class accounts for this by concatenating bytes written via the 'write' function
-    and then exposing a method which will return lines (ending with a '\n' character)
-    within the buffer via the 'scan_lines' function.
-    It maintains the position of the last read position to ensure
-    that previous bytes are not exposed again.
-
-    For more details see:
-    https://aws.amazon.com/blogs/machine-learning/elevating-the-generative-ai-experience-introducing-streaming-support-in-amazon-sagemaker-hosting/
-    """
-
-    def __init__(self, stream: Any) -> None:
-        self.byte_iterator = iter(stream)
-        self.buffer = io.BytesIO()
-        self.read_pos = 0
-
-    def __iter__(self) -> "LineIterator":
-        return self
-
-    def __next__(self) -> Any:
-        while True:
-            self.buffer.seek(self.read_pos)
-            line = self.buffer.readline()
-            if line and line[-1] == ord("\n"):
-                self.read_pos += len(line)
-                return line[:-1]
-            try:
-                chunk = next(self.byte_iterator)
-                # print('chunk: ',chunk)
-            except StopIteration:
-                if self.read_pos < self.buffer.getbuffer().nbytes:
-                    # print('continue condition',self.read_pos,self.buffer.getbuffer().nbytes)
-                    continue
-                raise
-            # if "PayloadPart" not in chunk:
-            #     # Unknown Event Type
-            #     continue
-            self.buffer.seek(0, io.SEEK_END)
-            self.buffer.write(chunk)#["PayloadPart"]["Bytes"])
+class ECSInvocationError(RuntimeError):
+    """Raised when the load balancer of the model returns an error status."""
 
+    def __init__(self, status_code:int, message:str):
+        super().__init__(f"Error {status_code}, {message}")
+        self.status_code = status_code
 
 
 class ECSClient(ClientBase):
     base_url:str = ""
 
+    region_name: Optional[str] = None
+    """The region of the model stack, the default region if None."""
+
     @model_validator(mode='before')
     def validate_environment(cls, values: Dict) -> Dict:
         if values.get("base_url"):
@@ -97,11 +56,10 @@ class ECSClient(ClientBase):
                 model_tag=values.get("model_tag") or MODEL_DEFAULT_TAG
             )
 
-        # get endpoint name from stack
-        if not check_stack_exists(model_stack_name):
+        # get endpoint name from stack, cached across clients and processes
+        stack_info = endpoint_resolver.get_stack_info(model_stack_name, values.get("region_name"))
+        if stack_info is None:
             raise ValueError(f"Model stack {model_stack_name} does not exist")
-
-        stack_info = get_model_stack_info(model_stack_name)
         Outputs = stack_info.get('Outputs')
         if not Outputs:
             raise RuntimeError(f"Model stack {model_stack_name} does not have any outputs, the model may be not deployed in success")
@@ -113,29 +71,72 @@ class ECSClient(ClientBase):
         assert values.get("base_url") is not None, "base_url  not found in stack outputs"
         return values
 
-    def invoke(self,pyload:dict):
+    def get_endpoint_key(self) -> str:
+        return f"ecs/{self.base_url}/{self.model_id}/{self.model_tag}"
+
+    def _invoke(self,pyload:dict):
         stream = pyload.get('stream', False)
         model_specific_invocations_path = get_model_specific_path(self.model_id, self.model_tag, "invocations")
         url = f"{self.base_url}{model_specific_invocations_path}"
+        serializer = self.get_serializer()
+        headers = {"Content-Type": serializer.content_type, "Accept": serializer.accept}
         if stream:
             response = requests.post(
                 url,
-                json=pyload,
+                data=serializer.serialize(pyload),
+                headers=headers,
                 stream=True
             )
             if response.status_code != 200:
-                raise RuntimeError(f"Error {response.status_code}, {response.text}")
+                raise ECSInvocationError(response.status_code, response.text)
             def _ret_iterator_helper():
-                interator = LineIterator(response)
-                for line in interator:
-                    chunk_dict = json.loads(line)
-                    if not chunk_dict:
-                        continue
-                    yield chunk_dict
+                # server-sent events of the load balancer
+                try:
+                    yield from iter_json_stream(response.iter_content(chunk_size=None))
+                finally:
+                    response.close()
 
             return _ret_iterator_helper()
         else:
-            return requests.post(
+            response = requests.post(
                 url,
-                json=pyload
-            ).json()
+                data=serializer.serialize(pyload),
+                headers=headers
+            )
+            if response.status_code != 200:
+                raise ECSInvocationError(response.status_code, response.text)
+            return serializer.deserialize(response.content)
+
+    async def _ainvoke(self,pyload:dict):
+        stream = pyload.get('stream', False)
+        model_specific_invocations_path = get_model_specific_path(self.model_id, self.model_tag, "invocations")
+        url = f"{self.base_url}{model_specific_invocations_path}"
+        http_client = self.get_async_http_client()
+        serializer = self.get_serializer()
+        body = serializer.serialize(pyload)
+        headers = {"Content-Type": serializer.content_type, "Accept": serializer.accept}
+        if stream:
+            response = await http_client.send(
+                http_client.build_request("POST", url, content=body, headers=headers),
+                stream=True
+            )
+            if response.status_code != 200:
+                try:
+                    content = await response.aread()
+                finally:
+                    await response.aclose()
+                raise ECSInvocationError(response.status_code, content.decode('utf-8', errors='replace'))
+            async def _ret_iterator_helper():
+                # server-sent events of the load balancer
+                try:
+                    async for chunk_dict in aiter_json_stream(response.aiter_bytes()):
+                        yield chunk_dict
+                finally:
+                    await response.aclose()
+
+            return _ret_iterator_helper()
+        else:
+            response = await http_client.post(url, content=body, headers=headers)
+            if response.status_code != 200:
+                raise ECSInvocationError(response.status_code, response.text)
+            return serializer.deserialize(response.content)
@@ -5,6 +5,7 @@ from typing import (
     Callable,
     Dict,
     Iterator,
+    AsyncIterator,
     List,
     Literal,
     Mapping,
@@ -51,7 +52,6 @@ from langchain_core.runnables import (
     RunnableMap
 )
 from langchain_aws.llms import SagemakerEndpoint
-from langchain_aws.llms.sagemaker_endpoint import LineIterator
 from pydantic import BaseModel,Field,model_validator
 from pydantic import BaseModel as pydantic_basemodel
 from langchain_core.messages import (
@@ -88,6 +88,7 @@ from emd.utils.aws_service_utils import check_stack_exists,get_model_stack_info
 from emd.models import Model
 from emd.constants import MODEL_DEFAULT_TAG
 from emd.sdk.clients.sagemaker_client import SageMakerClient
+from emd.sdk.clients.response_cache import get_default_response_cache
 from emd.utils.logger_utils import get_logger
 from langchain_core.embeddings import Embeddings
 
@@ -266,14 +267,25 @@ class SageMakerVllmModelBase(BaseModel):
     s3_client: Any = None
     """Boto3 client for s3"""
 
+    response_cache: Any = None
+    """A `ResponseCache` of the responses of deterministic requests, False to disable the
+    default cache of the embeddings and rerank models."""
+
     class Config:
         """Configuration for this pydantic object."""
         extra = "allow"
 
+    @classmethod
+    def get_default_response_cache(cls):
+        return None
+
     @model_validator(mode='before')
     def validate_environment(cls, values: Dict) -> Dict:
         """Dont do anything if client provided externally"""
         if not values.get("sagemaker_client"):
+            response_cache = values.get("response_cache")
+            if response_cache is None:
+                response_cache = cls.get_default_response_cache()
             values["sagemaker_client"] = SageMakerClient(
                 region_name=values.get("region_name"),
                 endpoint_name=values.get('endpoint_name'),
@@ -286,6 +298,7 @@ class SageMakerVllmModelBase(BaseModel):
                 model_id=values.get("model_id"),
                 model_tag=values.get("model_tag"),
                 model_stack_name=values.get("model_stack_name"),
+                response_cache=response_cache or None,
             )
         return values
 
@@ -337,6 +350,25 @@ class SageMakerVllmChatModelBase(SageMakerVllmModelBase,BaseChatModel):
         input_body = self.prepare_input_body(_model_kwargs,messages)
         input_body['stream'] = False
         response_dict = self.sagemaker_client.invoke(input_body)
+        return self._create_chat_result(response_dict)
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        """Asynchronous version of `_generate`, which does not hold a thread while waiting for the endpoint."""
+        _model_kwargs = self.model_kwargs or {}
+        _model_kwargs = {**_model_kwargs, **kwargs}
+
+        input_body = self.prepare_input_body(_model_kwargs,messages)
+        input_body['stream'] = False
+        response_dict = await self.sagemaker_client.ainvoke(input_body)
+        return self._create_chat_result(response_dict)
+
+    def _create_chat_result(self, response_dict: dict) -> ChatResult:
         generations = []
         generation_info = None
         token_usage = response_dict.get("usage")
@@ -377,30 +409,57 @@ class SageMakerVllmChatModelBase(SageMakerVllmModelBase,BaseChatModel):
         iterator = self.sagemaker_client.invoke(input_body)
 
         for chunk_dict in iterator:
-            if not chunk_dict:
-                continue
-            if len(chunk_dict["choices"]) == 0:
+            cg_chunk = self._convert_chunk(chunk_dict)
+            if cg_chunk is None:
                 continue
-            choice = chunk_dict["choices"][0]
-            if choice["delta"] is None:
-                continue
-
-            default_chunk_class = AIMessageChunk
-            chunk = _convert_delta_to_message_chunk(
-                choice["delta"], default_chunk_class
-            )
-            finish_reason = choice.get("finish_reason")
-            generation_info = (
-                dict(finish_reason=finish_reason) if finish_reason is not None else None
-            )
-            default_chunk_class = chunk.__class__
-            cg_chunk = ChatGenerationChunk(
-                message=chunk, generation_info=generation_info
-            )
             if run_manager:
                 run_manager.on_llm_new_token(cg_chunk.text, chunk=cg_chunk)
             yield cg_chunk
 
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        """Stream the output of the model without holding a thread.
+        """
+        _model_kwargs = self.model_kwargs or {}
+        _model_kwargs = {**_model_kwargs, **kwargs}
+        input_body = self.prepare_input_body(_model_kwargs,messages)
+        input_body['stream'] = True
+        iterator = await self.sagemaker_client.ainvoke(input_body)
+
+        async for chunk_dict in iterator:
+            cg_chunk = self._convert_chunk(chunk_dict)
+            if cg_chunk is None:
+                continue
+            if run_manager:
+                await run_manager.on_llm_new_token(cg_chunk.text, chunk=cg_chunk)
+            yield cg_chunk
+
+    def _convert_chunk(self, chunk_dict: dict) -> Optional[ChatGenerationChunk]:
+        if not chunk_dict:
+            return None
+        if len(chunk_dict["choices"]) == 0:
+            return None
+        choice = chunk_dict["choices"][0]
+        if choice["delta"] is None:
+            return None
+
+        default_chunk_class = AIMessageChunk
+        chunk = _convert_delta_to_message_chunk(
+            choice["delta"], default_chunk_class
+        )
+        finish_reason = choice.get("finish_reason")
+        generation_info = (
+            dict(finish_reason=finish_reason) if finish_reason is not None else None
+        )
+        return ChatGenerationChunk(
+            message=chunk, generation_info=generation_info
+        )
+
 
     @property
     def _llm_type(self) -> str:
@@ -571,6 +630,11 @@ class SageMakerVllmChatModel(SageMakerVllmChatModelBase):
 class SageMakerVllmEmbeddings(SageMakerVllmModelBase,Embeddings):
     normalize: bool = False
 
+    @classmethod
+    def get_default_response_cache(cls):
+        # identical texts, e.g. when a corpus is ingested again, are not embedded again
+        return get_default_response_cache()
+
     def _embedding_func(self, text: str) -> List[float]:
         """Call out to SageMaker embedding endpoint."""
 
@@ -586,6 +650,21 @@ class SageMakerVllmEmbeddings(SageMakerVllmModelBase,Embeddings):
             logger.error(f"Error raised by inference endpoint: {e}")
             raise e
 
+    async def _aembedding_func(self, text: str) -> List[float]:
+        """Asynchronous call out to SageMaker embedding endpoint."""
+
+        input_body: Dict[str, Any] = {
+            "input": [text],
+        }
+
+        try:
+            response_dict = await self.sagemaker_client.ainvoke(input_body)
+            return response_dict['data'][0]['embedding']
+
+        except Exception as e:
+            logger.error(f"Error raised by inference endpoint: {e}")
+            raise e
+
     def _normalize_vector(self, embeddings: List[float]) -> List[float]:
         """Normalize the embedding to a unit vector."""
         import numpy as np
@@ -640,7 +719,12 @@ class SageMakerVllmEmbeddings(SageMakerVllmModelBase,Embeddings):
             Embeddings for the text.
         """
 
-        return await run_in_executor(None, self.embed_query, text)
+        embedding = await self._aembedding_func(text)
+
+        if self.normalize:
+            return self._normalize_vector(embedding)
+
+        return embedding
 
     async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
         """Asynchronous compute doc embeddings using a Bedrock model.
@@ -660,6 +744,10 @@ class SageMakerVllmEmbeddings(SageMakerVllmModelBase,Embeddings):
 class SageMakerVllmRerank(SageMakerVllmModelBase,BaseDocumentCompressor):
     top_n: Optional[int] = sys.maxsize
 
+    @classmethod
+    def get_default_response_cache(cls):
+        return get_default_response_cache()
+
     def rerank(
         self,
         documents: Sequence[Union[str, Document]],
@@ -694,7 +782,7 @@ class SageMakerVllmRerank(SageMakerVllmModelBase,BaseDocumentCompressor):
                     "text_2": doc
                 }]
             }
-            for doc in documents
+            for doc in serialized_documents
         ]
         rets = asyncio.run(self.run_tasks_in_executor(tasks))
 
@@ -708,6 +796,41 @@ class SageMakerVllmRerank(SageMakerVllmModelBase,BaseDocumentCompressor):
 
         return rets
 
+    async def arerank(
+        self,
+        documents: Sequence[Union[str, Document]],
+        query: str,
+        top_n: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """Asynchronous version of `rerank`."""
+        if len(documents) == 0:
+            return []
+
+        serialized_documents = [
+            doc.page_content
+            if isinstance(doc,Document)
+            else doc
+            for doc in documents
+        ]
+        rets = await asyncio.gather(*[
+            self.sagemaker_client.ainvoke({
+                "encoding_format": "float",
+                "text_1": query,
+                "text_2": doc
+            })
+            for doc in serialized_documents
+        ])
+
+        rets = [
+            {
+                "index": i,
+                "relevance_score": ret["data"][0]["score"]
+            }
+            for i,ret in enumerate(rets)
+        ]
+
+        return rets
+
     def compress_documents(
         self,
         documents: Sequence[Document],
@@ -732,3 +855,18 @@ class SageMakerVllmRerank(SageMakerVllmModelBase,BaseDocumentCompressor):
             doc_copy.metadata["relevance_score"] = res["relevance_score"]
             compressed.append(doc_copy)
         return compressed
+
+    async def acompress_documents(
+        self,
+        documents: Sequence[Document],
+        query: str,
+        callbacks: Optional[Callbacks] = None,
+    ) -> Sequence[Document]:
+        """Asynchronous version of `compress_documents`."""
+        compressed = []
+        for res in await self.arerank(documents, query):
+            doc = documents[res["index"]]
+            doc_copy = Document(doc.page_content, metadata=deepcopy(doc.metadata))
+            doc_copy.metadata["relevance_score"] = res["relevance_score"]
+            compressed.append(doc_copy)
+        return compressed
@@ -0,0 +1,414 @@
+import asyncio
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Dict, List, Optional, Set
+
+import botocore.exceptions
+from botocore.exceptions import ClientError
+from pydantic import PrivateAttr, model_validator
+
+from emd.constants import MODEL_DEFAULT_TAG
+from emd.models import Model
+from emd.models.utils.constants import ServiceType
+from emd.utils.endpoint_resolver import endpoint_resolver
+from emd.utils.logger_utils import get_logger
+
+from .batch import is_retryable_error
+from .client_base import ClientBase
+
+logger = get_logger(__name__)
+
+# latencies kept per endpoint for the hedging delay
+LATENCY_WINDOW = 200
+# latencies needed before requests to an endpoint are hedged
+MIN_HEDGE_SAMPLES = 20
+
+
+def is_endpoint_failure(error:Exception) -> bool:
+    """Whether `error` means the endpoint is unhealthy, as opposed to a bad request,
+    so that the request is sent to another endpoint."""
+    if is_retryable_error(error):
+        return True
+    if isinstance(error, ClientError):
+        status_code = error.response.get("ResponseMetadata", {}).get("HTTPStatusCode") or 0
+        return status_code >= 500 or error.response.get("Error", {}).get("Code") == "ModelNotReadyException"
+    # connection errors and timeouts of botocore
+    if isinstance(error, (botocore.exceptions.HTTPClientError, botocore.exceptions.ConnectionError)):
+        return True
+    status_code = getattr(error, "status_code", None)
+    if isinstance(status_code, int):
+        return status_code >= 500
+    try:
+        import requests
+    except ImportError:
+        return False
+    return isinstance(error, (requests.ConnectionError, requests.Timeout))
+
+
+class CircuitBreaker:
+    """
+    Ejects an endpoint after `failure_threshold` consecutive failures. After
+    `recovery_time` seconds one probe request is let through (half open), which closes
+    the breaker if it succeeds and opens it again if it fails.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold:int = 5, recovery_time:float = 30):
+        self.failure_threshold = failure_threshold
+        self.recovery_time = recovery_time
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def is_available(self) -> bool:
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN:
+            return time.monotonic() - self.opened_at >= self.recovery_time
+        # half open, the probe is in flight
+        return False
+
+    def acquire(self) -> bool:
+        """Whether a request can be sent, turns an expired open breaker half open."""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.recovery_time:
+                self.state = self.HALF_OPEN
+                return True
+            return False
+
+    def release(self):
+        """The request let through was cancelled, allow another probe."""
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self.state = self.OPEN
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    logger.warning(f"circuit breaker opened after {self.failures} failures")
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+
+class EndpointState:
+    """A client of the `MultiEndpointClient` with its latency statistics and circuit breaker."""
+
+    def __init__(self, name:str, client:ClientBase, ewma_alpha:float, circuit_breaker:CircuitBreaker):
+        self.name = name
+        self.client = client
+        self.ewma_alpha = ewma_alpha
+        self.circuit_breaker = circuit_breaker
+        # exponentially weighted moving average of the latency, None until the first response
+        self.ewma_latency: Optional[float] = None
+        self.outstanding = 0
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self._lock = threading.Lock()
+
+    def score(self) -> float:
+        """The expected latency of a new request, lower is better. Endpoints without
+        responses yet score 0, so that they get requests."""
+        if self.ewma_latency is None:
+            return 0.0
+        return self.ewma_latency * (self.outstanding + 1)
+
+    def quantile(self, q:float) -> Optional[float]:
+        with self._lock:
+            if len(self.latencies) < MIN_HEDGE_SAMPLES:
+                return None
+            latencies = sorted(self.latencies)
+        return latencies[min(len(latencies) - 1, int(q * len(latencies)))]
+
+    def start(self) -> float:
+        with self._lock:
+            self.outstanding += 1
+        return time.perf_counter()
+
+    def cancel(self):
+        with self._lock:
+            self.outstanding -= 1
+        self.circuit_breaker.release()
+
+    def finish(self, started:float, error:Optional[Exception] = None):
+        latency = time.perf_counter() - started
+        with self._lock:
+            self.outstanding -= 1
+            if error is None:
+                self.latencies.append(latency)
+                if self.ewma_latency is None:
+                    self.ewma_latency = latency
+                else:
+                    self.ewma_latency += self.ewma_alpha * (latency - self.ewma_latency)
+        if error is None:
+            self.circuit_breaker.record_success()
+        elif is_endpoint_failure(error):
+            self.circuit_breaker.record_failure()
+        else:
+            # a bad request, the endpoint answered
+            self.circuit_breaker.record_success()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "ewma_latency": self.ewma_latency,
+            "p95_latency": self.quantile(0.95),
+            "outstanding": self.outstanding,
+            "circuit": self.circuit_breaker.state,
+        }
+
+
+class MultiEndpointClient(ClientBase):
+    """
+    Invokes a model deployed several times, e.g. under several tags or in several regions.
+
+    Each request goes to the endpoint with the lowest expected latency, the EWMA of its
+    latency times its outstanding requests plus one. An endpoint is ejected by a circuit
+    breaker after `failure_threshold` consecutive failures (throttling, 5xx, connection
+    errors), and the request is sent to the next endpoint. With `hedge`, a non-streaming
+    request is also sent to a second endpoint if it takes longer than the `hedge_quantile`
+    latency of the first one, and the first response is returned.
+
+    Example:
+        client = MultiEndpointClient(targets=[
+            {"model_id": "Qwen2.5-7B-Instruct", "model_tag": "a"},
+            {"model_id": "Qwen2.5-7B-Instruct", "model_tag": "a", "region_name": "us-west-2"},
+        ], hedge=True)
+    """
+
+    targets: List[Any] = []
+    """The endpoints, dicts (or tuples) of model_id, model_tag and region_name, or clients."""
+
+    hedge: bool = False
+    """Send a duplicate of slow non-streaming requests to a second endpoint."""
+
+    hedge_quantile: float = 0.95
+    """The latency quantile of an endpoint after which a request is hedged."""
+
+    min_hedge_delay: float = 0.05
+    """The minimum delay in seconds before a request is hedged."""
+
+    ewma_alpha: float = 0.3
+    """The weight of a new latency in the moving average."""
+
+    failure_threshold: int = 5
+    """Consecutive failures after which an endpoint is ejected."""
+
+    recovery_time: float = 30
+    """Seconds after which an ejected endpoint is probed again."""
+
+    max_hedge_workers: int = 64
+    """The maximum number of concurrent requests of `invoke` with `hedge`."""
+
+    endpoints: List[Any] = []
+
+    _executor: Any = PrivateAttr(default=None)
+
+    @model_validator(mode='before')
+    def validate_environment(cls, values: Dict) -> Dict:
+        if values.get("endpoints"):
+            return values
+        targets = values.get("targets") or []
+        if not targets:
+            raise ValueError("targets must not be empty")
+        endpoints = []
+        for target in targets:
+            try:
+                name, client = cls._create_client(target)
+            except Exception as e:
+                # the other endpoints are still usable, e.g. if a region is down
+                logger.warning(f"skip endpoint {target}: {e}")
+                continue
+            endpoints.append(EndpointState(
+                name,
+                client,
+                ewma_alpha=values.get("ewma_alpha", 0.3),
+                circuit_breaker=CircuitBreaker(
+                    failure_threshold=values.get("failure_threshold", 5),
+                    recovery_time=values.get("recovery_time", 30)
+                )
+            ))
+        if not endpoints:
+            raise ValueError(f"none of the targets {targets} can be invoked")
+        values["endpoints"] = endpoints
+        return values
+
+    @staticmethod
+    def _create_client(target):
+        if isinstance(target, ClientBase):
+            return target.model_stack_name or target.model_id or str(id(target)), target
+        if isinstance(target, (tuple, list)):
+            target = dict(zip(("model_id", "model_tag", "region_name"), target))
+        model_id = target["model_id"]
+        model_tag = target.get("model_tag") or MODEL_DEFAULT_TAG
+        region_name = target.get("region_name")
+        model_stack_name = Model.get_model_stack_name_prefix(model_id, model_tag)
+        stack_info = endpoint_resolver.get_stack_info(model_stack_name, region_name)
+        if stack_info is None:
+            raise ValueError(f"Model stack {model_stack_name} does not exist")
+        parameters = {p['ParameterKey']: p['ParameterValue'] for p in stack_info.get('Parameters', [])}
+        if parameters.get('ServiceType') == ServiceType.ECS:
+            from .ecs_client import ECSClient
+            client = ECSClient(model_id=model_id, model_tag=model_tag, region_name=region_name)
+        else:
+            from .sagemaker_client import SageMakerClient
+            client = SageMakerClient(model_id=model_id, model_tag=model_tag, region_name=region_name)
+        return f"{region_name or 'default'}/{model_stack_name}", client
+
+    def _select(self, exclude:Set[EndpointState] = frozenset()) -> Optional[EndpointState]:
+        """The endpoint with the lowest score which is not ejected, ties broken at random."""
+        candidates = [
+            e for e in self.endpoints
+            if e not in exclude and e.circuit_breaker.is_available()
+        ]
+        for endpoint in sorted(candidates, key=lambda e: (e.score(), random.random())):
+            if endpoint.circuit_breaker.acquire():
+                return endpoint
+        if not exclude:
+            # all endpoints are ejected, try the one ejected first rather than failing
+            return min(self.endpoints, key=lambda e: e.circuit_breaker.opened_at)
+        return None
+
+    def get_endpoint_key(self) -> str:
+        return "multi/" + ",".join(sorted(e.client.get_endpoint_key() for e in self.endpoints))
+
+    def get_stats(self) -> List[Dict[str, Any]]:
+        """The latency statistics and circuit breaker state of each endpoint."""
+        return [e.get_stats() for e in self.endpoints]
+
+    def _call(self, endpoint:EndpointState, pyload:dict):
+        started = endpoint.start()
+        try:
+            result = endpoint.client.invoke(pyload)
+        except Exception as e:
+            endpoint.finish(started, e)
+            raise
+        endpoint.finish(started)
+        return result
+
+    async def _acall(self, endpoint:EndpointState, pyload:dict):
+        started = endpoint.start()
+        try:
+            result = await endpoint.client.ainvoke(pyload)
+        except asyncio.CancelledError:
+            # the hedged duplicate won, neither a success nor a failure of the endpoint
+            endpoint.cancel()
+            raise
+        except Exception as e:
+            endpoint.finish(started, e)
+            raise
+        endpoint.finish(started)
+        return result
+
+    def _get_hedge_delay(self, endpoint:EndpointState) -> Optional[float]:
+        if not self.hedge or len(self.endpoints) < 2:
+            return None
+        delay = endpoint.quantile(self.hedge_quantile)
+        return None if delay is None else max(self.min_hedge_delay, delay)
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_hedge_workers, thread_name_prefix="emd-hedge"
+            )
+        return self._executor
+
+    def _invoke(self, pyload:dict):
+        tried = set()
+        last_error = None
+        while True:
+            endpoint = self._select(exclude=tried)
+            if endpoint is None:
+                raise last_error or RuntimeError("no endpoint is available")
+            tried.add(endpoint)
+            hedge_delay = None if pyload.get("stream") else self._get_hedge_delay(endpoint)
+            try:
+                if hedge_delay is None:
+                    return self._call(endpoint, pyload)
+                return self._invoke_hedged(endpoint, hedge_delay, pyload, tried)
+            except Exception as e:
+                if not is_endpoint_failure(e):
+                    raise
+                logger.warning(f"endpoint {endpoint.name} failed, try the next one: {e!r}")
+                last_error = e
+
+    def _invoke_hedged(self, endpoint:EndpointState, hedge_delay:float, pyload:dict, tried:set):
+        executor = self._get_executor()
+        pending = {executor.submit(self._call, endpoint, pyload)}
+        done, _ = wait(pending, timeout=hedge_delay)
+        if not done:
+            hedge_endpoint = self._select(exclude=tried)
+            if hedge_endpoint is not None:
+                tried.add(hedge_endpoint)
+                pending.add(executor.submit(self._call, hedge_endpoint, pyload))
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    # the other request is left to finish, it still updates the statistics
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    async def _ainvoke(self, pyload:dict):
+        tried = set()
+        last_error = None
+        while True:
+            endpoint = self._select(exclude=tried)
+            if endpoint is None:
+                raise last_error or RuntimeError("no endpoint is available")
+            tried.add(endpoint)
+            hedge_delay = None if pyload.get("stream") else self._get_hedge_delay(endpoint)
+            try:
+                if hedge_delay is None:
+                    return await self._acall(endpoint, pyload)
+                return await self._ainvoke_hedged(endpoint, hedge_delay, pyload, tried)
+            except Exception as e:
+                if not is_endpoint_failure(e):
+                    raise
+                logger.warning(f"endpoint {endpoint.name} failed, try the next one: {e!r}")
+                last_error = e
+
+    async def _ainvoke_hedged(self, endpoint:EndpointState, hedge_delay:float, pyload:dict, tried:set):
+        pending = {asyncio.ensure_future(self._acall(endpoint, pyload))}
+        try:
+            done, _ = await asyncio.wait(pending, timeout=hedge_delay)
+            if not done:
+                hedge_endpoint = self._select(exclude=tried)
+                if hedge_endpoint is not None:
+                    tried.add(hedge_endpoint)
+                    pending.add(asyncio.ensure_future(self._acall(hedge_endpoint, pyload)))
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _aclose_for_loop(self, loop):
+        for endpoint in self.endpoints:
+            await endpoint.client._aclose_for_loop(loop)
+
+    async def aclose(self):
+        for endpoint in self.endpoints:
+            await endpoint.client.aclose()
@@ -0,0 +1,203 @@
+"""
+Cache of the responses of deterministic requests of the sdk clients, e.g. embeddings,
+rerank scores or chat completions with `temperature=0`.
+
+The responses are kept in memory, least recently used first evicted once they exceed
+`max_bytes`, and optionally in a SQLite file shared across processes and runs:
+
+    from emd.sdk.clients.response_cache import ResponseCache
+    client = SageMakerClient(model_id=..., response_cache=ResponseCache(path="~/.emd/response_cache.sqlite"))
+
+Environment variables of the default cache of the LangChain embeddings and rerank models:
+    EMD_RESPONSE_CACHE_PATH: SQLite file of the default cache, in memory only if not set
+    EMD_RESPONSE_CACHE_TTL: seconds a response is valid (default 86400)
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+
+from emd.utils.logger_utils import get_logger
+from emd.utils.serializers import json_dumps, json_loads
+
+logger = get_logger(__name__)
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+DEFAULT_TTL = 24 * 3600
+
+# keys of generation requests, which are only deterministic without sampling
+GENERATION_KEYS = ("messages", "prompt")
+# keys of embedding and rerank requests
+DETERMINISTIC_KEYS = ("input", "text_1", "text_2", "query", "documents")
+
+
+def is_cacheable(payload:Any) -> bool:
+    """Whether the response of `payload` can be cached: embedding and rerank requests, and
+    chat/completion requests with temperature 0. Streaming requests are never cached."""
+    if not isinstance(payload, dict) or payload.get("stream"):
+        return False
+    if any(key in payload for key in GENERATION_KEYS):
+        return payload.get("temperature") == 0
+    return any(key in payload for key in DETERMINISTIC_KEYS)
+
+
+def is_successful_response(response:Any) -> bool:
+    """Whether a response can be cached: a json object which is not an error body,
+    e.g. the 429 `{"error": ...}` of an overloaded endpoint."""
+    return isinstance(response, dict) and "error" not in response
+
+
+class ResponseCache:
+    """
+    LRU cache of responses, bounded by the size of their json encoding, with an optional
+    SQLite tier at `path`. Responses are stored encoded, so that a hit returns a new object
+    the caller can modify.
+
+    Args:
+        max_bytes: The maximum size of the responses kept in memory.
+        ttl: Seconds a response is valid, None to keep responses until they are evicted.
+        path: A SQLite file to keep the responses in, in memory only if None.
+        is_cacheable: Decides which payloads are cached, `is_cacheable` by default.
+    """
+
+    def __init__(
+            self,
+            max_bytes:int = DEFAULT_MAX_BYTES,
+            ttl:Optional[float] = DEFAULT_TTL,
+            path:Optional[str] = None,
+            is_cacheable:Callable[[Any], bool] = is_cacheable
+        ):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.path = os.path.expanduser(path) if path else None
+        self.is_cacheable = is_cacheable
+        self._lock = threading.Lock()
+        # key -> (expires_at, encoded response)
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._size = 0
+        self._db = None
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if self.path:
+            self._open_db()
+
+    def _open_db(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(self.path, timeout=30, check_same_thread=False, isolation_level=None)
+        # readers do not block the writer of another process
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, value BLOB, expires_at REAL)"
+        )
+        self._db.execute("DELETE FROM responses WHERE expires_at < ?", (time.time(),))
+
+    @staticmethod
+    def make_key(endpoint:str, payload:Any) -> str:
+        """The hash of the endpoint and the canonical encoding of the payload."""
+        digest = hashlib.sha256(endpoint.encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(json_dumps(payload, sort_keys=True))
+        return digest.hexdigest()
+
+    def _expires_at(self) -> float:
+        return time.time() + self.ttl if self.ttl is not None else float("inf")
+
+    def _put_memory(self, key:str, expires_at:float, value:bytes):
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._size -= len(old[1])
+        if len(value) > self.max_bytes:
+            return
+        self._entries[key] = (expires_at, value)
+        self._size += len(value)
+        while self._size > self.max_bytes:
+            _, (_, evicted) = self._entries.popitem(last=False)
+            self._size -= len(evicted)
+            self.evictions += 1
+
+    def get(self, key:str) -> Any:
+        """The cached response of `key`, None on a miss."""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    value = entry[1]
+                else:
+                    del self._entries[key]
+                    self._size -= len(entry[1])
+                    entry = None
+            if entry is None and self._db is not None:
+                row = self._db.execute(
+                    "SELECT value, expires_at FROM responses WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None and row[1] > now:
+                    value = bytes(row[0])
+                    self._put_memory(key, row[1], value)
+                    self.disk_hits += 1
+                    entry = row
+            if entry is None:
+                self.misses += 1
+                return None
+        return json_loads(value)
+
+    def set(self, key:str, response:Any):
+        try:
+            value = json_dumps(response)
+        except (TypeError, ValueError):
+            # not json, e.g. the bytes of a custom serializer
+            return
+        expires_at = self._expires_at()
+        with self._lock:
+            self._put_memory(key, expires_at, value)
+            if self._db is not None:
+                try:
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO responses (key, value, expires_at) VALUES (?, ?, ?)",
+                        (key, value, expires_at if self.ttl is not None else 1e18)
+                    )
+                except sqlite3.Error as e:
+                    logger.warning(f"failed to write response cache {self.path}: {e}")
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+            if self._db is not None:
+                self._db.execute("DELETE FROM responses")
+
+    def get_stats(self) -> Dict[str, Any]:
+        requests = self.hits + self.disk_hits + self.misses
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.disk_hits) / requests if requests else 0.0,
+            "evictions": self.evictions,
+            "entries": len(self._entries),
+            "bytes": self._size,
+        }
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_default_response_cache() -> ResponseCache:
+    """The cache shared by the LangChain embeddings and rerank models."""
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = ResponseCache(
+                ttl=float(os.environ.get("EMD_RESPONSE_CACHE_TTL", DEFAULT_TTL)),
+                path=os.environ.get("EMD_RESPONSE_CACHE_PATH")
+            )
+        return _default_cache
@@ -2,22 +2,36 @@ import json
 import os
 from typing import Optional,Dict,Any,Union
 import io
-from urllib.parse import urlparse
+from urllib.parse import urlparse,quote
 from pydantic import model_validator
 import uuid
-import codecs
+import mimetypes
 import time
 from functools import reduce
 import botocore
-import threading
-from botocore.exceptions import WaiterError
+from concurrent.futures import Future
 from botocore.exceptions import ClientError
+from botocore.auth import SigV4Auth
+from botocore.awsrequest import AWSRequest
+from botocore.eventstream import EventStreamBuffer
 
 from .client_base import ClientBase
-from emd.utils.aws_service_utils import check_stack_exists,get_model_stack_info
+from .async_inference import (
+    AsyncInferenceResultCollector,
+    SQSNotificationSource,
+    get_result_collector,
+    open_json_payload,
+    read_result,
+    RESULT_FORMATS,
+    S3_TRANSFER_CONFIG
+)
+from emd.utils.endpoint_resolver import endpoint_resolver
 from emd.models import Model
 from emd.constants import MODEL_DEFAULT_TAG
 from emd.utils.logger_utils import get_logger
+from emd.utils.line_iterator import LineIterator,AsyncLineIterator,iter_json_stream,aiter_json_stream
+from emd.utils.aws_client_factory import get_client,get_session
+from emd.utils.serializers import JSONSerializer,json_dumps
 # from sagemaker.async_inference
 
 logger = get_logger(__name__)
@@ -70,63 +84,18 @@ class ObjectNotExistedError(AsyncInferenceError):
 
 
 
-class LineIterator:
-    """
-    A helper class for parsing the byte stream input.
-
-    The output of the model will be in the following format:
-
-    b'{"outputs": [" a"]}\n'
-    b'{"outputs": [" challenging"]}\n'
-    b'{"outputs": [" problem"]}\n'
-    ...
-
-    While usually each PayloadPart event from the event stream will
-    contain a byte array with a full json, this is not guaranteed
-    and some of the json objects may be split acrossPayloadPart events.
-
-    For example:
-
-    {'PayloadPart': {'Bytes': b'{"outputs": '}}
-    {'PayloadPart': {'Bytes': b'[" problem"]}\n'}}
-
-
-    This class accounts for this by concatenating bytes written via the 'write' function
-    and then exposing a method which will return lines (ending with a '\n' character)
-    within the buffer via the 'scan_lines' function.
-    It maintains the position of the last read position to ensure
-    that previous bytes are not exposed again.
-
-    For more details see:
-    https://aws.amazon.com/blogs/machine-learning/elevating-the-generative-ai-experience-introducing-streaming-support-in-amazon-sagemaker-hosting/
-    """
-
-    def __init__(self, stream: Any) -> None:
-        self.byte_iterator = iter(stream)
-        self.buffer = io.BytesIO()
-        self.read_pos = 0
-
-    def __iter__(self) -> "LineIterator":
-        return self
-
-    def __next__(self) -> Any:
-        while True:
-            self.buffer.seek(self.read_pos)
-            line = self.buffer.readline()
-            if line and line[-1] == ord("\n"):
-                self.read_pos += len(line)
-                return line[:-1]
-            try:
-                chunk = next(self.byte_iterator)
-            except StopIteration:
-                if self.read_pos < self.buffer.getbuffer().nbytes:
-                    continue
-                raise
-            if "PayloadPart" not in chunk:
-                # Unknown Event Type
-                continue
-            self.buffer.seek(0, io.SEEK_END)
-            self.buffer.write(chunk["PayloadPart"]["Bytes"])
+# request options of invoke_endpoint(_with_response_stream) sent as http headers
+ENDPOINT_REQUEST_HEADERS = {
+    "ContentType": "Content-Type",
+    "CustomAttributes": "X-Amzn-SageMaker-Custom-Attributes",
+    "TargetModel": "X-Amzn-SageMaker-Target-Model",
+    "TargetVariant": "X-Amzn-SageMaker-Target-Variant",
+    "TargetContainerHostname": "X-Amzn-SageMaker-Target-Container-Hostname",
+    "InferenceId": "X-Amzn-SageMaker-Inference-Id",
+    "EnableExplanations": "X-Amzn-SageMaker-Enable-Explanations",
+    "InferenceComponentName": "X-Amzn-SageMaker-Inference-Component",
+    "SessionId": "X-Amzn-SageMaker-Session-Id",
+}
 
 
 class WaiterConfig(object):
@@ -172,6 +141,8 @@ class AsyncInferenceResponse(object):
         predictor_async,
         output_path,
         failure_path,
+        result_format="json",
+        result_path=None,
     ):
         """Initialize an AsyncInferenceResponse object.
 
@@ -185,11 +156,16 @@ class AsyncInferenceResponse(object):
                 to.
             failure_path (str): The Amazon S3 location that endpoints upload model errors
                 for failed requests.
+            result_format (str): How the result is read, see ``SageMakerClient.invoke_async``.
+            result_path (str): The local file the result is downloaded to, if ``result_format``
+                is ``file``.
         """
         self.predictor_async = predictor_async
         self.output_path = output_path
         self._result = None
         self.failure_path = failure_path
+        self.result_format = result_format
+        self.result_path = result_path
 
     def get_result(
         self,
@@ -217,10 +193,29 @@ class AsyncInferenceResponse(object):
                 self._result = self._get_result_from_s3(self.output_path, self.failure_path)
             else:
                 self._result = self.predictor_async._wait_for_output(
-                    self.output_path, self.failure_path, waiter_config
+                    self.output_path,
+                    self.failure_path,
+                    waiter_config,
+                    result_format=self.result_format,
+                    result_path=self.result_path
                 )
         return self._result
 
+    def get_future(self, waiter_config=None) -> Future:
+        """A future of the async inference result, e.g. to wait for many requests with
+        `concurrent.futures.wait` or to await it with `asyncio.wrap_future`.
+
+        Args:
+            waiter_config (WaiterConfig): The timeout is delay * max_attempts, 15 minutes by default.
+        """
+        return self.predictor_async._watch_output(
+            self.output_path,
+            self.failure_path,
+            waiter_config or WaiterConfig(),
+            result_format=self.result_format,
+            result_path=self.result_path
+        )
+
     def _get_result_from_s3(self, output_path, failure_path):
         """Retrieve output based on the presense of failure_path"""
         if failure_path is not None:
@@ -230,12 +225,12 @@ class AsyncInferenceResponse(object):
 
     def _get_result_from_s3_output_path(self, output_path):
         """Get inference result from the output Amazon S3 path"""
-        bucket, key = parse_s3_url(output_path)
         try:
-            response = self.predictor_async.s3_client.get_object(Bucket=bucket, Key=key)
-            return self.predictor_async.predictor._handle_response(response)
+            return self.predictor_async._read_result(
+                output_path, self.result_format, self.result_path
+            )
         except ClientError as ex:
-            if ex.response["Error"]["Code"] == "NoSuchKey":
+            if ex.response["Error"]["Code"] in ("NoSuchKey", "404"):
                 raise ObjectNotExistedError(
                     message="Inference could still be running",
                     output_path=output_path,
@@ -246,12 +241,12 @@ class AsyncInferenceResponse(object):
 
     def _get_result_from_s3_output_failure_paths(self, output_path, failure_path):
         """Get inference result from the output & failure Amazon S3 path"""
-        bucket, key = parse_s3_url(output_path)
         try:
-            response = self.predictor_async.s3_client.get_object(Bucket=bucket, Key=key)
-            return self.predictor_async._handle_response(response)
+            return self.predictor_async._read_result(
+                output_path, self.result_format, self.result_path
+            )
         except ClientError as e:
-            if e.response["Error"]["Code"] == "NoSuchKey":
+            if e.response["Error"]["Code"] in ("NoSuchKey", "404"):
                 try:
                     failure_bucket, failure_key = parse_s3_url(failure_path)
                     failure_response = self.predictor_async.s3_client.get_object(
@@ -487,6 +482,15 @@ class SageMakerClient(ClientBase):
     s3_client: Any = None
     """Boto3 client for s3"""
 
+    async_notification_queue_url: Union[str,None] = None
+    """The SQS queue subscribed to the SNS success/error topics of the async endpoint.
+    If set, async inference results are collected as soon as they are notified instead
+    of waiting for the next poll of the output path."""
+
+    async_notification_source: Any = None
+    """The source of async inference notifications, see `emd.sdk.clients.async_inference`.
+    Created from `async_notification_queue_url` if not provided."""
+
     @model_validator(mode='before')
     def validate_environment(cls, values: Dict) -> Dict:
         """Dont do anything if client provided externally"""
@@ -496,21 +500,23 @@ class SageMakerClient(ClientBase):
                 import boto3
                 try:
                     if not values.get('boto_session'):
-                        if values.get("credentials_profile_name") is not None:
-                            boto_session = boto3.Session(
-                                profile_name=values["credentials_profile_name"]
-                            )
-                        else:
-                            # use default credentials
-                            boto_session = boto3.Session()
-                        values['boto_session'] = boto_session
-
-                    values["client"] = values['boto_session'].client(
-                        "sagemaker-runtime", region_name=values.get("region_name")
+                        # shared by the clients of the same profile and region,
+                        # the default profile is used if credentials_profile_name is None
+                        values['boto_session'] = get_session(
+                            profile_name=values.get("credentials_profile_name"),
+                            region_name=values.get("region_name")
+                        )
+
+                    values["client"] = get_client(
+                        "sagemaker-runtime",
+                        region_name=values.get("region_name"),
+                        session=values['boto_session']
                     )
                     if values.get("s3_client") is None:
-                        values["s3_client"] = values['boto_session'].client(
-                            "s3", region_name=values.get("region_name")
+                        values["s3_client"] = get_client(
+                            "s3",
+                            region_name=values.get("region_name"),
+                            session=values['boto_session']
                         )
 
                 except Exception as e:
@@ -542,12 +548,11 @@ class SageMakerClient(ClientBase):
                 model_tag=values.get("model_tag") or MODEL_DEFAULT_TAG
             )
 
-        # get endpoint name from stack
-        if not check_stack_exists(model_stack_name):
+        # get endpoint name from stack, cached across clients and processes
+        stack_info = endpoint_resolver.get_stack_info(model_stack_name, values.get("region_name"))
+        if stack_info is None:
             raise ValueError(f"Model stack {model_stack_name} does not exist")
 
-        stack_info = get_model_stack_info(model_stack_name)
-
         Outputs = stack_info.get('Outputs')
         if not Outputs:
             raise RuntimeError(f"Model stack {model_stack_name} does not have any outputs, the model may be not deployed in success")
@@ -563,42 +568,122 @@ class SageMakerClient(ClientBase):
         return values
 
     def _prepare_input_body(self,pyload:dict):
-        _model_kwargs = self.model_kwargs or {}
-        body = json.dumps({**_model_kwargs,**pyload},ensure_ascii=False,indent=2)
-        accept = "application/json"
-        contentType = "application/json"
+        serializer = self.get_serializer()
+        if isinstance(pyload, dict):
+            _model_kwargs = self.model_kwargs or {}
+            pyload = {**_model_kwargs,**pyload}
+        body = serializer.serialize(pyload)
         _endpoint_kwargs = self.endpoint_kwargs or {}
         request_options = {
             "Body": body,
             "EndpointName":self.endpoint_name,
-            "Accept": accept,
-            "ContentType": contentType,
+            "Accept": serializer.accept,
+            "ContentType": serializer.content_type,
             **_endpoint_kwargs
         }
         enable_print_messages = os.getenv("ENABLE_PRINT_MESSAGES", 'False').lower() in ('true', '1', 't')
         if enable_print_messages:
-            logger.info(f"request body: {json.loads(request_options['Body'])}")
+            # formatted only when logged, the body is not decoded again
+            logger.info("request body: %s", pyload)
         return request_options
 
-    def invoke(self,pyload:dict):
+    def get_endpoint_key(self) -> str:
+        # the model and endpoint kwargs are part of every request
+        kwargs = json_dumps([self.model_kwargs, self.endpoint_kwargs], sort_keys=True).decode("utf-8")
+        return f"sagemaker/{self.client.meta.region_name}/{self.endpoint_name}/{kwargs}"
+
+    def _invoke(self,pyload:dict):
         request_options = self._prepare_input_body(pyload)
-        stream = pyload.get('stream', False)
+        stream = isinstance(pyload, dict) and pyload.get('stream', False)
         if stream:
             resp = self.client.invoke_endpoint_with_response_stream(
                 **request_options
             )
-            def _ret_iterator_helper():
-                iterator = LineIterator(resp["Body"])
-                for line in iterator:
-                    chunk_dict = json.loads(line)
-                    if not chunk_dict:
-                        continue
-                    yield chunk_dict
-            return _ret_iterator_helper()
+            return iter_json_stream(resp["Body"])
         else:
             output = self.client.invoke_endpoint(**request_options)['Body']
-            response_dict = json.loads(output.read().decode("utf-8"))
-            return response_dict
+            return self.get_serializer().deserialize(output.read())
+
+
+    def _get_signed_request(self, request_options:dict, stream:bool):
+        """The url, headers and body of an InvokeEndpoint(WithResponseStream) call, signed with SigV4."""
+        request_options = dict(request_options)
+        endpoint_name = request_options.pop("EndpointName")
+        body = request_options.pop("Body")
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        operation = "invocations-response-stream" if stream else "invocations"
+        url = f"{self.client.meta.endpoint_url}/endpoints/{quote(endpoint_name, safe='')}/{operation}"
+        headers = {
+            "X-Amzn-SageMaker-Accept" if stream else "Accept": request_options.pop("Accept", "application/json")
+        }
+        for option, value in request_options.items():
+            if option not in ENDPOINT_REQUEST_HEADERS:
+                raise ValueError(f"endpoint option {option} is not supported by ainvoke")
+            headers[ENDPOINT_REQUEST_HEADERS[option]] = str(value)
+        boto_session = self.boto_session or get_session()
+        # frozen per request, so that refreshed credentials are picked up
+        credentials = boto_session.get_credentials().get_frozen_credentials()
+        aws_request = AWSRequest(method="POST", url=url, data=body, headers=headers)
+        SigV4Auth(credentials, "sagemaker", self.client.meta.region_name).add_auth(aws_request)
+        return url, dict(aws_request.headers.items()), body
+
+    async def _asend(self, request_options:dict, stream:bool):
+        url, headers, body = self._get_signed_request(request_options, stream)
+        http_client = self.get_async_http_client()
+        response = await http_client.send(
+            http_client.build_request("POST", url, content=body, headers=headers),
+            stream=True
+        )
+        if response.status_code >= 300:
+            try:
+                content = await response.aread()
+            finally:
+                await response.aclose()
+            try:
+                message = json.loads(content).get("message") or content.decode("utf-8")
+            except ValueError:
+                message = content.decode("utf-8", errors="replace")
+            code = response.headers.get("x-amzn-ErrorType", str(response.status_code)).split(":")[0]
+            raise ClientError(
+                {
+                    "Error": {"Code": code, "Message": message},
+                    "ResponseMetadata": {"HTTPStatusCode": response.status_code}
+                },
+                "InvokeEndpointWithResponseStream" if stream else "InvokeEndpoint"
+            )
+        return response
+
+    async def _aiter_events(self, response):
+        """Decode the event stream of InvokeEndpointWithResponseStream into PayloadPart events."""
+        event_buffer = EventStreamBuffer()
+        try:
+            async for data in response.aiter_bytes():
+                event_buffer.add_data(data)
+                for event in event_buffer:
+                    headers = event.headers
+                    if headers.get(":message-type") == "exception":
+                        error = json.loads(event.payload or b"{}")
+                        raise ClientError(
+                            {"Error": {"Code": headers.get(":exception-type"), "Message": error.get("Message", "")}},
+                            "InvokeEndpointWithResponseStream"
+                        )
+                    if headers.get(":event-type") == "PayloadPart":
+                        yield {"PayloadPart": {"Bytes": event.payload}}
+        finally:
+            await response.aclose()
+
+    async def _ainvoke(self,pyload:dict):
+        request_options = self._prepare_input_body(pyload)
+        stream = isinstance(pyload, dict) and pyload.get('stream', False)
+        response = await self._asend(request_options, stream)
+        if stream:
+            return aiter_json_stream(self._aiter_events(response))
+        try:
+            content = await response.aread()
+        finally:
+            await response.aclose()
+        return self.get_serializer().deserialize(content)
 
 
     def account_id(self) -> str:
@@ -768,147 +853,126 @@ class SageMakerClient(ClientBase):
         return self.default_bucket
 
 
+    def _get_input_location(self, input_path=None):
+        """The bucket and key to upload the request data to"""
+        if input_path:
+            return parse_s3_url(input_path)
+        my_uuid = str(uuid.uuid4())
+        timestamp = sagemaker_timestamp()
+        bucket = self.get_default_bucket()
+        key = s3_path_join(
+            self.default_bucket_prefix,
+            "async-endpoint-inputs",
+            name_from_base(self.name, short=True),
+            "{}-{}".format(timestamp, my_uuid),
+        )
+        return bucket, key
+
     def _upload_data_to_s3(
         self,
         data,
         input_path=None,
+        content_type=None,
     ):
-        """Upload request data to Amazon S3 for users"""
-        if input_path:
-            bucket, key = parse_s3_url(input_path)
-        else:
-            my_uuid = str(uuid.uuid4())
-            timestamp = sagemaker_timestamp()
-            bucket = self.get_default_bucket()
-            key = s3_path_join(
-                self.default_bucket_prefix,
-                "async-endpoint-inputs",
-                name_from_base(self.name, short=True),
-                "{}-{}".format(timestamp, my_uuid),
-            )
+        """Upload request data to Amazon S3 for users.
 
-        _model_kwargs = self.model_kwargs or {}
-        data = json.dumps({**_model_kwargs,**data},ensure_ascii=False,indent=2)
-        self.s3_client.put_object(
-            Body=data, Bucket=bucket, Key=key, ContentType="application/json"
+        A dict is merged with `model_kwargs` and uploaded as compact json, or encoded by
+        the serializer of the client. Bytes and binary
+        file-like objects are uploaded as they are. The data is streamed with a multipart
+        upload, so it is never copied into one large request body.
+        """
+        bucket, key = self._get_input_location(input_path)
+        serializer = self.get_serializer()
+        if isinstance(data, dict):
+            _model_kwargs = self.model_kwargs or {}
+            data = {**_model_kwargs,**data}
+            if isinstance(serializer, JSONSerializer):
+                fileobj = open_json_payload(data)
+            else:
+                fileobj = io.BytesIO(serializer.serialize(data))
+            content_type = content_type or serializer.content_type
+        elif isinstance(data, (bytes, bytearray, memoryview)):
+            fileobj = io.BytesIO(data)
+        elif hasattr(data, "read"):
+            fileobj = data
+        else:
+            raise TypeError(f"unsupported data type for async inference: {type(data)}")
+
+        self.s3_client.upload_fileobj(
+            fileobj,
+            bucket,
+            key,
+            ExtraArgs={"ContentType": content_type or "application/octet-stream"},
+            Config=S3_TRANSFER_CONFIG
         )
-        input_path = input_path or "s3://{}/{}".format(bucket, key)
+        return input_path or "s3://{}/{}".format(bucket, key)
 
-        return input_path
+    def _upload_file_to_s3(
+        self,
+        input_file,
+        input_path=None,
+        content_type=None,
+    ):
+        """Upload a local file, e.g. an audio file, to Amazon S3 with a multipart upload"""
+        bucket, key = self._get_input_location(input_path)
+        content_type = content_type or mimetypes.guess_type(input_file)[0] or "application/octet-stream"
+        self.s3_client.upload_file(
+            input_file,
+            bucket,
+            key,
+            ExtraArgs={"ContentType": content_type},
+            Config=S3_TRANSFER_CONFIG
+        )
+        return input_path or "s3://{}/{}".format(bucket, key)
 
     def _handle_response(self,response):
-        response_body = response["Body"]
-        content_type = response.get("ContentType", "application/octet-stream")
-        try:
-            return json.load(codecs.getreader("utf-8")(response_body))
-        finally:
-            response_body.close()
+        return read_result(response["Body"], "json")
 
-    def _check_output_and_failure_paths(self, output_path, failure_path, waiter_config):
-        """Check the Amazon S3 output path for the output.
+    def _read_result(self, output_path, result_format="json", result_path=None):
+        """Read the async inference result at `output_path` in `result_format`"""
+        bucket, key = parse_s3_url(output_path)
+        if result_format == "file":
+            # parallel ranged downloads straight to the file
+            self.s3_client.download_file(bucket, key, result_path, Config=S3_TRANSFER_CONFIG)
+            return result_path
+        return read_result(self.s3_client.get_object(Bucket=bucket, Key=key)["Body"], result_format)
+
+    def get_result_collector(self) -> AsyncInferenceResultCollector:
+        """The collector of the async inference results, shared by the clients of the same s3 client."""
+        if self.async_notification_source is None and self.async_notification_queue_url:
+            self.async_notification_source = SQSNotificationSource(
+                get_client("sqs", region_name=self.region_name, session=self.boto_session),
+                self.async_notification_queue_url
+            )
+        return get_result_collector(
+            self.s3_client, self._handle_response, self.async_notification_source
+        )
 
-        This method waits for either the output file or the failure file to be found on the
-        specified S3 output path. Whichever file is found first, its corresponding event is
-        triggered, and the method executes the appropriate action based on the event.
+    def _watch_output(self, output_path, failure_path, waiter_config, result_format="json", result_path=None) -> Future:
+        fetch_result = None
+        if result_format != "json":
+            fetch_result = lambda location: self._read_result(location, result_format, result_path)
+        return self.get_result_collector().watch(
+            output_path,
+            failure_path,
+            timeout=waiter_config.delay * waiter_config.max_attempts,
+            fetch_result=fetch_result
+        )
 
-        Args:
-            output_path (str): The S3 path where the output file is expected to be found.
-            failure_path (str): The S3 path where the failure file is expected to be found.
-            waiter_config (boto3.waiter.WaiterConfig): The configuration for the S3 waiter.
+    def _wait_for_output(self, output_path, failure_path, waiter_config, result_format="json", result_path=None):
+        """Wait for the output or failure object of an async inference request.
 
-        Returns:
-            Any: The deserialized result from the output file, if the output file is found first.
-            Otherwise, raises an exception.
+        The objects are polled by the background thread of the result collector together
+        with those of all other pending requests, `waiter_config` only sets the timeout
+        (delay * max_attempts).
 
         Raises:
             AsyncInferenceModelError: If the failure file is found before the output file.
-            PollingTimeoutError: If both files are not found and the S3 waiter
-             has thrown a WaiterError.
-        """
-        output_bucket, output_key = parse_s3_url(output_path)
-        failure_bucket, failure_key = parse_s3_url(failure_path)
-
-        output_file_found = threading.Event()
-        failure_file_found = threading.Event()
-
-        def check_output_file():
-            try:
-                output_file_waiter = self.s3_client.get_waiter("object_exists")
-                output_file_waiter.wait(
-                    Bucket=output_bucket,
-                    Key=output_key,
-                    WaiterConfig=waiter_config._to_request_dict(),
-                )
-                output_file_found.set()
-            except WaiterError:
-                pass
-
-        def check_failure_file():
-            try:
-                failure_file_waiter = self.s3_client.get_waiter("object_exists")
-                failure_file_waiter.wait(
-                    Bucket=failure_bucket,
-                    Key=failure_key,
-                    WaiterConfig=waiter_config._to_request_dict(),
-                )
-                failure_file_found.set()
-            except WaiterError:
-                pass
-
-
-        output_thread = threading.Thread(target=check_output_file)
-        failure_thread = threading.Thread(target=check_failure_file)
-
-        output_thread.start()
-        failure_thread.start()
-
-        while not output_file_found.is_set() and not failure_file_found.is_set():
-            time.sleep(1)
-
-        if output_file_found.is_set():
-            s3_object = self.s3_client.get_object(Bucket=output_bucket, Key=output_key)
-            result = self._handle_response(response=s3_object)
-            return result
-
-        failure_object = self.s3_client.get_object(Bucket=failure_bucket, Key=failure_key)
-        failure_response = self._handle_response(response=failure_object)
-
-        raise (
-            AsyncInferenceModelError(message=failure_response)
-            if failure_file_found.is_set()
-            else PollingTimeoutError(
-                message="Inference could still be running",
-                output_path=output_path,
-                seconds=waiter_config.delay * waiter_config.max_attempts,
-            )
-        )
-
-    def _check_output_path(self, output_path, waiter_config):
-        """Check the Amazon S3 output path for the output.
-
-        Periodically check Amazon S3 output path for async inference result.
-        Timeout automatically after max attempts reached
+            PollingTimeoutError: If both files are not found before the timeout.
         """
-        bucket, key = parse_s3_url(output_path)
-        s3_waiter = self.s3_client.get_waiter("object_exists")
-        try:
-            s3_waiter.wait(Bucket=bucket, Key=key, WaiterConfig=waiter_config._to_request_dict())
-        except WaiterError:
-            raise PollingTimeoutError(
-                message="Inference could still be running",
-                output_path=output_path,
-                seconds=waiter_config.delay * waiter_config.max_attempts,
-            )
-        s3_object = self.s3_client.get_object(Bucket=bucket, Key=key)
-        result = self._handle_response(response=s3_object)
-        return result
-
-    def _wait_for_output(self, output_path, failure_path, waiter_config):
-        """Retrieve output based on the presense of failure_path."""
-        if failure_path is not None:
-            return self._check_output_and_failure_paths(output_path, failure_path, waiter_config)
-
-        return self._check_output_path(output_path, waiter_config)
+        return self._watch_output(
+            output_path, failure_path, waiter_config, result_format=result_format, result_path=result_path
+        ).result()
 
     def invoke_async(
             self,
@@ -916,22 +980,51 @@ class SageMakerClient(ClientBase):
             input_path=None,
             inference_id=None,
             waiter_config=WaiterConfig(delay=0.1,max_attempts=15*60/0.1),
-            async_invoke=False
+            async_invoke=False,
+            input_file=None,
+            content_type=None,
+            result_format="json",
+            result_path=None
         ):
-        if data is None and input_path is None:
+        """Invoke the async endpoint and wait for the result, or return an
+        `AsyncInferenceResponse` if `async_invoke` is True.
+
+        Args:
+            data: The request, a dict sent as json, or bytes or a binary file-like object
+                sent as they are. Uploaded to `input_path` if provided.
+            input_path (str): The Amazon S3 location of the request. Without `data` and
+                `input_file`, the existing object is used as it is.
+            input_file (str): A local file to upload as the request, e.g. an audio file.
+            content_type (str): The content type of the request, guessed if not provided.
+            result_format (str): json (default), json_stream (an iterator of the documents
+                of a json lines result), bytes, stream (a file-like object) or file (downloaded
+                to `result_path`).
+        """
+        if data is None and input_path is None and input_file is None:
             raise ValueError(
-                "Please provide data or input_path Amazon S3 location to use async prediction"
+                "Please provide data, input_file or input_path Amazon S3 location to use async prediction"
             )
-        if data is not None:
-            input_path = self._upload_data_to_s3(data, input_path)
+        if result_format not in RESULT_FORMATS:
+            raise ValueError(f"result_format should be one of {RESULT_FORMATS}, got {result_format}")
+        if result_format == "file" and not result_path:
+            raise ValueError("result_path is required to download the result to a file")
+
+        if input_file is not None:
+            input_path = self._upload_file_to_s3(input_file, input_path, content_type)
+        elif data is not None:
+            input_path = self._upload_data_to_s3(data, input_path, content_type)
 
         request_options = {
             "InputLocation":input_path,
             "EndpointName":self.endpoint_name,
             "Accept":"*/*"
         }
+        if content_type:
+            request_options['ContentType'] = content_type
+        elif isinstance(data, dict):
+            request_options['ContentType'] = "application/json"
         if inference_id:
-            request_options['InferenceId']
+            request_options['InferenceId'] = inference_id
 
         response = self.client.invoke_endpoint_async(
             **request_options
@@ -942,11 +1035,17 @@ class SageMakerClient(ClientBase):
             response_async = AsyncInferenceResponse(
                 predictor_async=self,
                 output_path=output_location,
-                failure_path=failure_location
+                failure_path=failure_location,
+                result_format=result_format,
+                result_path=result_path
             )
             return response_async
         else:
             result = self._wait_for_output(
-                output_path=output_location, failure_path=failure_location, waiter_config=waiter_config
+                output_path=output_location,
+                failure_path=failure_location,
+                waiter_config=waiter_config,
+                result_format=result_format,
+                result_path=result_path
             )
         return result
@@ -23,6 +23,7 @@ from emd.utils.aws_service_utils import (
     get_current_region,
     get_pipeline_active_executions,
 )
+from emd.utils.endpoint_resolver import endpoint_resolver
 from emd.utils.logger_utils import get_logger
 from emd.utils.upload_pipeline import ziped_pipeline
 from emd.utils.aws_service_utils import get_current_region
@@ -208,6 +209,8 @@ def deploy(
         f"Model deployment pipeline execution initiated. Execution ID: {response['pipelineExecutionId']}"
     )
     execution_id = response["pipelineExecutionId"]
+    # the stack outputs change when the model is deployed again
+    endpoint_resolver.invalidate(model_stack_name)
     ret = {
         "pipeline_execution_id": response["pipelineExecutionId"],
         "model_stack_name": model_stack_name,
@@ -252,6 +255,7 @@ def deploy(
             time.sleep(10)
         deploy_time = time.time() - start_deploy_time
         ret["model_deploy_elasped_time"] = deploy_time
+        endpoint_resolver.invalidate(model_stack_name)
 
     if service_type == ServiceType.SAGEMAKER:
         ret["sagemaker_endpoint_name"] = f"{model_stack_name}-endpoint"
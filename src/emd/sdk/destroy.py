@@ -1,6 +1,7 @@
 import boto3
 import time
 from emd.utils.logger_utils import get_logger
+from emd.utils.endpoint_resolver import endpoint_resolver
 from .status import get_destroy_status
 from emd.constants import (
     EMD_STACK_NOT_EXISTS_STATUS,
@@ -61,6 +62,7 @@ def stop_pipeline_execution(
 def destroy_ecs(model_id,model_tag,stack_name):
     cf_client = boto3.client('cloudformation')
     cf_client.delete_stack(StackName=stack_name)
+    endpoint_resolver.invalidate(stack_name)
 
 def destroy(model_id:str,model_tag=MODEL_DEFAULT_TAG,waiting_until_complete=True):
     check_env_stack_exist_and_complete()
@@ -76,6 +78,7 @@ def destroy(model_id:str,model_tag=MODEL_DEFAULT_TAG,waiting_until_complete=True
 
     cf_client = boto3.client('cloudformation')
     cf_client.delete_stack(StackName=stack_name)
+    endpoint_resolver.invalidate(stack_name)
 
     logger.info(f"Delete stack initiated: {stack_name}")
     # check delete status
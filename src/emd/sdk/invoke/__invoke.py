@@ -11,7 +11,9 @@ from pathlib import Path
 from botocore.exceptions import ClientError, NoCredentialsError
 from typing_extensions import Annotated
 
-from emd.utils.line_iterator import LineIterator
+from emd.utils.line_iterator import LMILineIterator as LineIterator
+from emd.utils.aws_client_factory import get_client
+from emd.utils.serializers import json_dumps
 
 
 def get_streaming_response(response: requests.Response) -> Iterable[List[str]]:
@@ -40,7 +42,7 @@ class SageMakerClient:
         stream=False,
     ):
         self.stream = stream
-        self.client = boto3.client("runtime.sagemaker", region_name=region)
+        self.client = get_client("runtime.sagemaker", region_name=region)
         self.endpoint_name = endpoint_name
 
     def invoke(self, request):
@@ -48,7 +50,7 @@ class SageMakerClient:
         if self.stream:
             response = self.client.invoke_endpoint_with_response_stream(
                 EndpointName=self.endpoint_name,
-                Body=json.dumps(request),
+                Body=json_dumps(request),
                 ContentType="application/json",
             )
             event_stream = response["Body"]
@@ -59,7 +61,7 @@ class SageMakerClient:
         else:
             response = self.client.invoke_endpoint(
                 EndpointName=self.endpoint_name,
-                Body=json.dumps(request),
+                Body=json_dumps(request),
                 ContentType="application/json",
             )
             resp_body = response["Body"]
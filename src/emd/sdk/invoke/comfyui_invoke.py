@@ -2,7 +2,7 @@ from .invoker_base import InvokerBase
 from emd.constants import MODEL_DEFAULT_TAG
 import json
 import os
-import boto3
+from emd.utils.aws_client_factory import get_client
 
 class ComfyUIInvoker(InvokerBase):
     def __init__(self, model_id, model_tag = MODEL_DEFAULT_TAG):
@@ -29,6 +29,6 @@ class ComfyUIInvoker(InvokerBase):
             s3_video_path = "/".join(s3_output_path.split("/")[3:]) + "/LTXVideo_00001.mp4"
             prompt_id = ret.get("prompt_id", None)
             local_video_path = f"{prompt_id}.mp4"
-            boto3.client("s3").download_file(s3_bucket, s3_video_path, local_video_path)
+            get_client("s3").download_file(s3_bucket, s3_video_path, local_video_path)
             ret["local_video_path"] = local_video_path
             return ret
@@ -1,4 +1,4 @@
-from emd.utils.aws_service_utils import get_model_stack_info
+from emd.utils.endpoint_resolver import endpoint_resolver
 from emd.models import Model
 from emd.constants import MODEL_DEFAULT_TAG
 from emd.models.utils.constants import ServiceType
@@ -26,7 +26,9 @@ class InvokerBase:
             self.model_tag
         )
         self.model_stack_name = model_stack_name
-        stack_info = get_model_stack_info(self.model_stack_name)
+        stack_info = endpoint_resolver.get_stack_info(self.model_stack_name)
+        if stack_info is None:
+            raise ValueError(f"Model stack {model_stack_name} does not exist")
         parameters = stack_info.get('Parameters')
 
         if not parameters:
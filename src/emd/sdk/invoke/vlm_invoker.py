@@ -6,6 +6,7 @@ import os
 import io
 from urllib.parse import urlparse
 from rich.console import Console
+from emd.utils.aws_client_factory import get_client
 
 class VLMInvoker(InvokerBase):
     def __init__(self, model_id, model_tag = MODEL_DEFAULT_TAG):
@@ -28,8 +29,7 @@ class VLMInvoker(InvokerBase):
                 return base64.b64encode(image_file.read()).decode('utf-8')
         elif image_path.startswith("s3://"):
             # download image from s3
-            import boto3
-            s3 = boto3.client('s3')
+            s3 = get_client('s3')
             o = urlparse(image_path, allow_fragments=False)
             buffer = io.BytesIO()
             bucket,object_name = o.netloc,o.path.lstrip("/")
@@ -0,0 +1,99 @@
+"""
+Process-wide cache of boto3 sessions and clients.
+
+Creating a session or a client costs hundreds of milliseconds (loading the service
+models, resolving credentials) and every new client opens new TLS connections, so the
+sdk clients, invokers and utils share the clients created here. Clients are thread safe,
+sessions are not, so sessions are only used under the lock.
+
+The botocore config can be tuned with environment variables:
+    EMD_BOTO_MAX_POOL_CONNECTIONS: connections kept per client (default 64)
+    EMD_BOTO_RETRY_MODE: botocore retry mode (default adaptive)
+    EMD_BOTO_MAX_ATTEMPTS: attempts per call, including the first one (default 5)
+"""
+import os
+import threading
+import weakref
+from typing import Optional
+
+import boto3
+from botocore.config import Config
+
+DEFAULT_MAX_POOL_CONNECTIONS = 64
+DEFAULT_RETRY_MODE = "adaptive"
+DEFAULT_MAX_ATTEMPTS = 5
+
+_lock = threading.RLock()
+# (profile_name, region_name) -> session
+_sessions = {}
+# session -> {(service_name, region_name): client}
+_clients = weakref.WeakKeyDictionary()
+
+
+def get_boto_config(config:Optional[Config] = None) -> Config:
+    """The botocore config of the shared clients, merged with `config`."""
+    boto_config = Config(
+        max_pool_connections=int(
+            os.environ.get("EMD_BOTO_MAX_POOL_CONNECTIONS", DEFAULT_MAX_POOL_CONNECTIONS)
+        ),
+        retries={
+            "mode": os.environ.get("EMD_BOTO_RETRY_MODE", DEFAULT_RETRY_MODE),
+            "max_attempts": int(os.environ.get("EMD_BOTO_MAX_ATTEMPTS", DEFAULT_MAX_ATTEMPTS)),
+        },
+        tcp_keepalive=True,
+    )
+    if config is not None:
+        boto_config = boto_config.merge(config)
+    return boto_config
+
+
+def _default_region_name() -> Optional[str]:
+    return os.environ.get("AWS_REGION") or os.environ.get("AWS_DEFAULT_REGION")
+
+
+def get_session(profile_name:Optional[str] = None, region_name:Optional[str] = None) -> boto3.Session:
+    """The shared session of the profile and region, the default profile is `AWS_PROFILE`,
+    which `emd config set-default-profile-name` sets."""
+    profile_name = profile_name or os.environ.get("AWS_PROFILE")
+    region_name = region_name or _default_region_name()
+    key = (profile_name, region_name)
+    with _lock:
+        session = _sessions.get(key)
+        if session is None:
+            session = boto3.Session(profile_name=profile_name, region_name=region_name)
+            _sessions[key] = session
+        return session
+
+
+def get_client(
+        service_name:str,
+        region_name:Optional[str] = None,
+        profile_name:Optional[str] = None,
+        session:Optional[boto3.Session] = None,
+        config:Optional[Config] = None
+    ):
+    """The shared client of the service. Clients of a `session` passed in are cached with
+    the session. A client with a custom `config` is created every time and not shared."""
+    if session is None:
+        session = get_session(profile_name=profile_name, region_name=region_name)
+    region_name = region_name or session.region_name
+    with _lock:
+        if config is not None:
+            return session.client(
+                service_name, region_name=region_name, config=get_boto_config(config)
+            )
+        clients = _clients.setdefault(session, {})
+        client = clients.get((service_name, region_name))
+        if client is None:
+            client = session.client(
+                service_name, region_name=region_name, config=get_boto_config()
+            )
+            clients[(service_name, region_name)] = client
+        return client
+
+
+def clear_clients():
+    """Drop the cached sessions and clients, e.g. after the credentials changed."""
+    with _lock:
+        _sessions.clear()
+        _clients.clear()
@@ -0,0 +1,154 @@
+"""
+Cache of the model stacks the sdk clients and invokers resolve their endpoints from.
+
+Resolving a model to its SageMaker endpoint name, ALB DNS name or stack parameters
+takes CloudFormation DescribeStacks calls, which are slow and throttled, so the outputs
+and parameters of the stacks are cached in memory and in `~/.emd/endpoint_cache.json`,
+which later processes on the machine reuse. Entries expire after a TTL and are
+invalidated when a model is deployed or destroyed.
+
+Environment variables:
+    EMD_ENDPOINT_CACHE_TTL: seconds an entry is valid, 0 disables the cache (default 300)
+    EMD_ENDPOINT_DISK_CACHE: set to 0 to keep the cache in memory only (default 1)
+"""
+import contextlib
+import json
+import os
+import threading
+import time
+from typing import Optional
+
+from botocore.exceptions import ClientError
+
+try:
+    import fcntl
+except ImportError:
+    # e.g. Windows, where concurrent updates of the file may lose entries
+    fcntl = None
+
+from emd.constants import EMD_ENDPOINT_CACHE_PATH
+
+from .aws_client_factory import get_client, get_session
+from .logger_utils import get_logger
+
+logger = get_logger(__name__)
+
+DEFAULT_TTL = 300
+# the stacks whose outputs and parameters do not change until the next deploy or destroy
+CACHEABLE_STACK_STATUSES = ("CREATE_COMPLETE", "UPDATE_COMPLETE", "UPDATE_ROLLBACK_COMPLETE")
+
+
+class EndpointResolver:
+    def __init__(self, cache_path:str = EMD_ENDPOINT_CACHE_PATH, ttl:Optional[float] = None, disk_cache:Optional[bool] = None):
+        self.cache_path = os.path.expanduser(cache_path)
+        self.ttl = float(os.environ.get("EMD_ENDPOINT_CACHE_TTL", DEFAULT_TTL)) if ttl is None else ttl
+        if disk_cache is None:
+            disk_cache = os.environ.get("EMD_ENDPOINT_DISK_CACHE", "1").lower() in ("true", "1", "t")
+        self.disk_cache = disk_cache
+        self._lock = threading.Lock()
+        # cache key -> {"stack_info": ..., "cached_at": ...}
+        self._entries = {}
+
+    @staticmethod
+    def _get_cache_key(model_stack_name:str, region_name:Optional[str] = None) -> str:
+        # stacks of the same name can exist in several accounts/regions
+        session = get_session(region_name=region_name)
+        return f"{session.profile_name}/{session.region_name}/{model_stack_name}"
+
+    def _is_valid(self, entry:Optional[dict]) -> bool:
+        return entry is not None and time.time() - entry["cached_at"] < self.ttl
+
+    def _read_disk(self) -> dict:
+        try:
+            with open(self.cache_path, encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logger.debug(f"ignore endpoint cache {self.cache_path}: {e}")
+            return {}
+
+    @contextlib.contextmanager
+    def _disk_lock(self):
+        """Serializes the updates of the file across processes."""
+        if fcntl is None:
+            yield
+            return
+        os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+        fd = os.open(f"{self.cache_path}.lock", os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(fd)
+
+    def _update_disk(self, update):
+        """Apply `update` to the entries in the file. The file is read again under a lock,
+        so that the entries other processes added or invalidated in the meantime are kept."""
+        if not self.disk_cache:
+            return
+        try:
+            with self._disk_lock():
+                entries = self._read_disk()
+                update(entries)
+                entries = {key: entry for key, entry in entries.items() if self._is_valid(entry)}
+                # replace atomically, other processes may read the file at the same time
+                tmp_path = f"{self.cache_path}.{os.getpid()}.tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(entries, f)
+                os.replace(tmp_path, self.cache_path)
+        except OSError as e:
+            logger.debug(f"failed to write endpoint cache {self.cache_path}: {e}")
+
+    def get_stack_info(self, model_stack_name:str, region_name:Optional[str] = None) -> Optional[dict]:
+        """The `Parameters` and `Outputs` of the stack in `region_name` (the default region if
+        None), None if the stack does not exist."""
+        key = self._get_cache_key(model_stack_name, region_name)
+        if self.ttl > 0:
+            with self._lock:
+                entry = self._entries.get(key)
+                if not self._is_valid(entry) and self.disk_cache:
+                    entry = self._read_disk().get(key)
+                    if self._is_valid(entry):
+                        self._entries[key] = entry
+            if self._is_valid(entry):
+                return entry["stack_info"]
+
+        try:
+            stack = get_client("cloudformation", region_name=region_name).describe_stacks(
+                StackName=model_stack_name
+            )["Stacks"][0]
+        except ClientError as e:
+            if e.response["Error"]["Code"] == "ValidationError" and "does not exist" in str(e):
+                self.invalidate(model_stack_name)
+                return None
+            raise
+        stack_info = {
+            "StackName": stack["StackName"],
+            "StackStatus": stack["StackStatus"],
+            "Parameters": stack.get("Parameters", []),
+            "Outputs": stack.get("Outputs", []),
+        }
+        # stacks in progress, failed or being deleted are looked up again on the next call
+        if self.ttl > 0 and stack_info["StackStatus"] in CACHEABLE_STACK_STATUSES:
+            entry = {"stack_info": stack_info, "cached_at": time.time()}
+            with self._lock:
+                self._entries[key] = entry
+                self._update_disk(lambda entries: entries.__setitem__(key, entry))
+        return stack_info
+
+    def invalidate(self, model_stack_name:Optional[str] = None):
+        """Drop the entries of the stack, or all entries if `model_stack_name` is None."""
+        def _invalidate(entries:dict):
+            if model_stack_name is None:
+                entries.clear()
+                return
+            for key in [key for key in entries if key.endswith(f"/{model_stack_name}")]:
+                del entries[key]
+
+        with self._lock:
+            _invalidate(self._entries)
+            self._update_disk(_invalidate)
+
+
+endpoint_resolver = EndpointResolver()
@@ -26,13 +26,241 @@
 # --  -----------------------------------------------------------------
 # --
 
-import io
+import codecs
 import re
+from typing import Any, AsyncIterator, Iterator, Optional, Sequence, Tuple
+
+from .serializers import json_loads as _json_loads
 
 NEWLINE = re.compile(r'\\n')
 DOUBLE_NEWLINE = re.compile(r'\\n\\n')
 
+SSE_DATA_PREFIX = b"data:"
+SSE_DONE = b"[DONE]"
+# other fields of server-sent events, ignored
+SSE_FIELD_PREFIXES = (b"event:", b"id:", b"retry:")
+
+
+def get_chunk_bytes(chunk: Any) -> Optional[bytes]:
+    """The bytes of a chunk of a response stream: a SageMaker `PayloadPart` event or a
+    raw http chunk. None for other events."""
+    if type(chunk) is dict:
+        payload = chunk.get("PayloadPart")
+        # None for unknown event types
+        return payload["Bytes"] if payload is not None else None
+    if isinstance(chunk, bytes):
+        return chunk
+    if isinstance(chunk, (bytearray, memoryview)):
+        # the buffer of the chunk may be reused by the producer
+        return bytes(chunk)
+    if isinstance(chunk, str):
+        return chunk.encode("utf-8")
+    raise TypeError(f"unsupported chunk type: {type(chunk)}")
+
+
+class LineBuffer:
+    """
+    Incremental splitter of a byte stream into lines.
+
+    Each chunk is searched for newlines once and split in C. The complete lines are
+    sliced out of the chunk, only the pieces of the unfinished last line are kept and
+    joined once the line is complete, so every byte is copied once, the memory is bounded
+    by the longest line instead of the length of the stream, and a long line arriving in
+    many small chunks is not scanned again and again. A trailing `\r` is kept, json and
+    the sse framing ignore it.
+    """
+
+    __slots__ = ("pieces",)
+
+    MAX_PIECES = 64
+
+    def __init__(self) -> None:
+        self.pieces = []
+
+    def feed(self, data: bytes) -> Sequence[bytes]:
+        """The lines completed by `data`, without the newlines."""
+        newline = data.find(b"\n")
+        pieces = self.pieces
+        if newline < 0:
+            pieces.append(data)
+            if len(pieces) >= self.MAX_PIECES:
+                # a long line in small chunks, appending to a bytearray is amortized O(1)
+                head = pieces[0] if isinstance(pieces[0], bytearray) else bytearray(pieces[0])
+                for piece in pieces[1:]:
+                    head += piece
+                pieces[:] = [head]
+            return ()
+        if newline == len(data) - 1 and not pieces:
+            # fast path, a chunk with exactly one line
+            return (data[:-1],)
+        lines = data.split(b"\n")
+        if pieces:
+            pieces.append(lines[0])
+            lines[0] = b"".join(pieces)
+            pieces.clear()
+        last = lines.pop()
+        if last:
+            pieces.append(last)
+        return lines
+
+    def flush(self) -> Optional[bytes]:
+        """The last line of the stream, if it does not end with a newline."""
+        if not self.pieces:
+            return None
+        line = b"".join(self.pieces)
+        self.pieces.clear()
+        return line
+
+
+def _iter_lines(stream: Any) -> Iterator[bytes]:
+    line_buffer = LineBuffer()
+    for chunk in stream:
+        data = get_chunk_bytes(chunk)
+        if data:
+            yield from line_buffer.feed(data)
+    line = line_buffer.flush()
+    if line is not None:
+        yield line
+
+
+async def _aiter_lines(stream: AsyncIterator) -> AsyncIterator[bytes]:
+    line_buffer = LineBuffer()
+    async for chunk in stream:
+        data = get_chunk_bytes(chunk)
+        if data:
+            for line in line_buffer.feed(data):
+                yield line
+    line = line_buffer.flush()
+    if line is not None:
+        yield line
+
+
 class LineIterator:
+    """
+    Iterates over the lines of a byte stream, without the line endings.
+
+    The stream can be the event stream of InvokeEndpointWithResponseStream, whose
+    `PayloadPart` events are not guaranteed to contain whole lines:
+
+    {'PayloadPart': {'Bytes': b'{"outputs": '}}
+    {'PayloadPart': {'Bytes': b'[" problem"]}\n'}}
+
+    or an iterator of raw http chunks.
+
+    For more details see:
+    https://aws.amazon.com/blogs/machine-learning/elevating-the-generative-ai-experience-introducing-streaming-support-in-amazon-sagemaker-hosting/
+    """
+
+    def __init__(self, stream: Any) -> None:
+        self.lines = _iter_lines(stream)
+
+    def __iter__(self) -> Iterator[bytes]:
+        return self.lines
+
+    def __next__(self) -> bytes:
+        return next(self.lines)
+
+
+class AsyncLineIterator:
+    """
+    Asynchronous version of `LineIterator`, over an async iterator of events or chunks.
+    """
+
+    def __init__(self, stream: AsyncIterator) -> None:
+        self.lines = _aiter_lines(stream)
+
+    def __aiter__(self) -> AsyncIterator[bytes]:
+        return self.lines
+
+    async def __anext__(self) -> bytes:
+        return await self.lines.__anext__()
+
+
+class JsonStreamDecoder:
+    """
+    Decodes the lines of a stream of json documents, either one document per line (the
+    format of the SageMaker endpoints of emd), or server-sent events (the format of the
+    ECS services of emd and OpenAI compatible servers):
+
+    data: {"choices": [...]}
+
+    : comment
+    data: [DONE]
+
+    `feed_line` returns (done, document), the document is None if the line does not
+    complete one. Empty documents are dropped.
+    """
+
+    def __init__(self) -> None:
+        self.data_lines = []
+
+    def _decode(self, data: bytes) -> Tuple[bool, Any]:
+        if data.strip() == SSE_DONE:
+            return True, None
+        document = _json_loads(data)
+        return False, document or None
+
+    def feed_line(self, line: bytes) -> Tuple[bool, Any]:
+        if line.startswith(SSE_DATA_PREFIX):
+            data = line[len(SSE_DATA_PREFIX):]
+            self.data_lines.append(data[1:] if data.startswith(b" ") else data)
+            return False, None
+        if not line.strip():
+            # the end of an event
+            return self.flush()
+        if line.startswith(b":") or line.startswith(SSE_FIELD_PREFIXES):
+            return False, None
+        # a json line
+        return self._decode(line)
+
+    def flush(self) -> Tuple[bool, Any]:
+        if not self.data_lines:
+            return False, None
+        data = b"\n".join(self.data_lines)
+        self.data_lines = []
+        return self._decode(data)
+
+
+def iter_json_stream(stream: Any) -> Iterator[Any]:
+    """The json documents of a stream of `PayloadPart` events or http chunks, see `JsonStreamDecoder`."""
+    decoder = JsonStreamDecoder()
+    for line in LineIterator(stream):
+        if line[:1] == b"{":
+            # fast path of json lines
+            document = _json_loads(line)
+            if document:
+                yield document
+            continue
+        done, document = decoder.feed_line(line)
+        if done:
+            return
+        if document is not None:
+            yield document
+    done, document = decoder.flush()
+    if document is not None:
+        yield document
+
+
+async def aiter_json_stream(stream: AsyncIterator) -> AsyncIterator[Any]:
+    """Asynchronous version of `iter_json_stream`."""
+    decoder = JsonStreamDecoder()
+    async for line in AsyncLineIterator(stream):
+        if line[:1] == b"{":
+            document = _json_loads(line)
+            if document:
+                yield document
+            continue
+        done, document = decoder.feed_line(line)
+        if done:
+            return
+        if document is not None:
+            yield document
+    done, document = decoder.flush()
+    if document is not None:
+        yield document
+
+
+class LMILineIterator:
     """
     A helper class for parsing the byte stream from Llama 2 model inferenced with LMI Container.
 
@@ -44,45 +272,37 @@ class LineIterator:
     b'How are you?"}'
     ...
 
-    For each iteration, we just read the incremental part and seek for the new position for the next iteration till the end of the line.
-
+    Each piece of a line is returned as text as soon as it arrives, without the
+    `{"generated_text": "` and `"}` wrapper, so the output is incremental.
     """
 
+    start_sequence = b'{"generated_text": "'
+    stop_sequence = b'"}'
+
     def __init__(self, stream):
-        self.byte_iterator = iter(stream)
-        self.buffer = io.BytesIO()
-        self.read_pos = 0
+        self.lines = self._iter_text(stream)
 
     def __iter__(self):
         return self
 
-    def __next__(self):
-        start_sequence = b'{"generated_text": "'
-        stop_sequence = b'"}'
-        new_line = '\n'
-        double_new_line = '\n\n'
-        while True:
-            self.buffer.seek(self.read_pos)
-            line = self.buffer.readline()
-            if line:
-                self.read_pos += len(line)
-                if line.startswith(start_sequence):# in :
-                    line = line.lstrip(start_sequence)
-
-                if line.endswith(stop_sequence):
-                    line =line.rstrip(stop_sequence)
-                line = line.decode('utf-8')
-                line = NEWLINE.sub(new_line, line)
-                line = DOUBLE_NEWLINE.sub(double_new_line, line)
-                return line
-            try:
-                chunk = next(self.byte_iterator)
-            except StopIteration:
-                if self.read_pos < self.buffer.getbuffer().nbytes:
-                    continue
-                raise
-            if 'PayloadPart' not in chunk:
-                print('Unknown event type:' + chunk)
+    def _iter_text(self, stream):
+        # a character may be split across chunks
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        for chunk in stream:
+            data = get_chunk_bytes(chunk)
+            if data is None:
                 continue
-            self.buffer.seek(0, io.SEEK_END)
-            self.buffer.write(chunk['PayloadPart']['Bytes'])
+            pieces = data.split(b"\n")
+            # the unterminated tail is returned too, its line is continued by the next chunk
+            for piece in [piece + b"\n" for piece in pieces[:-1]] + ([pieces[-1]] if pieces[-1] else []):
+                if piece.startswith(self.start_sequence):
+                    piece = piece[len(self.start_sequence):]
+                if piece.endswith(self.stop_sequence):
+                    piece = piece[:-len(self.stop_sequence)]
+                text = decoder.decode(piece)
+                text = NEWLINE.sub('\n', text)
+                text = DOUBLE_NEWLINE.sub('\n\n', text)
+                yield text
+
+    def __next__(self):
+        return next(self.lines)
@@ -0,0 +1,66 @@
+"""
+Serialization of the requests and responses of the sdk clients.
+
+Requests are encoded as compact json (no indentation, minimal separators, utf-8
+instead of `\\uXXXX` escapes), with orjson if it is installed. Bodies that are already
+encoded (bytes) are sent as they are. A client can be given another `Serializer`, e.g.
+for a model that does not take json.
+"""
+import json
+from typing import Any, Union
+
+try:
+    # optional, several times faster than the json module
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def json_dumps(obj:Any, sort_keys:bool = False) -> bytes:
+    """Compact json encoding of `obj`, as utf-8 bytes. With `sort_keys`, equal objects
+    have the same encoding."""
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        try:
+            return orjson.dumps(obj, option=option)
+        except TypeError:
+            # types orjson does not support, e.g. Decimal or integers over 64 bits
+            pass
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), sort_keys=sort_keys).encode("utf-8")
+
+
+if orjson is not None:
+    json_loads = orjson.loads
+else:
+    json_loads = json.loads
+
+
+class Serializer:
+    """Encodes requests and decodes responses of a content type."""
+
+    content_type = "application/octet-stream"
+    accept = "application/json"
+
+    def serialize(self, data:Any) -> bytes:
+        raise NotImplementedError
+
+    def deserialize(self, data:Union[bytes, bytearray]) -> Any:
+        raise NotImplementedError
+
+
+class JSONSerializer(Serializer):
+    content_type = "application/json"
+
+    def serialize(self, data:Any) -> bytes:
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            # already encoded
+            return bytes(data) if not isinstance(data, bytes) else data
+        return json_dumps(data)
+
+    def deserialize(self, data:Union[bytes, bytearray]) -> Any:
+        return json_loads(data)
+
+
+DEFAULT_SERIALIZER = JSONSerializer()
@@ -1,7 +1,6 @@
 from abc import ABC, abstractmethod
-from typing import Iterable, List
+from typing import Iterable, List, AsyncIterable
 from emd.models import Model,Engine
-from typing import Iterable, List
 import os
 import time
 import logging
@@ -9,8 +8,11 @@ import subprocess
 import signal
 import traceback
 import json
+import re
 import socket
 import threading
+import copy
+import contextlib
 
 
 # import httpx
@@ -19,14 +21,135 @@ from emd.models import Engine
 from emd.utils.accelerator_utils import get_gpu_num,get_neuron_core_num
 
 
-from utils.common import download_dir_from_s3_by_s5cmd
+from utils.model_fetcher import download_model_from_s3
 # import torch
 from emd.constants import EMD_MODELS_S3_KEY_TEMPLATE
 from emd.utils.logger_utils import get_logger
+from emd.utils.accelerator_utils import check_cuda_exists
 
 logger = get_logger(__name__)
 
+# matches the first `"model": "..."` member of a raw json request body. Quotes inside
+# json strings are always escaped, so this can not match text in message contents.
+MODEL_FIELD_PATTERN = re.compile(rb'"model"\s*:\s*"(?:[^"\\]|\\.)*"')
+JSON_STRING_PATTERN = re.compile(rb'"(?:[^"\\]|\\.)*"')
+
+
+def get_json_depth(body:bytes, pos:int) -> int:
+    """The number of objects and arrays of a raw json body open at `pos`, 1 for the members
+    of the top level object."""
+    # brackets inside strings do not count
+    prefix = JSON_STRING_PATTERN.sub(b'""', body[:pos])
+    return prefix.count(b"{") + prefix.count(b"[") - prefix.count(b"}") - prefix.count(b"]")
+
+
+class EngineProcessSupervisor:
+    """Runs the engine server command as a subprocess in its own process group.
+
+    The output of the process is forwarded to the logger. When the process exits
+    unexpectedly, it is restarted with exponential backoff, and `healthy` is False
+    until `wait_ready` (e.g. polling the server until it answers) returns.
+    """
+    # a process which ran longer than this is considered stable, its restart count is reset
+    stable_run_seconds = 300
+
+    def __init__(self, command:str, name:str, max_restarts:int=5, max_backoff:float=60, wait_ready=None):
+        self.command = command
+        self.name = name
+        self.max_restarts = max_restarts
+        self.max_backoff = max_backoff
+        self.wait_ready = wait_ready
+        self.proc = None
+        self.healthy = False
+        self.restarts = 0
+        self._stopping = threading.Event()
+        # held while spawning and when stopping, so that stop() sees every process spawned
+        self._spawn_lock = threading.Lock()
+        self._monitor_thread = None
+
+    def _spawn(self):
+        self.proc = subprocess.Popen(
+            self.command,
+            shell=True,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            # own process group, so that the engine and its workers are signaled together
+            start_new_session=True
+        )
+        self.start_time = time.monotonic()
+        logger.info(f"{self.name} server started, pid: {self.proc.pid}")
+        threading.Thread(target=self._forward_output, args=(self.proc,), daemon=True).start()
+
+    def _forward_output(self, proc):
+        for line in iter(proc.stdout.readline, b""):
+            logger.info(f"[{self.name}] {line.decode('utf-8', errors='replace').rstrip()}")
+        proc.stdout.close()
+
+    def start(self):
+        self._spawn()
+        self._monitor_thread = threading.Thread(target=self._monitor, daemon=True)
+        self._monitor_thread.start()
+
+    def is_alive(self):
+        return self.proc is not None and self.proc.poll() is None
+
+    def wait_until_ready(self):
+        if self.wait_ready is not None:
+            self.wait_ready()
+        self.healthy = True
+
+    def _monitor(self):
+        while not self._stopping.is_set():
+            returncode = self.proc.wait()
+            if self._stopping.is_set():
+                return
+            self.healthy = False
+            logger.error(f"{self.name} server exited with code {returncode}")
+            if time.monotonic() - self.start_time > self.stable_run_seconds:
+                self.restarts = 0
+            if self.restarts >= self.max_restarts:
+                logger.error(f"{self.name} server exited {self.restarts + 1} times, giving up")
+                return
+            backoff = min(2 ** self.restarts, self.max_backoff)
+            self.restarts += 1
+            logger.info(f"restarting {self.name} server in {backoff}s, restart: {self.restarts}/{self.max_restarts}")
+            if self._stopping.wait(backoff):
+                return
+            with self._spawn_lock:
+                # stop() may have been called since the wait returned
+                if self._stopping.is_set():
+                    return
+                self._spawn()
+            try:
+                self.wait_until_ready()
+            except Exception as e:
+                # the process exited again, handled by the next iteration
+                logger.error(f"{self.name} server failed to restart: {e}")
+
+    def stop(self, timeout:float=30):
+        with self._spawn_lock:
+            self._stopping.set()
+            proc = self.proc
+        self.healthy = False
+        if proc is None or proc.poll() is not None:
+            return
+        pgid = os.getpgid(proc.pid)
+        logger.info(f"stopping {self.name} server, pgid: {pgid}")
+        os.killpg(pgid, signal.SIGTERM)
+        try:
+            proc.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            logger.warning(f"{self.name} server did not exit in {timeout}s, killing it")
+            os.killpg(pgid, signal.SIGKILL)
+            proc.wait()
+
 class BackendBase(ABC):
+    # backends which implement `ainvoke` are served on the event loop,
+    # the others fall back to `invoke` in the threadpool
+    support_async = False
+    # backends which implement `apassthrough` can relay raw request/response bytes
+    enable_passthrough = False
+
     def __init__(self,model:Model):
         self.execute_model: Model = model
 
@@ -38,9 +161,33 @@ class BackendBase(ABC):
     def invoke(self, request):
         ...
 
+    async def ainvoke(self, request):
+        raise NotImplementedError("This backend does not support async invoke.")
+
+    def get_pool_stats(self):
+        return {}
+
+    def get_warmup_stats(self):
+        return []
+
+    def is_healthy(self):
+        return True
+
+    def affinity(self, key:str):
+        # requests invoked in this context should reuse the engine state of requests with the same key
+        return contextlib.nullcontext()
+
+    def stop(self):
+        pass
+
 
 class OpenAICompitableProxyBackendBase(BackendBase):
     server_port = "8000"
+    support_async = True
+    # backends which can run several engine servers, each on its own port and GPUs
+    support_replicas = True
+    # the replica a copy of the backend creates the start command of, see create_replica_start_command
+    replica = None
 
     @property
     def base_url(self):
@@ -52,16 +199,14 @@ class OpenAICompitableProxyBackendBase(BackendBase):
               *args,
               **kwargs
         )
-        from openai import OpenAI
-        self.client = OpenAI(
-            base_url=self.base_url,
-            api_key="NOT SET"
-        )
         self.model_id = self.execute_model.model_id
         self.model_s3_bucket = self.execute_model.executable_config.model_s3_bucket
         self.model_files_s3_path = self.execute_model.model_files_s3_path
         self.service_type = self.execute_model.executable_config.current_service.service_type
         self.instance_type = self.execute_model.executable_config.current_instance.instance_type
+        self.model_fetch_concurrency = self.execute_model.executable_config.current_engine.model_fetch_concurrency
+        self.model_fetch_part_size_mb = self.execute_model.executable_config.current_engine.model_fetch_part_size_mb
+        self.verify_model_files = self.execute_model.executable_config.current_engine.verify_model_files
         self.api_key = self.execute_model.executable_config.current_engine.api_key
         self.cli_args = self.execute_model.executable_config.current_engine.cli_args
         self.default_cli_args = self.execute_model.executable_config.current_engine.default_cli_args
@@ -69,11 +214,109 @@ class OpenAICompitableProxyBackendBase(BackendBase):
         self.custom_neuron_core_num = self.execute_model.executable_config.current_engine.custom_neuron_core_num
         self.environment_variables = self.execute_model.executable_config.current_engine.environment_variables
         self.engine_type = self.execute_model.executable_config.current_engine.engine_type
+        self.enable_passthrough = self.execute_model.executable_config.current_engine.enable_passthrough
+        self.server_uds_path = self.execute_model.executable_config.current_engine.server_uds_path
+        self.http_keepalive_expiry = self.execute_model.executable_config.current_engine.http_keepalive_expiry
+        self.enable_warmup = self.execute_model.executable_config.current_engine.enable_warmup
+        self.warmup_prompt_lengths = self.execute_model.executable_config.current_engine.warmup_prompt_lengths
+        self.warmup_max_tokens = self.execute_model.executable_config.current_engine.warmup_max_tokens
+        self.readiness_poll_min_interval = self.execute_model.executable_config.current_engine.readiness_poll_min_interval
+        self.readiness_poll_max_interval = self.execute_model.executable_config.current_engine.readiness_poll_max_interval
+        self.warmup_stats = []
+        self.limit_concurrency = getattr(self.execute_model.executable_config.current_framework, "limit_concurrency", 1000)
         # self.gpu_num = torch.cuda.device_count()
         self.model_type = self.execute_model.model_type
-        self.proc = None
+        self.max_server_restarts = self.execute_model.executable_config.current_engine.max_server_restarts
+        self.num_replicas = self.execute_model.executable_config.current_engine.num_replicas
+        self.affinity_max_outstanding = self.execute_model.executable_config.current_engine.affinity_max_outstanding
+        self.replicas = self.create_replicas()
+        self.create_http_clients()
+
+    def create_replicas(self):
+        from backend.replicas import EngineReplica
+        num_replicas = self.num_replicas
+        if num_replicas > 1 and not (self.support_replicas and check_cuda_exists()):
+            logger.warning(f"{self.engine_type} engine on {self.instance_type} does not support replicas, starting one server")
+            num_replicas = 1
+        if num_replicas == 1:
+            return [EngineReplica(0, int(self.server_port), uds_path=self.server_uds_path)]
+        gpus_per_replica = self.gpu_num // num_replicas
+        if gpus_per_replica < 1:
+            raise ValueError(f"num_replicas: {num_replicas} is larger than the number of gpus: {self.gpu_num}")
+        replicas = []
+        for i in range(num_replicas):
+            replicas.append(EngineReplica(
+                i,
+                int(self.server_port) + i,
+                uds_path=f"{self.server_uds_path}.{i}" if self.server_uds_path else None,
+                gpu_ids=list(range(i * gpus_per_replica, (i + 1) * gpus_per_replica))
+            ))
+        logger.info(f"{num_replicas} replicas of {self.engine_type} server, {gpus_per_replica} gpus each")
+        return replicas
+
+    def create_http_clients(self):
+        import httpx
+        from openai import OpenAI, AsyncOpenAI
+        from backend.replicas import ReplicaRouter, RoutingTransport, AsyncRoutingTransport
+        # one connection pool per engine server for every request to it: inference,
+        # health checks and model listing. It is sized to the concurrency limit of the
+        # framework, so that every admitted request can keep its connection alive.
+        limits = httpx.Limits(
+            max_connections=self.limit_concurrency,
+            max_keepalive_connections=self.limit_concurrency,
+            keepalive_expiry=self.http_keepalive_expiry
+        )
+        timeout = httpx.Timeout(600, connect=5)
+        for replica in self.replicas:
+            replica.transport = httpx.HTTPTransport(limits=limits, uds=replica.uds_path)
+            replica.async_transport = httpx.AsyncHTTPTransport(limits=limits, uds=replica.uds_path)
+        # requests are sent to the replica with the least outstanding requests
+        self.router = ReplicaRouter(self.replicas, affinity_max_outstanding=self.affinity_max_outstanding)
+        self.transport = RoutingTransport(self.router)
+        self.async_transport = AsyncRoutingTransport(self.router)
+        self.http_client = httpx.Client(
+            base_url=self.base_url,
+            transport=self.transport,
+            timeout=timeout
+        )
+        self.async_http_client = httpx.AsyncClient(
+            base_url=self.base_url,
+            transport=self.async_transport,
+            timeout=timeout
+        )
+        self.client = OpenAI(
+            base_url=self.base_url,
+            api_key="NOT SET",
+            http_client=self.http_client
+        )
+        self.async_client = AsyncOpenAI(
+            base_url=self.base_url,
+            api_key="NOT SET",
+            http_client=self.async_http_client
+        )
+
+    def get_pool_stats(self):
+        stats = {"max_connections": self.limit_concurrency}
+        for name, routing_transport in [("sync", self.transport), ("async", self.async_transport)]:
+            # requests sent to the engine whose response is not closed yet
+            stats[name] = {"connections": 0, "active": 0, "idle": 0, "requests": routing_transport.in_flight}
+            for replica in self.replicas:
+                transport = replica.transport if name == "sync" else replica.async_transport
+                # the connections are internals of httpx/httpcore, empty if they change
+                connections = list(getattr(getattr(transport, "_pool", None), "connections", None) or [])
+                idle = sum(1 for connection in connections if getattr(connection, "is_idle", lambda: False)())
+                stats[name]["connections"] += len(connections)
+                stats[name]["active"] += len(connections) - idle
+                stats[name]["idle"] += idle
+        stats["replicas"] = [replica.get_stats() for replica in self.replicas]
+        return stats
 
 
+    @property
+    def served_model_name(self):
+        # the model name the engine server expects in the request body
+        return self.model_id
+
     @property
     def gpu_num(self):
         if self.custom_gpu_num is not None:
@@ -89,46 +332,98 @@ class OpenAICompitableProxyBackendBase(BackendBase):
     def create_proxy_server_start_command(self,model_path):
         raise NotImplementedError("This method should be implemented by subclasses.")
 
-    def wait_until_server_start(self,thread:threading.Thread,host,port):
+    def readiness_intervals(self):
+        # poll at sub-second intervals first, then back off while a large model is still loading
+        interval = self.readiness_poll_min_interval
+        while True:
+            yield interval
+            interval = min(interval * 2, self.readiness_poll_max_interval)
+
+    def wait_until_server_start(self,process:EngineProcessSupervisor,host,port):
+        import httpx
 
         def check_server_status(host, port):
+            # any http response means the server is listening, the request goes
+            # through the shared transport so that unix domain sockets are covered too
             try:
-                # 创建一个 socket 对象
-                sock = socket.create_connection((host, port), timeout=5)
-                sock.close()
+                self.http_client.get("/models", timeout=5)
                 logger.info(f"server {host}:{port} ready.")
                 return True
-            except (socket.timeout, ConnectionRefusedError):
+            except httpx.TransportError:
                 logger.info(f"server {host}:{port} starting...")
             except Exception as e:
                 logger.info(f"error：{str(e)}")
             return False
 
+        intervals = self.readiness_intervals()
         while True:
             if check_server_status(host,port):
                 break
-            if not thread.is_alive():
+            if not process.is_alive():
                 raise RuntimeError('openai server failed to start.')
-            time.sleep(5)
+            time.sleep(next(intervals))
 
-    def check_model_serve_ready(self,thread:threading.Thread,host,port):
+    def check_model_serve_ready(self,process:EngineProcessSupervisor,host,port):
         self.wait_until_server_start(
-            thread,
+            process,
             host,
             port
         )
 
-    def start_server(self, server_start_command):
+    def supervise_server(self, server_start_command, ready_check, replica=None) -> EngineProcessSupervisor:
+        """Start the server of `replica` (the first one by default), call `wait_until_ready` on the result."""
+        replica = replica or self.replicas[0]
         logger.info(f"Starting {self.engine_type} server with command: {server_start_command}")
-        t = threading.Thread(target=os.system,args=(server_start_command,),daemon=True)
-        t.start()
-        self.check_model_serve_ready(
-            t,
-            "127.0.0.1",
-            self.server_port
+        name = self.engine_type if len(self.replicas) == 1 else f"{self.engine_type}-{replica.index}"
+        supervisor = EngineProcessSupervisor(
+            server_start_command,
+            name=name,
+            max_restarts=self.max_server_restarts
         )
+
+        def wait_ready():
+            # readiness requests must reach this replica
+            with self.router.pin(replica.index):
+                ready_check(supervisor, "127.0.0.1", replica.port)
+        supervisor.wait_ready = wait_ready
+        supervisor.start()
+        replica.supervisor = supervisor
+        return supervisor
+
+    def start_server(self, server_start_command):
+        self.supervise_server(server_start_command, self.check_model_serve_ready).wait_until_ready()
         return
 
+    def create_replica_start_command(self, model_path, replica):
+        # the start command of each backend is created for the port, unix socket and gpus of the replica
+        replica_backend = copy.copy(self)
+        replica_backend.replica = replica
+        replica_backend.server_port = str(replica.port)
+        replica_backend.server_uds_path = replica.uds_path
+        replica_backend.custom_gpu_num = len(replica.gpu_ids)
+        server_start_command = replica_backend.create_proxy_server_start_command(model_path)
+        cuda_visible_devices = ",".join(str(gpu_id) for gpu_id in replica.gpu_ids)
+        return f"export CUDA_VISIBLE_DEVICES={cuda_visible_devices} && {server_start_command}"
+
+    def start_replicas(self, model_path):
+        # the replicas load the model concurrently
+        supervisors = [
+            self.supervise_server(
+                self.create_replica_start_command(model_path, replica),
+                self.check_model_serve_ready,
+                replica=replica
+            )
+            for replica in self.replicas
+        ]
+        for supervisor in supervisors:
+            supervisor.wait_until_ready()
+
+    def is_healthy(self):
+        return any(replica.healthy for replica in self.replicas)
+
+    def affinity(self, key:str):
+        return self.router.affinity(key)
+
 
     def download_model_files(self,model_dir):
         from deploy.prepare_model import download_model_files as _download_model_files
@@ -145,11 +440,15 @@ class OpenAICompitableProxyBackendBase(BackendBase):
         if self.service_type != ServiceType.LOCAL:
             if self.execute_model.need_prepare_model or self.model_files_s3_path:
                 logger.info(f"Downloading model from s3, model_dir: {model_dir}, bucket_name: {self.model_s3_bucket}")
-                download_dir_from_s3_by_s5cmd(
+                download_model_from_s3(
                     model_dir,
                     bucket_name = self.model_s3_bucket,
                     s3_key = model_dir,
-                    model_files_s3_path=self.model_files_s3_path
+                    model_files_s3_path=self.model_files_s3_path,
+                    instance_type=self.instance_type,
+                    max_concurrency=self.model_fetch_concurrency,
+                    part_size_mb=self.model_fetch_part_size_mb,
+                    verify=self.verify_model_files
                 )
             else:
                 logger.info(f"Downloading model from hubs...")
@@ -168,16 +467,83 @@ class OpenAICompitableProxyBackendBase(BackendBase):
         model_abs_path = self.before_start(model_dir=model_dir)
 
         # get server start command
-        server_start_command = self.create_proxy_server_start_command(model_abs_path)
-        self.start_server(server_start_command)
+        if len(self.replicas) > 1:
+            self.start_replicas(model_abs_path)
+        else:
+            server_start_command = self.create_proxy_server_start_command(model_abs_path)
+            self.start_server(server_start_command)
+        if self.enable_warmup:
+            self.warmup()
+
+    def get_warmup_requests(self) -> List[tuple]:
+        # (prompt length in words, request), a word is about one token
+        if self.model_type == ModelType.EMBEDDING:
+            return [
+                (prompt_length, {"input": ["hello " * prompt_length]})
+                for prompt_length in self.warmup_prompt_lengths
+            ]
+        if self.model_type == ModelType.RERANK:
+            return [
+                (prompt_length, {"text_1": "hello", "text_2": ["hello " * prompt_length] * 4})
+                for prompt_length in self.warmup_prompt_lengths
+            ]
+        requests = []
+        for prompt_length in self.warmup_prompt_lengths:
+            for max_tokens in self.warmup_max_tokens:
+                for stream in [False, True]:
+                    requests.append((prompt_length, {
+                        "messages": [{"role": "user", "content": "hello " * prompt_length}],
+                        "max_tokens": max_tokens,
+                        "stream": stream
+                    }))
+        return requests
+
+    def warmup(self):
+        """Run synthetic requests through the engine, so that the first requests of clients
+        do not pay for cuda graph capture, kernel compilation or cache allocation."""
+        warmup_requests = self.get_warmup_requests()
+        for replica in self.replicas:
+            logger.info(f"warming up {self.engine_type} server {replica.index} with {len(warmup_requests)} requests...")
+            with self.router.pin(replica.index):
+                for prompt_length, request in warmup_requests:
+                    self.warmup_stats.append(self._warmup_request(prompt_length, request, replica))
+
+    def _warmup_request(self, prompt_length, request, replica):
+        stat = {
+            "replica": replica.index,
+            "prompt_length": prompt_length,
+            "max_tokens": request.get("max_tokens"),
+            "stream": request.get("stream", False),
+            "success": True,
+            "time_to_first_token": None
+        }
+        payload = dict(request)
+        if self.api_key:
+            # the engine server is started with --api-key, like the requests of clients
+            payload["extra_headers"] = {"Authorization": f"Bearer {self.api_key}"}
+        start_time = time.perf_counter()
+        try:
+            response = self.invoke(payload)
+            if stat["stream"]:
+                for _ in response:
+                    if stat["time_to_first_token"] is None:
+                        stat["time_to_first_token"] = time.perf_counter() - start_time
+        except Exception as e:
+            # a failed warmup request does not prevent serving
+            logger.warning(f"warmup request failed: {e}")
+            stat["success"] = False
+        stat["latency"] = time.perf_counter() - start_time
+        logger.info(f"warmup request: {stat}")
+        return stat
+
+    def get_warmup_stats(self):
+        return self.warmup_stats
 
 
     def stop(self):
-        if self.proc:
-            logger.info(f"pid: {self.proc.pid}")
-            logger.info(f"Kill vLLM server")
-            logger.info(f"pgid: {os.getpgid(self.proc.pid)}")
-            subprocess.Popen(f"kill -9 -{self.proc.pid}", shell=True)
+        for replica in self.replicas:
+            if replica.supervisor is not None:
+                replica.supervisor.stop()
         return
 
 
@@ -194,6 +560,10 @@ class OpenAICompitableProxyBackendBase(BackendBase):
         # Transform response to sagemaker format
         return self._get_streaming_response(response)
 
+    def _atransform_streaming_response(self, response):
+        # Transform async response to sagemaker format
+        return self._aget_streaming_response(response)
+
     def _format_streaming_response(self, response:bytes):
         if self.service_type == ServiceType.SAGEMAKER:
             return response +  "\n"
@@ -212,3 +582,104 @@ class OpenAICompitableProxyBackendBase(BackendBase):
 
     def _get_response(self, response) -> List[str]:
         return response
+
+    async def _aget_streaming_response(self, response) -> AsyncIterable[str]:
+        try:
+            async for chunk in response:
+                yield self._format_streaming_response(chunk.model_dump_json())
+        except Exception as e:
+            logger.error(traceback.format_exc())
+            yield self._format_streaming_response(json.dumps({"error": str(e)}))
+        finally:
+            # release the upstream connection when the client disconnects
+            await response.close()
+
+    def get_passthrough_path(self, route:str):
+        # map the route of the incoming request to the engine server api, relative to `base_url`
+        for path in ["/chat/completions", "/embeddings", "/score"]:
+            if route.endswith(path):
+                return path
+        # sagemaker only exposes /invocations
+        if self.model_type == ModelType.EMBEDDING:
+            return "/embeddings"
+        if self.model_type == ModelType.RERANK:
+            return "/score"
+        return "/chat/completions"
+
+    def _rewrite_model_field(self, body:bytes) -> bytes:
+        """Set the model of a raw json request body to `served_model_name`. Raises
+        ValueError if the body is not a json object."""
+        model_field = b'"model":' + json.dumps(self.served_model_name).encode("utf-8")
+        start = body.find(b"{")
+        if start < 0 or body[:start].strip():
+            raise ValueError("the request body is not a json object")
+        if b'"model"' not in body:
+            # model is not set in the request, insert it as the first member
+            start += 1
+            sep = b"" if body[start:].lstrip().startswith(b"}") else b","
+            return body[:start] + model_field + sep + body[start:]
+        match = MODEL_FIELD_PATTERN.search(body)
+        if match is not None and get_json_depth(body, match.start()) == 1:
+            return body[:match.start()] + model_field + body[match.end():]
+        # the first match is nested, e.g. in a tool schema, the top level model may come after
+        # it, or the top level model is not a string, e.g. null
+        payload = json.loads(body)
+        if not isinstance(payload, dict):
+            raise ValueError("the request body is not a json object")
+        payload["model"] = self.served_model_name
+        return json.dumps(payload, ensure_ascii=False).encode("utf-8")
+
+    async def apassthrough(self, route:str, body:bytes, headers:dict=None):
+        """Forward the raw request body to the engine server without decoding it.
+
+        Returns a tuple of (status_code, media_type, content), where content is the
+        response bytes, or an async iterator of bytes if the engine answers with an event stream.
+        """
+        try:
+            content = self._rewrite_model_field(body)
+        except ValueError as e:
+            return 400, "application/json", json.dumps({"error": str(e)}).encode("utf-8")
+        request = self.async_http_client.build_request(
+            "POST",
+            self.get_passthrough_path(route),
+            content=content,
+            headers={"Content-Type": "application/json", **(headers or {})}
+        )
+        response = await self.async_http_client.send(request, stream=True)
+        media_type = response.headers.get("content-type", "application/json")
+        if not media_type.startswith("text/event-stream"):
+            try:
+                content = await response.aread()
+            finally:
+                await response.aclose()
+            return response.status_code, media_type, content
+        return response.status_code, "text/event-stream", self._relay_event_stream(response)
+
+    @staticmethod
+    def _reframe_sse_event(event:bytes) -> bytes:
+        # `data: {...}` -> `{...}\n`, the `[DONE]` sentinel and sse comments are dropped
+        data = b"".join(
+            line[5:].lstrip() for line in event.split(b"\n") if line.startswith(b"data:")
+        )
+        if not data or data == b"[DONE]":
+            return b""
+        return data + b"\n"
+
+    async def _relay_event_stream(self, response) -> AsyncIterable[bytes]:
+        try:
+            if self.service_type != ServiceType.SAGEMAKER:
+                async for chunk in response.aiter_bytes():
+                    yield chunk
+                return
+            # sagemaker streams one json document per line
+            buffer = b""
+            async for chunk in response.aiter_bytes():
+                buffer += chunk
+                *events, buffer = buffer.split(b"\n\n")
+                reframed = b"".join(self._reframe_sse_event(event) for event in events)
+                if reframed:
+                    yield reframed
+            if buffer.strip():
+                yield self._reframe_sse_event(buffer)
+        finally:
+            await response.aclose()
@@ -1,11 +1,13 @@
 from typing import Iterable, List
+from contextlib import contextmanager, nullcontext
 import os
 import time
 
 from emd.models.utils.constants import ModelType,ServiceType
 
 from backend.backend import BackendBase
-from utils.common import download_dir_from_s3_by_s5cmd
+from utils.model_cache import get_model_cache
+from utils.model_fetcher import ModelFetch, download_model_from_s3, start_model_download_from_s3
 import torch
 from emd.constants import EMD_MODELS_LOCAL_DIR_TEMPLATE
 from emd.utils.logger_utils import get_logger
@@ -14,11 +16,37 @@ import torch
 from transformers import TextIteratorStreamer
 from threading import Thread
 import json
+import transformers.modeling_utils
 
 
 logger = get_logger(__name__)
 
 
+@contextmanager
+def load_shards_when_ready(model_fetch:ModelFetch, model_dir:str):
+    """Make `from_pretrained` wait for each shard to be downloaded before it loads it,
+    instead of waiting for the whole download. Only sharded checkpoints are loaded
+    this way: `from_pretrained` finds the shards in the index, not on disk."""
+    if not any(path.endswith(".index.json") for path in model_fetch.files):
+        model_fetch.wait()
+        yield
+        return
+    load_state_dict = transformers.modeling_utils.load_state_dict
+
+    def wait_and_load_state_dict(checkpoint_file, *args, **kwargs):
+        relative_path = os.path.relpath(os.path.abspath(checkpoint_file), model_dir)
+        started = time.time()
+        model_fetch.wait_file(relative_path)
+        logger.info(f"loading shard {relative_path}, waited {time.time() - started:.1f}s for its download")
+        return load_state_dict(checkpoint_file, *args, **kwargs)
+
+    transformers.modeling_utils.load_state_dict = wait_and_load_state_dict
+    try:
+        yield
+    finally:
+        transformers.modeling_utils.load_state_dict = load_state_dict
+
+
 class TransformerLLMBackend(BackendBase):
     def __init__(self,*args,**kwargs):
         super().__init__(
@@ -29,6 +57,10 @@ class TransformerLLMBackend(BackendBase):
         self.model_s3_bucket = self.execute_model.executable_config.model_s3_bucket
         self.model_files_s3_path = self.execute_model.model_files_s3_path
         self.service_type = self.execute_model.executable_config.current_service.service_type
+        self.instance_type = self.execute_model.executable_config.current_instance.instance_type
+        self.model_fetch_concurrency = self.execute_model.executable_config.current_engine.model_fetch_concurrency
+        self.model_fetch_part_size_mb = self.execute_model.executable_config.current_engine.model_fetch_part_size_mb
+        self.verify_model_files = self.execute_model.executable_config.current_engine.verify_model_files
         self.gpu_num = torch.cuda.device_count()
         self.model_type = self.execute_model.model_type
         self.proc = None
@@ -36,35 +68,53 @@ class TransformerLLMBackend(BackendBase):
         self.tokenizer = None
         self.pretrained_model_init_kwargs = self.execute_model.executable_config.current_engine.pretrained_model_init_kwargs or {}
         self.pretrained_tokenizer_init_kwargs = self.execute_model.executable_config.current_engine.pretrained_tokenizer_init_kwargs or {}
+        self.stream_model_load = self.execute_model.executable_config.current_engine.stream_model_load
 
 
     def start(self):
         model_dir = os.environ.get("MODEL_DIR") or EMD_MODELS_LOCAL_DIR_TEMPLATE.format(model_id=self.model_id)
+        model_abs_path = os.path.abspath(model_dir)
+        model_fetch = None
         if self.service_type != ServiceType.LOCAL:
             logger.info(f"Downloading model from s3")
-            download_dir_from_s3_by_s5cmd(
+            download_kwargs = dict(
                 local_dir=model_dir,
                 bucket_name = self.model_s3_bucket,
                 s3_key = model_dir,
-                model_files_s3_path=self.model_files_s3_path
+                model_files_s3_path=self.model_files_s3_path,
+                instance_type=self.instance_type,
+                max_concurrency=self.model_fetch_concurrency,
+                part_size_mb=self.model_fetch_part_size_mb,
+                verify=self.verify_model_files
             )
-        model_abs_path = os.path.abspath(model_dir)
-
-        # TODO add model iint args from model's definition
-        self.model = AutoModelForCausalLM.from_pretrained(
-                model_abs_path,
-                torch_dtype="auto",
-                device_map="auto",
-                **self.pretrained_model_init_kwargs
-
+            if get_model_cache() is not None:
+                # usually a hit of the host cache, downloaded by another container otherwise
+                download_model_from_s3(**download_kwargs)
+            else:
+                # config, tokenizer and shard index first, then the shards in the order they are loaded
+                model_fetch = start_model_download_from_s3(**download_kwargs)
+                model_fetch.wait_metadata()
 
-        )
         # TODO add tokenizer init args from model's definition
         self.tokenizer =  AutoTokenizer.from_pretrained(
             model_abs_path,
             **self.pretrained_tokenizer_init_kwargs
         )
 
+        if model_fetch is not None and not self.stream_model_load:
+            model_fetch.wait()
+        # TODO add model iint args from model's definition
+        with load_shards_when_ready(model_fetch, model_abs_path) if model_fetch is not None else nullcontext():
+            self.model = AutoModelForCausalLM.from_pretrained(
+                    model_abs_path,
+                    torch_dtype="auto",
+                    device_map="auto",
+                    **self.pretrained_model_init_kwargs
+            )
+        if model_fetch is not None:
+            # the files the model does not load
+            model_fetch.wait()
+
 
     def format_response_as_openai(self,response:str):
         return {
@@ -1,9 +1,8 @@
-from backend.backend import OpenAICompitableProxyBackendBase
+from backend.backend import OpenAICompitableProxyBackendBase,EngineProcessSupervisor
 from emd.utils.logger_utils import get_logger
 import glob
 import os
 import time
-import threading
 
 logger = get_logger(__name__)
 
@@ -47,18 +46,21 @@ class LlamaCppBackend(OpenAICompitableProxyBackendBase):
             serve_command += f" --api-key {self.api_key}"
         return serve_command
 
-    def check_model_serve_ready(self,thread:threading.Thread,host,port):
+    def check_model_serve_ready(self,process:EngineProcessSupervisor,host,port):
         import openai
+        intervals = self.readiness_intervals()
         while True:
+            if not process.is_alive():
+                raise RuntimeError('llama.cpp server failed to start.')
             try:
                 for m in self.client.models.list():
                     if self.model_id in m.id:
                         return
                 logger.info(f"model: {self.model_id} starting...")
-                time.sleep(5)
+                time.sleep(next(intervals))
             except (openai.NotFoundError,openai.InternalServerError,openai.APIConnectionError) as e:
                 logger.info(f"model: {self.model_id} error: {str(e)}, starting...")
-                time.sleep(5)
+                time.sleep(next(intervals))
 
     def invoke(self, request):
         # Transform input to lmdeploy format
@@ -86,3 +88,15 @@ class LlamaCppBackend(OpenAICompitableProxyBackendBase):
             return self._transform_streaming_response(response)
         else:
             return self._transform_response(response)
+
+    async def ainvoke(self, request):
+        # Transform input to llama.cpp format
+        request = self._transform_request(request)
+        # Invoke llama.cpp
+        logger.info(f"Chat request:{request}")
+        response = await self.async_client.chat.completions.create(**request)
+        logger.info(f"response:{response}")
+        if request.get('stream',False):
+            return self._atransform_streaming_response(response)
+        else:
+            return self._transform_response(response)
@@ -1,7 +1,7 @@
-from backend.backend import OpenAICompitableProxyBackendBase
+from backend.backend import OpenAICompitableProxyBackendBase,EngineProcessSupervisor
 from emd.utils.logger_utils import get_logger
 import os
-import threading
+import subprocess
 from emd.constants import EMD_MODELS_S3_KEY_TEMPLATE
 from emd.models.utils.constants import ModelType,ServiceType
 from emd.utils.system_call_utils import execute_command
@@ -12,22 +12,23 @@ logger = get_logger(__name__)
 
 class OllamaBackend(OpenAICompitableProxyBackendBase):
     server_port = "11434"
+    # ollama schedules the models on the gpus itself
+    support_replicas = False
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         # self.ollama_serve_extra_cli_args = self.execute_model.executable_config.current_engine.ollama_serve_extra_cli_args
         self.ollama_model_id = self.execute_model.ollama_model_id
 
+    @property
+    def served_model_name(self):
+        return self.ollama_model_id
+
     def run_ollama_serve(self,model_dir):
         serve_args = f'export OLLAMA_FLASH_ATTENTION=1 {self.default_cli_args} && export OLLAMA_HOST=0.0.0.0:{self.server_port} && export OLLAMA_KEEP_ALIVE=-1 && export OLLAMA_MODELS="{model_dir}" && ollama serve'
         logger.info(f'start ollama serve, args: {serve_args}...')
-        t = threading.Thread(target=os.system,args=(serve_args,),daemon=True)
-        t.start()
-        self.wait_until_server_start(
-            t,
-            "127.0.0.1",
-            self.server_port
-        )
+        # the models are loaded again on their first request after a restart (OLLAMA_KEEP_ALIVE)
+        self.supervise_server(serve_args, self.wait_until_server_start).wait_until_ready()
 
 
     def before_start(self,model_dir=None):
@@ -47,18 +48,27 @@ class OllamaBackend(OpenAICompitableProxyBackendBase):
         return serve_command
 
 
-    def check_model_serve_ready(self,thread:threading.Thread,host,port):
+    def start_server(self, server_start_command):
+        # `ollama run` only pulls and loads the model, `ollama serve` is the supervised server
+        logger.info(f"Loading ollama model with command: {server_start_command}")
+        subprocess.Popen(server_start_command, shell=True, start_new_session=True)
+        self.check_model_serve_ready(self.replicas[0].supervisor, "127.0.0.1", self.server_port)
+
+    def check_model_serve_ready(self,process:EngineProcessSupervisor,host,port):
         import openai
+        intervals = self.readiness_intervals()
         while True:
+            if not process.is_alive():
+                raise RuntimeError('ollama server failed to start.')
             try:
                 for m in self.client.models.list():
                     if self.ollama_model_id in m.id:
                         return
                 logger.info(f"model: {self.ollama_model_id} starting...")
-                time.sleep(5)
+                time.sleep(next(intervals))
             except openai.NotFoundError as e:
                 logger.info(f"model: {self.ollama_model_id} error: {str(e)}, starting...")
-                time.sleep(5)
+                time.sleep(next(intervals))
 
 
     def _transform_request(self, request):
@@ -93,3 +103,15 @@ class OllamaBackend(OpenAICompitableProxyBackendBase):
             return self._transform_streaming_response(response)
         else:
             return self._transform_response(response)
+
+    async def ainvoke(self, request):
+        # Transform input to ollama format
+        request = self._transform_request(request)
+        # Invoke ollama
+        logger.info(f"Chat request:{request}")
+        response = await self.async_client.chat.completions.create(**request)
+        logger.info(f"response:{response}")
+        if request.get('stream',False):
+            return self._atransform_streaming_response(response)
+        else:
+            return self._transform_response(response)
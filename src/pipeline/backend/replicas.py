@@ -0,0 +1,213 @@
+import contextvars
+import hashlib
+import itertools
+import threading
+from contextlib import contextmanager
+from typing import List
+
+import httpx
+
+from emd.utils.logger_utils import get_logger
+
+logger = get_logger(__name__)
+
+# the replica requests of the current thread/task are sent to, e.g. during readiness checks
+_pinned_replica = contextvars.ContextVar("pinned_replica", default=None)
+# requests with the same key go to the same replica, e.g. to reuse its prefix cache
+_affinity_key = contextvars.ContextVar("affinity_key", default=None)
+
+
+def _rendezvous_score(key:str, index:int) -> int:
+    return int.from_bytes(hashlib.blake2b(f"{key}:{index}".encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class EngineReplica:
+    """One engine server process, with its own port and GPUs (`CUDA_VISIBLE_DEVICES`)."""
+
+    def __init__(self, index:int, port:int, uds_path:str=None, gpu_ids:List[int]=None):
+        self.index = index
+        self.port = port
+        self.uds_path = uds_path
+        self.gpu_ids = gpu_ids
+        # requests sent to the replica whose response is not closed yet
+        self.outstanding = 0
+        self.supervisor = None
+        self.transport = None
+        self.async_transport = None
+
+    @property
+    def healthy(self):
+        return self.supervisor is not None and self.supervisor.healthy
+
+    def get_stats(self):
+        return {
+            "index": self.index,
+            "port": self.port,
+            "gpu_ids": self.gpu_ids,
+            "healthy": self.healthy,
+            "outstanding": self.outstanding
+        }
+
+
+class ReplicaRouter:
+    """Chooses the replica of each request to the engine servers.
+
+    Requests with an affinity key go to the healthy replica chosen for the key by
+    rendezvous hashing, so only the keys of a failed replica move, unless it has
+    `affinity_max_outstanding` outstanding requests. Other requests go to the healthy
+    replica with the least outstanding requests, ties are broken round robin.
+    """
+
+    def __init__(self, replicas:List[EngineReplica], affinity_max_outstanding:int=64):
+        self.replicas = replicas
+        self.affinity_max_outstanding = affinity_max_outstanding
+        self._lock = threading.Lock()
+        self._counter = itertools.count()
+
+    @contextmanager
+    def pin(self, index:int):
+        token = _pinned_replica.set(index)
+        try:
+            yield
+        finally:
+            _pinned_replica.reset(token)
+
+    @contextmanager
+    def affinity(self, key:str):
+        token = _affinity_key.set(key)
+        try:
+            yield
+        finally:
+            _affinity_key.reset(token)
+
+    def select(self, request:httpx.Request) -> EngineReplica:
+        candidates = [replica for replica in self.replicas if replica.healthy] or self.replicas
+        key = _affinity_key.get()
+        if key is not None:
+            replica = max(candidates, key=lambda replica: _rendezvous_score(key, replica.index))
+            if replica.outstanding < self.affinity_max_outstanding:
+                return replica
+            # saturated, fall back to the least loaded replica
+        start = next(self._counter) % len(self.replicas)
+        return min(
+            candidates,
+            key=lambda replica: (replica.outstanding, (replica.index - start) % len(self.replicas))
+        )
+
+    def acquire(self, request:httpx.Request) -> EngineReplica:
+        pinned = _pinned_replica.get()
+        with self._lock:
+            if pinned is not None:
+                replica = self.replicas[pinned]
+            elif len(self.replicas) == 1:
+                replica = self.replicas[0]
+            else:
+                replica = self.select(request)
+            replica.outstanding += 1
+        return replica
+
+    def release(self, replica:EngineReplica):
+        with self._lock:
+            replica.outstanding -= 1
+
+
+class _ReleasingByteStream(httpx.SyncByteStream):
+    def __init__(self, stream, release):
+        self.stream = stream
+        self.release = release
+
+    def __iter__(self):
+        yield from self.stream
+
+    def close(self):
+        try:
+            self.stream.close()
+        finally:
+            self.release()
+
+
+class _AsyncReleasingByteStream(httpx.AsyncByteStream):
+    def __init__(self, stream, release):
+        self.stream = stream
+        self.release = release
+
+    async def __aiter__(self):
+        async for chunk in self.stream:
+            yield chunk
+
+    async def aclose(self):
+        try:
+            await self.stream.aclose()
+        finally:
+            self.release()
+
+
+def _release_once(router:ReplicaRouter, replica:EngineReplica, counter:_InFlightCounter):
+    released = False
+    counter._add_in_flight(1)
+
+    def release():
+        nonlocal released
+        if not released:
+            released = True
+            router.release(replica)
+            counter._add_in_flight(-1)
+    return release
+
+
+class _InFlightCounter:
+    def __init__(self):
+        # requests sent through the transport whose response is not closed yet
+        self.in_flight = 0
+        self._in_flight_lock = threading.Lock()
+
+    def _add_in_flight(self, count:int):
+        with self._in_flight_lock:
+            self.in_flight += count
+
+
+class RoutingTransport(httpx.BaseTransport, _InFlightCounter):
+    """Sends each request to the transport of the replica chosen by `router`.
+    The replica counts the request as outstanding until its response is closed."""
+
+    def __init__(self, router:ReplicaRouter):
+        _InFlightCounter.__init__(self)
+        self.router = router
+
+    def handle_request(self, request:httpx.Request) -> httpx.Response:
+        replica = self.router.acquire(request)
+        release = _release_once(self.router, replica, self)
+        try:
+            request.url = request.url.copy_with(port=replica.port)
+            response = replica.transport.handle_request(request)
+        except BaseException:
+            release()
+            raise
+        response.stream = _ReleasingByteStream(response.stream, release)
+        return response
+
+    def close(self):
+        for replica in self.router.replicas:
+            replica.transport.close()
+
+
+class AsyncRoutingTransport(httpx.AsyncBaseTransport, _InFlightCounter):
+    def __init__(self, router:ReplicaRouter):
+        _InFlightCounter.__init__(self)
+        self.router = router
+
+    async def handle_async_request(self, request:httpx.Request) -> httpx.Response:
+        replica = self.router.acquire(request)
+        release = _release_once(self.router, replica, self)
+        try:
+            request.url = request.url.copy_with(port=replica.port)
+            response = await replica.async_transport.handle_async_request(request)
+        except BaseException:
+            release()
+            raise
+        response.stream = _AsyncReleasingByteStream(response.stream, release)
+        return response
+
+    async def aclose(self):
+        for replica in self.router.replicas:
+            await replica.async_transport.aclose()
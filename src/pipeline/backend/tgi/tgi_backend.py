@@ -12,6 +12,10 @@ from emd.constants import EMD_MODELS_S3_KEY_TEMPLATE
 
 logger = get_logger(__name__)
 
+# defaults of text-generation-launcher, offset by the replica index so that replicas do not collide
+TGI_SHARD_UDS_PATH = "/tmp/text-generation-server"
+TGI_MASTER_PORT = 29500
+
 
 class TgiBackend(OpenAICompitableProxyBackendBase):
     def __init__(self, *args, **kwargs):
@@ -19,6 +23,11 @@ class TgiBackend(OpenAICompitableProxyBackendBase):
         self.compile_to_neuron = self.execute_model.executable_config.current_engine.compile_to_neuron
         self.neuron_compile_params = self.execute_model.executable_config.current_engine.neuron_compile_params
         self.entrypoint = self.execute_model.executable_config.current_engine.entrypoint
+
+    @property
+    def served_model_name(self):
+        return "tgi"
+
     def get_shard_num(self):
         if check_cuda_exists():
             return self.gpu_num
@@ -31,6 +40,12 @@ class TgiBackend(OpenAICompitableProxyBackendBase):
         shard_num_cli_args = ""
         if check_cuda_exists():
             shard_num_cli_args = f"--num-shard {self.get_shard_num()}"
+        if self.replica is not None:
+            # the shards of each replica talk over their own unix sockets and torch distributed port
+            shard_num_cli_args += (
+                f" --shard-uds-path {TGI_SHARD_UDS_PATH}-{self.replica.index}"
+                f" --master-port {TGI_MASTER_PORT + self.replica.index}"
+            )
         serve_command = f'{self.entrypoint} --trust-remote-code --model-id {model_path} --port {self.server_port} {self.default_cli_args} {shard_num_cli_args} {self.cli_args}'
         if self.environment_variables:
             serve_command = f'{self.environment_variables} && {serve_command}'
@@ -107,3 +122,16 @@ class TgiBackend(OpenAICompitableProxyBackendBase):
             return self._transform_streaming_response(response)
         else:
             return self._transform_response(response)
+
+    async def ainvoke(self, request):
+        # Transform input to tgi format
+        request = self._transform_request(request)
+        request['model'] = 'tgi'
+        # Invoke tgi
+        logger.info(f"Chat request:{request}")
+        response = await self.async_client.chat.completions.create(**request)
+        logger.info(f"response:{response}")
+        if request.get('stream',False):
+            return self._atransform_streaming_response(response)
+        else:
+            return self._transform_response(response)
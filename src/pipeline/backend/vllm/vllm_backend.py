@@ -1,4 +1,3 @@
-import httpx
 from emd.models.utils.constants import ModelType
 
 from backend.backend import OpenAICompitableProxyBackendBase
@@ -17,6 +16,8 @@ class VLLMBackend(OpenAICompitableProxyBackendBase):
             serve_command += " --task score"
         if self.api_key:
             serve_command += f" --api-key {self.api_key}"
+        if self.server_uds_path:
+            serve_command += f" --uds {self.server_uds_path}"
         return serve_command
 
 
@@ -33,9 +34,11 @@ class VLLMBackend(OpenAICompitableProxyBackendBase):
             headers = {
                 "accept": "application/json",
                 "Accept-Type": "application/json",
+                # e.g. the Authorization of the caller, not a field of the score api
+                **request.pop("extra_headers", {})
             }
-            response = httpx.post(
-                f'{self.base_url}/score',
+            response = self.http_client.post(
+                "/score",
                 json=request,
                 headers=headers
             ).json()
@@ -47,3 +50,31 @@ class VLLMBackend(OpenAICompitableProxyBackendBase):
             return self._transform_streaming_response(response)
         else:
             return self._transform_response(response)
+
+    async def ainvoke(self, request):
+        # Transform input to vllm format
+        request = self._transform_request(request)
+        # Invoke vllm
+        logger.info(f"Chat request:{request}")
+        if self.model_type == ModelType.EMBEDDING:
+            response = await self.async_client.embeddings.create(**request)
+        elif self.model_type == ModelType.RERANK:
+            headers = {
+                "accept": "application/json",
+                "Accept-Type": "application/json",
+                # e.g. the Authorization of the caller, not a field of the score api
+                **request.pop("extra_headers", {})
+            }
+            response = (await self.async_http_client.post(
+                "/score",
+                json=request,
+                headers=headers
+            )).json()
+        else:
+            response = await self.async_client.chat.completions.create(**request)
+        logger.info(f"response:{response},{request}")
+
+        if request.get("stream", False):
+            return self._atransform_streaming_response(response)
+        else:
+            return self._transform_response(response)
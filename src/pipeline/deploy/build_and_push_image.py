@@ -133,6 +133,7 @@ def run(
     assert os.system(f"cp -r backend {execute_dir}") == 0
     assert os.system(f"cp -r deploy {execute_dir}") == 0
     assert os.system(f"cp -r utils {execute_dir}") == 0
+    assert os.system(f"cp -r framework {execute_dir}") == 0
 
     # download s5cmd
     # assert os.system('curl https://github.com/peak/s5cmd/releases/download/v2.0.0/s5cmd_2.0.0_Linux-64bit.tar.gz -L -o /tmp/s5cmd.tar.gz') == 0
@@ -174,7 +175,8 @@ def run(
             fastapi_serve_command = (
                 f"export AWS_DEFAULT_REGION={region} && "
                 f"export PYTHONPATH=.:$PYTHONPATH && "
-                f"python3 fast_api.py"
+                # exec, so that SIGTERM reaches the server and in-flight requests are drained
+                f"exec python3 fast_api.py"
                 f" --backend_type={backend_type}"
                 f" --model_id={model_id}"
                 f" --region={region}"
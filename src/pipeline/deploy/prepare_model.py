@@ -1,79 +1,64 @@
 import os
-import subprocess
 import logging
 
-from huggingface_hub import snapshot_download as hf_snapshot_download
-from modelscope import snapshot_download as ms_snapshot_download
 from emd.models import Model
 from emd.models.utils.constants import ServiceType,EngineType,ModelFilesDownloadSource
 from emd.utils.aws_service_utils import check_cn_region
 from emd.utils.logger_utils import get_logger
-from utils.common import upload_dir_to_s3_by_s5cmd,download_dir_from_s3_by_s5cmd
+from utils.common import upload_dir_to_s3_by_s5cmd,download_dir_from_s3_by_s5cmd,sync_files_to_s3_by_s5cmd
+from utils.hub_downloader import HubDownloader
+from utils.model_manifest import (
+    get_huggingface_files,
+    get_modelscope_files,
+    get_local_files,
+    list_s3_files,
+    read_manifest,
+    write_manifest,
+    diff_files,
+    build_manifest,
+    file_sha256
+)
 from emd.constants import EMD_MODELS_LOCAL_DIR_TEMPLATE,EMD_MODELS_S3_KEY_TEMPLATE
-from emd.utils.network_check import check_website_urllib
+from emd.utils.aws_client_factory import get_client
 
 logger = get_logger(__name__)
 
 
-def enable_hf_transfer():
-    try:
-        import hf_transfer
-        os.environ["HF_HUB_ENABLE_HF_TRANSFER"] = "1"
-        from huggingface_hub import constants
-        constants.HF_HUB_ENABLE_HF_TRANSFER = True
-        logger.info("hf_transfer enabled")
-    except ModuleNotFoundError as e:
-        logger.info(f"hf_transfer not installed, skip enabling hf_transfer, error: {e}")
-
-
-def download_huggingface_model(model:Model,model_dir=None):
-    if not model.disable_hf_transfer:
-        enable_hf_transfer()
+def download_huggingface_model(model:Model,model_dir=None,allow_patterns=None):
     huggingface_model_id = model.huggingface_model_id
-    service_type = model.executable_config.current_service.service_type
     model_id = model.model_id
     model_dir = model_dir or EMD_MODELS_LOCAL_DIR_TEMPLATE.format(model_id=model_id)
-    # hf_endpoint_from_cli = args.get("model_params",{}).get("hf_endpoint")
     huggingface_endpoints = model.huggingface_endpoints
 
     if isinstance(huggingface_endpoints,str):
         huggingface_endpoints = [huggingface_endpoints]
 
-    is_download_success = False
     logger.info(f'huggingface_endpoints: {huggingface_endpoints}')
-    for huggingface_endpoint in huggingface_endpoints:
-        try:
-            logger.info(f"Downloading {huggingface_model_id} model from endpoint: {huggingface_endpoint}")
-            # check endpoint reacheable
-            if not check_website_urllib(huggingface_endpoint):
-                logger.error(f"Endpoint {huggingface_endpoint} is not reachable")
-                continue
-            hf_snapshot_download(
-                huggingface_model_id,
-                local_dir=model_dir,
-                endpoint=huggingface_endpoint,
-                **model.huggingface_model_download_kwargs
-            )
-            is_download_success = True
-            break
-        except Exception as e:
-            logger.error(f"Error downloading {huggingface_model_id} model from endpoint: {huggingface_endpoint}, error: {e}")
-            continue
-
-    if not is_download_success:
-        raise Exception(f"Failed to download {huggingface_model_id} model from all endpoints: {huggingface_endpoints}")
+    download_kwargs = dict(model.huggingface_model_download_kwargs)
+    if allow_patterns is not None:
+        # only the files missing in s3, a subset of the allowed files
+        download_kwargs["allow_patterns"] = allow_patterns
+    # the endpoints are probed at once, each file fails over to the next fastest endpoint
+    try:
+        HubDownloader(split_files=not model.disable_hf_transfer).download_huggingface_repo(
+            huggingface_model_id,
+            model_dir,
+            endpoints=huggingface_endpoints,
+            **download_kwargs
+        )
+    except Exception as e:
+        raise Exception(f"Failed to download {huggingface_model_id} model from all endpoints: {huggingface_endpoints}") from e
 
 
-def download_modelscope_model(model:Model,model_dir=None):
+def download_modelscope_model(model:Model,model_dir=None,allow_patterns=None):
     modelscope_model_id = model.modelscope_model_id
-    service_type = model.executable_config.current_service.service_type
     model_id = model.model_id
     model_dir = model_dir or EMD_MODELS_LOCAL_DIR_TEMPLATE.format(model_id=model_id)
     logger.info(f"Downloading {modelscope_model_id} model")
-
-    ms_snapshot_download(
-        model_id=modelscope_model_id,
-        local_dir=model_dir
+    HubDownloader().download_modelscope_repo(
+        modelscope_model_id,
+        model_dir,
+        allow_patterns=allow_patterns
     )
 
 def download_comfyui_model(model,model_dir=None):
@@ -82,20 +67,29 @@ def download_comfyui_model(model,model_dir=None):
     huggingface_url_list = model.huggingface_url_list
     model_dir = model_dir or EMD_MODELS_LOCAL_DIR_TEMPLATE.format(model_id=model_id)
     os.makedirs(model_dir, exist_ok=True)
+    huggingface_endpoints = model.huggingface_endpoints
+    if isinstance(huggingface_endpoints,str):
+        huggingface_endpoints = [huggingface_endpoints]
+    # the files of all the repos and urls are downloaded together
+    downloader = HubDownloader(split_files=not model.disable_hf_transfer)
+    jobs = []
     if huggingface_model_list is not None:
         for key, value in huggingface_model_list.items():
-            logger.info(f"Downloading {key} model")
-            huggingface_model_id = key
-            model_local_dir = os.path.join(model_dir, value)
-            os.makedirs(model_local_dir, exist_ok=True)
-            hf_snapshot_download(repo_id=huggingface_model_id, local_dir=model_local_dir)
+            logger.info(f"Listing {key} model")
+            _, repo_jobs = downloader.get_huggingface_jobs(
+                key,
+                os.path.join(model_dir, value),
+                endpoints=huggingface_endpoints
+            )
+            jobs.extend(repo_jobs)
     if huggingface_url_list is not None:
         for key, value in huggingface_url_list.items():
-            logger.info(f"Downloading {os.path.basename(key)} model")
-            huggingface_model_url = key
-            model_local_dir = os.path.join(model_dir, value)
-            os.makedirs(model_local_dir, exist_ok=True)
-            subprocess.run(["wget", "-P", model_local_dir, huggingface_model_url])
+            jobs.append(downloader.get_url_job(
+                key,
+                os.path.join(model_dir, value),
+                endpoints=huggingface_endpoints
+            ))
+    downloader.download(jobs)
 
 def upload_model_to_s3(model:Model, model_s3_bucket):
     model_id = model.model_id
@@ -104,7 +98,7 @@ def upload_model_to_s3(model:Model, model_s3_bucket):
     upload_dir_to_s3_by_s5cmd(model_s3_bucket, model_dir)
 
 
-def download_model_files(model:Model,model_dir=None):
+def download_model_files(model:Model,model_dir=None,allow_patterns=None):
     engine_type = model.executable_config.current_engine.engine_type
     region = model.executable_config.region
     if engine_type == EngineType.COMFYUI:
@@ -113,22 +107,86 @@ def download_model_files(model:Model,model_dir=None):
         if model.model_files_download_source == ModelFilesDownloadSource.AUTO:
             if check_cn_region(region):
                 try:
-                    download_modelscope_model(model,model_dir=model_dir)
+                    download_modelscope_model(model,model_dir=model_dir,allow_patterns=allow_patterns)
                 except Exception as e:
                     logger.error(f"Error downloading {model.model_id} model from modelscope, error: {e}")
                     logger.info("download from huggingface...")
-                    download_huggingface_model(model, model_dir=model_dir)
+                    download_huggingface_model(model, model_dir=model_dir,allow_patterns=allow_patterns)
             else:
-                download_huggingface_model(model,model_dir=model_dir)
+                download_huggingface_model(model,model_dir=model_dir,allow_patterns=allow_patterns)
         else:
             if model.model_files_download_source == ModelFilesDownloadSource.HUGGINGFACE:
-                download_huggingface_model(model, model_dir=model_dir)
+                download_huggingface_model(model, model_dir=model_dir,allow_patterns=allow_patterns)
             elif model.model_files_download_source == ModelFilesDownloadSource.MODELSCOPE:
-                download_modelscope_model(model, model_dir=model_dir)
+                download_modelscope_model(model, model_dir=model_dir,allow_patterns=allow_patterns)
             else:
                 raise ValueError(f"Invalid model_files_download_source: {model.model_files_download_source}")
 
 
+def get_upstream_files(model:Model):
+    """The source, repo id, revision and files of the model where download_model_files
+    downloads it from first."""
+    region = model.executable_config.region
+    source = model.model_files_download_source
+    if source == ModelFilesDownloadSource.MODELSCOPE or (
+        source == ModelFilesDownloadSource.AUTO and check_cn_region(region)
+    ):
+        revision, files = get_modelscope_files(model)
+        return "modelscope", model.modelscope_model_id, revision, files
+    revision, files = get_huggingface_files(model)
+    return "huggingface", model.huggingface_model_id, revision, files
+
+
+def sync_model_to_s3(model:Model, model_s3_bucket):
+    """Download and upload only the model files which are not in s3 yet.
+
+    The manifest next to the files in s3 is compared with the files of the upstream revision,
+    so redeploying a model whose files are already in the bucket, e.g. under another tag,
+    neither downloads nor uploads anything.
+    """
+    model_id = model.model_id
+    s3_prefix = EMD_MODELS_S3_KEY_TEMPLATE.format(model_id=model_id)
+    model_dir = EMD_MODELS_LOCAL_DIR_TEMPLATE.format(model_id=model_id)
+    s3_client = get_client("s3", region_name=model.executable_config.region)
+    manifest = read_manifest(s3_client, model_s3_bucket, s3_prefix)
+    s3_files = list_s3_files(s3_client, model_s3_bucket, s3_prefix)
+    try:
+        source, repo_id, revision, files = get_upstream_files(model)
+    except Exception as e:
+        logger.warning(f"Failed to get the files of {model_id} upstream, download all files, error: {e}")
+        source, repo_id, revision, files = None, None, None, None
+
+    if files is not None:
+        changed, removed = diff_files(files, manifest, s3_files)
+        if not changed and not removed:
+            logger.info(f"Model {model_id} revision {revision} already in s3://{model_s3_bucket}/{s3_prefix}, skip download and upload")
+            if manifest is None or manifest.get("revision") != revision:
+                write_manifest(s3_client, model_s3_bucket, s3_prefix, build_manifest(
+                    model_id, source, repo_id, revision, files, s3_files
+                ))
+            return
+        logger.info(f"{len(changed)} of {len(files)} files of {model_id} changed, {len(removed)} removed")
+        download_model_files(
+            model,
+            allow_patterns=changed if len(changed) < len(files) else None
+        )
+        # the hash of small files not stored in lfs, to verify downloads from s3
+        for path in changed:
+            if not files[path].get("sha256"):
+                files[path]["sha256"] = file_sha256(os.path.join(model_dir, path))
+    else:
+        download_model_files(model)
+        files = get_local_files(model_dir)
+        changed, removed = diff_files(files, manifest, s3_files)
+        logger.info(f"{len(changed)} of {len(files)} files of {model_id} changed, {len(removed)} removed")
+
+    sync_files_to_s3_by_s5cmd(model_dir, model_s3_bucket, s3_prefix, changed, removed)
+    s3_files = list_s3_files(s3_client, model_s3_bucket, s3_prefix)
+    write_manifest(s3_client, model_s3_bucket, s3_prefix, build_manifest(
+        model_id, source, repo_id, revision, files, s3_files
+    ))
+
+
 def run(model:Model):#, model_s3_bucket, backend_type, service_type, region,args):
     need_prepare_model = model.need_prepare_model
     model_files_s3_path = model.model_files_s3_path
@@ -157,6 +215,9 @@ def run(model:Model):#, model_s3_bucket, backend_type, service_type, region,args
                 model_files_s3_path=model_files_s3_path
             )
             return
+        if service_type != ServiceType.LOCAL and engine_type != EngineType.COMFYUI:
+            sync_model_to_s3(model, model_s3_bucket)
+            return
         download_model_files(model)
     else:
         logger.info(f"Model {model.model_id} already prepared, skip prepare model step. need_prepare_model:{need_prepare_model}, model_files_s3_path: {model_files_s3_path}")
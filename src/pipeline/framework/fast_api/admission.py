@@ -0,0 +1,186 @@
+import asyncio
+import heapq
+import itertools
+from typing import AsyncIterable, Callable
+
+from fastapi.responses import StreamingResponse
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, status_code:int, retry_after:float, reason:str):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class ClosingStreamingResponse(StreamingResponse):
+    """A `StreamingResponse` which calls `on_close` once it is sent, or failed to be sent,
+    e.g. the client disconnected before the body iterator was started."""
+
+    def __init__(self, *args, on_close:Callable[[], None], **kwargs):
+        super().__init__(*args, **kwargs)
+        self.on_close = on_close
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.on_close()
+
+
+class AdmissionController:
+    """Limits the number of in-flight requests of a route.
+
+    Requests over `max_in_flight` wait in a bounded queue, ordered by priority
+    (higher first) then arrival. A request is shed with 429 when the queue is full,
+    and with 503 when it waited longer than `max_queue_time` seconds.
+    """
+
+    def __init__(
+            self,
+            max_in_flight:int,
+            max_queue_size:int,
+            max_queue_time:float,
+            retry_after:float=1
+        ):
+        self.max_in_flight = max_in_flight
+        self.max_queue_size = max_queue_size
+        self.max_queue_time = max_queue_time
+        self.retry_after = retry_after
+        self.in_flight = 0
+        self.queue_size = 0
+        # entries of (-priority, seq, future), cancelled futures are dropped lazily
+        self._queue = []
+        self._seq = itertools.count()
+
+    def _reject_lowest_priority(self, priority:int) -> bool:
+        """Shed the lowest priority waiter in favor of a request with a higher `priority`."""
+        waiting = [entry for entry in self._queue if not entry[2].done()]
+        if not waiting:
+            return False
+        lowest = max(waiting, key=lambda entry: (entry[0], entry[1]))
+        if -lowest[0] >= priority:
+            return False
+        lowest[2].set_exception(self._rejected(429, "request queue is full"))
+        self.queue_size -= 1
+        return True
+
+    def _rejected(self, status_code:int, reason:str) -> AdmissionRejected:
+        return AdmissionRejected(status_code, self.retry_after, reason)
+
+    async def acquire(self, priority:int=0):
+        if self.in_flight < self.max_in_flight and self.queue_size == 0:
+            self.in_flight += 1
+            return
+        if self.queue_size >= self.max_queue_size and not self._reject_lowest_priority(priority):
+            raise self._rejected(429, "request queue is full")
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, (-priority, next(self._seq), future))
+        self.queue_size += 1
+        try:
+            # shielded, so that a slot handed over at the deadline is not lost
+            await asyncio.wait_for(asyncio.shield(future), timeout=self.max_queue_time)
+        except asyncio.TimeoutError:
+            if not self._leave_queue(future):
+                return
+            raise self._rejected(503, f"request waited in queue for more than {self.max_queue_time}s")
+        except asyncio.CancelledError:
+            # e.g. the client disconnected
+            if not self._leave_queue(future):
+                self.release()
+            raise
+
+    def _leave_queue(self, future) -> bool:
+        """Returns False if the slot was handed over to `future` meanwhile."""
+        if future.done():
+            return future.cancelled() or future.exception() is not None
+        future.cancel()
+        self.queue_size -= 1
+        return True
+
+    def release(self):
+        while self._queue:
+            _, _, future = heapq.heappop(self._queue)
+            if future.done():
+                continue
+            # hand over the slot to the next waiter
+            self.queue_size -= 1
+            future.set_result(None)
+            return
+        self.in_flight -= 1
+
+    def release_on_close(self, response:StreamingResponse) -> StreamingResponse:
+        """Release the slot once, at the end of the body of `response`, or when the response
+        is done if the body was never iterated."""
+        released = False
+
+        def release_once():
+            nonlocal released
+            if not released:
+                released = True
+                self.release()
+
+        async def release_at_end(content:AsyncIterable) -> AsyncIterable:
+            try:
+                async for chunk in content:
+                    yield chunk
+            finally:
+                release_once()
+
+        closing_response = ClosingStreamingResponse(
+            content=release_at_end(response.body_iterator),
+            status_code=response.status_code,
+            media_type=response.media_type,
+            background=response.background,
+            on_close=release_once
+        )
+        closing_response.raw_headers = response.raw_headers
+        return closing_response
+
+
+class AdmissionControl:
+    """One `AdmissionController` per route, e.g. `/v1/chat/completions`."""
+
+    def __init__(
+            self,
+            max_in_flight:int,
+            max_queue_size:int,
+            max_queue_time:float,
+            retry_after:float=1,
+            priority_header:str=None
+        ):
+        self.max_in_flight = max_in_flight
+        self.max_queue_size = max_queue_size
+        self.max_queue_time = max_queue_time
+        self.retry_after = retry_after
+        self.priority_header = priority_header
+        self.controllers = {}
+
+    @classmethod
+    def enabled(cls, max_in_flight:int):
+        return max_in_flight > 0
+
+    def get_controller(self, route:str) -> AdmissionController:
+        if route not in self.controllers:
+            self.controllers[route] = AdmissionController(
+                self.max_in_flight,
+                self.max_queue_size,
+                self.max_queue_time,
+                retry_after=self.retry_after
+            )
+        return self.controllers[route]
+
+    def get_priority(self, headers) -> int:
+        if not self.priority_header:
+            return 0
+        try:
+            return int(headers.get(self.priority_header, 0))
+        except ValueError:
+            return 0
+
+    def get_stats(self) -> dict:
+        return {
+            route: {"in_flight": controller.in_flight, "queue_size": controller.queue_size}
+            for route, controller in self.controllers.items()
+        }
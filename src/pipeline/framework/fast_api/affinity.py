@@ -0,0 +1,37 @@
+import hashlib
+import json
+from typing import Optional
+
+# the session id of sagemaker stateful sessions
+SAGEMAKER_SESSION_HEADER = "X-Amzn-SageMaker-Session-Id"
+
+
+def _hash(value) -> str:
+    return hashlib.sha1(
+        json.dumps(value, sort_keys=True, ensure_ascii=False).encode("utf-8")
+    ).hexdigest()
+
+
+def get_prefix_key(payload:dict) -> Optional[str]:
+    """Key of the prompt prefix shared by requests: the system prompt if there is one,
+    e.g. agents, otherwise the first message, which stays the same across the turns of
+    a conversation."""
+    messages = payload.get("messages")
+    if not isinstance(messages, list) or not messages:
+        return None
+    system_messages = [
+        message for message in messages
+        if isinstance(message, dict) and message.get("role") in ("system", "developer")
+    ]
+    return "prefix:" + _hash(system_messages or messages[:1])
+
+
+def get_affinity_key(headers, payload:dict=None, session_header:str=None) -> Optional[str]:
+    """Key of the engine replica a request should go to, so that requests sharing a
+    prefix reuse its kv cache. An explicit session header wins over the prompt prefix."""
+    for header in [session_header, SAGEMAKER_SESSION_HEADER]:
+        if header and headers.get(header):
+            return "session:" + headers.get(header)
+    if payload is None:
+        return None
+    return get_prefix_key(payload)
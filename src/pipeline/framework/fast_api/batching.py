@@ -0,0 +1,188 @@
+import asyncio
+import json
+from typing import Any, Awaitable, Callable, List
+
+from emd.models.utils.constants import ModelType
+from emd.utils.logger_utils import get_logger
+
+logger = get_logger(__name__)
+
+
+class MicroBatcher:
+    """Gathers concurrent requests and runs them with a single call of `batch_fn`.
+
+    A batch is flushed once it holds `max_batch_size` items, or `batch_window_ms`
+    after its first item arrived, whichever comes first.
+    """
+
+    def __init__(
+            self,
+            batch_fn: Callable[[List[Any]], Awaitable[List[Any]]],
+            max_batch_size: int,
+            batch_window_ms: float
+        ):
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.batch_window = batch_window_ms / 1000
+        self._pending = []
+        self._pending_size = 0
+        self._timer = None
+        self._tasks = set()
+
+    async def submit(self, item, size=1):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((item, future))
+        self._pending_size += size
+        if self._pending_size >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.batch_window, self._flush)
+        return await future
+
+    @property
+    def idle(self) -> bool:
+        return not self._pending and not self._tasks
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch = self._pending
+        self._pending = []
+        self._pending_size = 0
+        if not batch:
+            return
+        task = asyncio.create_task(self._run(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch):
+        try:
+            results = await self.batch_fn([item for item, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            # the waiting request may have been cancelled by a client disconnect
+            if not future.done():
+                future.set_result(result)
+
+
+def _to_dict(response):
+    if hasattr(response, "model_dump"):
+        return response.model_dump()
+    return response
+
+
+def _scatter(response:dict, counts:List[int]) -> List[dict]:
+    """Split the `data` list of a batched embeddings/score response back into one response per request.
+    `usage` is the one of the whole batch."""
+    data = sorted(response["data"], key=lambda d: d["index"])
+    results = []
+    start = 0
+    for count in counts:
+        results.append({
+            **response,
+            "data": [{**d, "index": d["index"] - start} for d in data[start:start + count]]
+        })
+        start += count
+    return results
+
+
+class RequestBatcher:
+    """Micro-batching stage of embedding and rerank requests in front of `engine.ainvoke`.
+
+    Requests are only merged with requests which have the same parameters,
+    e.g. `encoding_format`, so each group of parameters has its own `MicroBatcher`.
+    Only the parameters which change the output of the engine, and the `extra_headers`
+    the batch is sent with, e.g. the `Authorization` of the caller, form a group. The others,
+    e.g. `user`, are taken from the first request of the batch.
+    """
+    # idle batchers are dropped once there are more groups than this
+    max_idle_batchers = 64
+
+    batch_model_types = [ModelType.EMBEDDING, ModelType.RERANK]
+    group_fields = {
+        ModelType.EMBEDDING: ["model", "encoding_format", "dimensions", "truncate_prompt_tokens", "add_special_tokens"],
+        ModelType.RERANK: ["model", "encoding_format", "truncate_prompt_tokens", "add_special_tokens"],
+    }
+
+    def __init__(self, engine, model_type, max_batch_size:int, batch_window_ms:float):
+        self.engine = engine
+        self.model_type = model_type
+        self.max_batch_size = max_batch_size
+        self.batch_window_ms = batch_window_ms
+        self.batchers = {}
+
+    @classmethod
+    def enabled(cls, engine, model_type, max_batch_size:int):
+        return engine.support_async and model_type in cls.batch_model_types and max_batch_size > 1
+
+    def _get_batcher(self, payload:dict) -> MicroBatcher:
+        key = json.dumps(
+            [payload.get(field) for field in self.group_fields[self.model_type]] + [payload.get("extra_headers")],
+            sort_keys=True,
+            default=str
+        )
+        if key not in self.batchers:
+            if len(self.batchers) >= self.max_idle_batchers:
+                for idle_key in [k for k, batcher in self.batchers.items() if batcher.idle]:
+                    del self.batchers[idle_key]
+            batch_fn = self._embeddings_batch if self.model_type == ModelType.EMBEDDING else self._score_batch
+            self.batchers[key] = MicroBatcher(batch_fn, self.max_batch_size, self.batch_window_ms)
+        return self.batchers[key]
+
+    def _embedding_inputs(self, payload:dict):
+        inputs = payload.get("input")
+        if isinstance(inputs, str):
+            return [inputs]
+        if isinstance(inputs, list) and inputs and all(isinstance(i, str) for i in inputs):
+            return inputs
+        # e.g. token ids, which are not merged
+        return None
+
+    def _score_pairs(self, payload:dict):
+        text_1, text_2 = payload.get("text_1"), payload.get("text_2")
+        if isinstance(text_2, str):
+            text_2 = [text_2]
+        if isinstance(text_1, str):
+            text_1 = [text_1]
+        if not isinstance(text_1, list) or not isinstance(text_2, list) or not text_2:
+            return None
+        if len(text_1) == 1:
+            text_1 = text_1 * len(text_2)
+        if len(text_1) != len(text_2):
+            return None
+        return text_1, text_2
+
+    def can_batch(self, payload:dict) -> bool:
+        if payload.get("stream", False):
+            return False
+        if self.model_type == ModelType.EMBEDDING:
+            return self._embedding_inputs(payload) is not None
+        return self._score_pairs(payload) is not None
+
+    async def invoke(self, payload:dict):
+        if self.model_type == ModelType.EMBEDDING:
+            inputs = self._embedding_inputs(payload)
+            batcher = self._get_batcher(payload)
+            return await batcher.submit((payload, inputs), size=len(inputs))
+        text_1, text_2 = self._score_pairs(payload)
+        batcher = self._get_batcher(payload)
+        return await batcher.submit((payload, text_1, text_2), size=len(text_2))
+
+    async def _embeddings_batch(self, items):
+        inputs = [text for _, texts in items for text in texts]
+        logger.info(f"embeddings batch: {len(items)} requests, {len(inputs)} inputs")
+        response = await self.engine.ainvoke({**items[0][0], "input": inputs})
+        return _scatter(_to_dict(response), [len(texts) for _, texts in items])
+
+    async def _score_batch(self, items):
+        text_1 = [text for _, texts, _ in items for text in texts]
+        text_2 = [text for _, _, texts in items for text in texts]
+        logger.info(f"score batch: {len(items)} requests, {len(text_2)} pairs")
+        response = await self.engine.ainvoke({**items[0][0], "text_1": text_1, "text_2": text_2})
+        return _scatter(_to_dict(response), [len(texts) for _, _, texts in items])
@@ -1,5 +1,6 @@
 import os
 import sys
+import math
 import uvicorn
 import argparse
 import logging
@@ -7,10 +8,14 @@ from emd.models import Model,ExecutableConfig
 from emd.models.utils.constants import FrameworkType
 from emd.models.utils.serialize_utils import load_extra_params,dump_extra_params
 from fastapi import FastAPI, Request, status, Header, Depends
-from fastapi.responses import JSONResponse, Response, StreamingResponse
+from fastapi.responses import JSONResponse, Response, StreamingResponse, PlainTextResponse
 from emd.utils.logger_utils import get_logger
 from fastapi.concurrency import run_in_threadpool
 from emd.utils.framework_utils import get_model_specific_path
+from framework.fast_api.batching import RequestBatcher
+from framework.fast_api.affinity import get_affinity_key
+from framework.fast_api.admission import AdmissionControl, AdmissionRejected
+from framework.fast_api.metrics import ServingMetrics, CONTENT_TYPE, get_output_tokens
 
 model_id = os.environ.get("model_id")
 model_tag = os.environ.get("model_tag")
@@ -21,7 +26,8 @@ logger.info(f"model_tag: {model_tag}")
 # prevent logging ping
 class HealthCheckFilter(logging.Filter):
     def filter(self, record: logging.LogRecord) -> bool:
-        return record.getMessage().find("GET /ping") == -1 and record.getMessage().find("GET /health") == -1
+        message = record.getMessage()
+        return all(message.find(path) == -1 for path in ["GET /ping", "GET /health", "GET /pool_stats", "GET /metrics"])
 
 # Remove /credentials/health from application server logs
 logging.getLogger("uvicorn.access").addFilter(HealthCheckFilter())
@@ -48,12 +54,40 @@ def parse_args():
 
 app = FastAPI()
 engine = None
+request_batcher = None
+serving_metrics = None
+admission_control = None
+# routing of requests sharing a session or a system prompt to the same engine replica
+enable_affinity = False
+session_header = None
 
 async def get_authorization(authorization: str = Header(None)):
     return authorization
 
-async def invoke(payload):
-    generator = await run_in_threadpool(engine.invoke, payload)
+def get_route(request: Request):
+    # model specific paths are reported as their base path
+    path = request.url.path
+    if model_id and model_tag:
+        path = path.replace(get_model_specific_path(model_id, model_tag, ""), "/", 1)
+    return path
+
+def invoke_in_thread(payload, timer, affinity_key=None):
+    timer.engine_started()
+    with engine.affinity(affinity_key):
+        return engine.invoke(payload)
+
+async def invoke(payload, timer, affinity_key=None):
+    if request_batcher is not None and request_batcher.can_batch(payload):
+        timer.engine_started()
+        return await request_batcher.invoke(payload)
+    if engine.support_async:
+        timer.engine_started()
+        # streaming responses are routed when they are opened, i.e. in this context
+        with engine.affinity(affinity_key):
+            generator = await engine.ainvoke(payload)
+    else:
+        # e.g. TransformerLLMBackend, which only has a blocking invoke
+        generator = await run_in_threadpool(invoke_in_thread, payload, timer, affinity_key)
     stream = payload.get("stream",False)
     if stream:
         return StreamingResponse(content=generator,
@@ -61,15 +95,55 @@ async def invoke(payload):
     else:
         return generator
 
+async def passthrough(request: Request, authorization: str = None, timer = None):
+    body = await request.body()
+    headers = {"Authorization": authorization} if authorization else None
+    timer.engine_started()
+    # the body is not decoded in passthrough mode, only session headers are used for affinity
+    affinity_key = get_affinity_key(request.headers, session_header=session_header) if enable_affinity else None
+    with engine.affinity(affinity_key):
+        status_code, media_type, content = await engine.apassthrough(
+            request.url.path,
+            body,
+            headers=headers
+        )
+    if isinstance(content, bytes):
+        return Response(content=content, status_code=status_code, media_type=media_type)
+    return StreamingResponse(content=content, status_code=status_code, media_type=media_type)
+
 # As sagemaker endpoint requires...
 @app.get("/ping")
 def ping():
+    # e.g. the engine server crashed and is being restarted
+    if not engine.is_healthy():
+        return JSONResponse(content={}, status_code=status.HTTP_503_SERVICE_UNAVAILABLE)
     return JSONResponse(content={}, status_code=status.HTTP_200_OK)
 
 @app.get("/health")
 def health():
     return "200 OK"
 
+# utilization of the connection pool to the engine server
+@app.get("/pool_stats")
+def pool_stats():
+    stats = engine.get_pool_stats()
+    if admission_control is not None:
+        stats["admission"] = admission_control.get_stats()
+    return stats
+
+@app.get("/metrics")
+def metrics():
+    serving_metrics.set_pool_stats(engine.get_pool_stats())
+    if admission_control is not None:
+        serving_metrics.set_admission_stats(admission_control.get_stats())
+    return PlainTextResponse(content=serving_metrics.render(), media_type=CONTENT_TYPE)
+
+# uvicorn runs the shutdown handlers once in-flight requests are drained
+@app.on_event("shutdown")
+def shutdown():
+    if engine is not None:
+        engine.stop()
+
 # As sagemaker endpoint requires...
 @app.post("/invocations")
 @app.post("/v1/chat/completions")
@@ -77,11 +151,52 @@ def health():
 @app.post("/score")
 # @measure_time
 async def invocations(request: Request, authorization: str = Depends(get_authorization)):
+    route = get_route(request)
+    timer = serving_metrics.start_request(route)
+    controller = None
+    if admission_control is not None:
+        controller = admission_control.get_controller(route)
+        try:
+            await controller.acquire(admission_control.get_priority(request.headers))
+        except AdmissionRejected as e:
+            timer.finish("rejected")
+            return JSONResponse(
+                content={"error": e.reason},
+                status_code=e.status_code,
+                headers={"Retry-After": str(int(math.ceil(e.retry_after)))}
+            )
+    try:
+        response = await handle_invocations(request, authorization, timer)
+    except BaseException:
+        if controller is not None:
+            controller.release()
+        timer.finish("error")
+        raise
+    if isinstance(response, StreamingResponse):
+        # finished and released by the end of the stream
+        response.body_iterator = timer.wrap_stream(response.body_iterator)
+        if controller is not None:
+            response = controller.release_on_close(response)
+    else:
+        if controller is not None:
+            controller.release()
+        status_code = getattr(response, "status_code", 200)
+        timer.finish(
+            "success" if status_code < 400 else "error",
+            output_tokens=get_output_tokens(response)
+        )
+    return response
+
+async def handle_invocations(request: Request, authorization: str, timer):
     # logger.info('invocations ......')
+    # embeddings and rerank requests need to be decoded to be batched
+    if engine.enable_passthrough and request_batcher is None:
+        return await passthrough(request, authorization, timer)
     payload = await request.json()
+    affinity_key = get_affinity_key(request.headers, payload, session_header=session_header) if enable_affinity else None
     # If the request does not have Authorization, invoke the payload
     if authorization is None:
-        return await invoke(payload)
+        return await invoke(payload, timer, affinity_key)
     # If the request has extra_headers, add Authorization to it
     if "extra_headers" in payload and "Authorization" not in payload["extra_headers"]:
         payload["extra_headers"]["Authorization"] = authorization
@@ -89,11 +204,13 @@ async def invocations(request: Request, authorization: str = Depends(get_authori
     elif "extra_headers" not in payload:
         payload["extra_headers"] = { "Authorization": authorization }
 
-    return await invoke(payload)
+    return await invoke(payload, timer, affinity_key)
 
 endpoints = {
     "ping": {"func": ping, "methods": ["GET"]},
     "health": {"func": health, "methods": ["GET"]},
+    "pool_stats": {"func": pool_stats, "methods": ["GET"]},
+    "metrics": {"func": metrics, "methods": ["GET"]},
     # Note: The functions for the POST endpoints all use "invocations".
     "invocations": {"func": invocations, "methods": ["POST"]},
     "v1/chat/completions": {"func": invocations, "methods": ["POST"]},
@@ -143,12 +260,34 @@ if __name__ == "__main__":
     logger.info(f"executable_config:\n{execute_model.executable_config.model_dump()}")
     engine = execute_model.get_engine()
     framework = execute_model.executable_config.current_framework
+    serving_metrics = ServingMetrics(model_id, model_tag, backend_type)
+    enable_affinity = framework.enable_affinity
+    session_header = framework.session_header
     engine.start()
+    serving_metrics.record_warmup(engine.get_warmup_stats())
+    if RequestBatcher.enabled(engine, execute_model.model_type, framework.max_batch_size):
+        logger.info(f"batching requests, max_batch_size: {framework.max_batch_size}, batch_window_ms: {framework.batch_window_ms}")
+        request_batcher = RequestBatcher(
+            engine,
+            execute_model.model_type,
+            max_batch_size=framework.max_batch_size,
+            batch_window_ms=framework.batch_window_ms
+        )
+    if AdmissionControl.enabled(framework.max_in_flight):
+        logger.info(f"admission control, max_in_flight: {framework.max_in_flight}, max_queue_size: {framework.max_queue_size}, max_queue_time: {framework.max_queue_time}")
+        admission_control = AdmissionControl(
+            max_in_flight=framework.max_in_flight,
+            max_queue_size=framework.max_queue_size,
+            max_queue_time=framework.max_queue_time,
+            retry_after=framework.retry_after,
+            priority_header=framework.priority_header
+        )
     uvicorn.run(
         app,
         host=host,
         port=port,
         log_level=framework.uvicorn_log_level,
         timeout_keep_alive=framework.timeout_keep_alive,
+        timeout_graceful_shutdown=framework.timeout_graceful_shutdown,
         limit_concurrency=framework.limit_concurrency,
     )
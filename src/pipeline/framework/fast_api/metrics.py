@@ -0,0 +1,279 @@
+import threading
+import time
+from typing import AsyncIterable, Dict, List, Tuple
+
+# Prometheus text exposition format, see
+# https://prometheus.io/docs/instrumenting/exposition_formats/
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+INTER_TOKEN_LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.02, 0.04, 0.06, 0.08, 0.1, 0.25, 0.5, 1, 2.5)
+TOKENS_PER_SECOND_BUCKETS = (1, 5, 10, 20, 40, 60, 80, 100, 150, 200, 500, 1000)
+
+
+def _format_labels(labels:Dict[str,str]) -> str:
+    if not labels:
+        return ""
+    items = ",".join(
+        '{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for k, v in labels.items()
+    )
+    return "{" + items + "}"
+
+
+def _format_value(value:float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+class Metric:
+    metric_type = "untyped"
+
+    def __init__(self, name:str, documentation:str, labelnames:List[str]):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = list(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels:dict) -> Tuple:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _samples(self):
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.metric_type}"
+        ]
+        with self._lock:
+            for suffix, labels, value in self._samples():
+                lines.append(f"{self.name}{suffix}{_format_labels(labels)} {_format_value(value)}")
+        return lines
+
+
+class Counter(Metric):
+    metric_type = "counter"
+
+    def inc(self, labels:dict, amount:float=1):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self):
+        for key, value in self._values.items():
+            yield "_total", dict(zip(self.labelnames, key)), value
+
+
+class Gauge(Metric):
+    metric_type = "gauge"
+
+    def inc(self, labels:dict, amount:float=1):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, labels:dict, amount:float=1):
+        self.inc(labels, -amount)
+
+    def set(self, labels:dict, value:float):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def _samples(self):
+        for key, value in self._values.items():
+            yield "", dict(zip(self.labelnames, key)), value
+
+
+class Histogram(Metric):
+    metric_type = "histogram"
+
+    def __init__(self, name:str, documentation:str, labelnames:List[str], buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, labels:dict, value:float):
+        key = self._key(labels)
+        with self._lock:
+            if key not in self._values:
+                self._values[key] = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            state = self._values[key]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state["buckets"][i] += 1
+                    break
+            state["sum"] += value
+            state["count"] += 1
+
+    def _samples(self):
+        for key, state in self._values.items():
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets, state["buckets"]):
+                cumulative += count
+                yield "_bucket", {**labels, "le": _format_value(bound)}, cumulative
+            yield "_sum", labels, state["sum"]
+            yield "_count", labels, state["count"]
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics:List[Metric] = []
+
+    def register(self, metric:Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+class RequestTimer:
+    """Records the timings of one request, from its arrival to the end of its response."""
+
+    def __init__(self, metrics:"ServingMetrics", labels:dict):
+        self.metrics = metrics
+        self.labels = labels
+        self.start_time = time.perf_counter()
+        self.engine_start_time = None
+        self.first_token_time = None
+        self.last_token_time = None
+        self.output_tokens = 0
+        self.finished = False
+        metrics.requests_in_flight.inc(labels)
+
+    def engine_started(self):
+        # the time spent before the engine is called, e.g. waiting for admission or a worker thread
+        self.engine_start_time = time.perf_counter()
+        self.metrics.queue_time.observe(self.labels, self.engine_start_time - self.start_time)
+
+    def on_token(self, count:int=1):
+        now = time.perf_counter()
+        if self.first_token_time is None:
+            self.first_token_time = now
+            self.metrics.time_to_first_token.observe(self.labels, now - self.start_time)
+        else:
+            self.metrics.inter_token_latency.observe(self.labels, (now - self.last_token_time) / count)
+        self.last_token_time = now
+        self.output_tokens += count
+
+    def finish(self, status:str="success", output_tokens:int=None):
+        if self.finished:
+            return
+        self.finished = True
+        now = time.perf_counter()
+        labels = self.labels
+        self.metrics.requests_in_flight.dec(labels)
+        self.metrics.requests.inc({**labels, "status": status})
+        self.metrics.request_latency.observe(labels, now - self.start_time)
+        if output_tokens is None:
+            output_tokens = self.output_tokens
+        if output_tokens:
+            self.metrics.output_tokens.inc(labels, output_tokens)
+            generation_start = self.first_token_time or self.engine_start_time or self.start_time
+            if now > generation_start:
+                self.metrics.tokens_per_second.observe(labels, output_tokens / (now - generation_start))
+
+    async def wrap_stream(self, content:AsyncIterable) -> AsyncIterable:
+        status = "success"
+        try:
+            async for chunk in content:
+                self.on_token(_count_stream_events(chunk))
+                yield chunk
+        except BaseException:
+            status = "error"
+            raise
+        finally:
+            self.finish(status)
+
+
+def _count_stream_events(chunk) -> int:
+    # every event of an openai compatible stream carries one token, a relayed
+    # chunk of bytes (passthrough mode) may hold several events
+    if isinstance(chunk, (bytes, bytearray)):
+        return max(chunk.count(b"\n\n") or chunk.count(b"\n"), 1)
+    return 1
+
+
+class ServingMetrics:
+    def __init__(self, model_id:str, model_tag:str, engine_type:str):
+        self.base_labels = {
+            "model_id": model_id or "",
+            "model_tag": model_tag or "",
+            "engine_type": engine_type or ""
+        }
+        labelnames = list(self.base_labels) + ["route"]
+        self.registry = MetricsRegistry()
+        register = self.registry.register
+        self.requests = register(Counter(
+            "emd_requests", "Number of finished requests.", labelnames + ["status"]))
+        self.requests_in_flight = register(Gauge(
+            "emd_requests_in_flight", "Number of requests being processed.", labelnames))
+        self.request_latency = register(Histogram(
+            "emd_request_latency_seconds", "End to end latency of requests.", labelnames))
+        self.queue_time = register(Histogram(
+            "emd_request_queue_time_seconds", "Time between the arrival of a request and the engine call.", labelnames))
+        self.time_to_first_token = register(Histogram(
+            "emd_time_to_first_token_seconds", "Time to the first token of streaming requests.", labelnames))
+        self.inter_token_latency = register(Histogram(
+            "emd_inter_token_latency_seconds", "Latency between tokens of streaming requests.", labelnames,
+            buckets=INTER_TOKEN_LATENCY_BUCKETS))
+        self.output_tokens = register(Counter(
+            "emd_output_tokens", "Number of generated tokens.", labelnames))
+        self.tokens_per_second = register(Histogram(
+            "emd_output_tokens_per_second", "Generation speed of requests.", labelnames,
+            buckets=TOKENS_PER_SECOND_BUCKETS))
+        self.engine_pool = register(Gauge(
+            "emd_engine_pool_connections", "Connections to the engine server.", list(self.base_labels) + ["pool", "state"]))
+        self.warmup_latency = register(Histogram(
+            "emd_warmup_latency_seconds", "Latency of the warmup requests run before serving.",
+            list(self.base_labels) + ["stream", "success"]))
+        self.warmup_time_to_first_token = register(Histogram(
+            "emd_warmup_time_to_first_token_seconds", "Time to the first token of streaming warmup requests.",
+            list(self.base_labels)))
+        self.admission_queue_size = register(Gauge(
+            "emd_admission_queue_size", "Number of requests waiting for admission.", labelnames))
+
+    def start_request(self, route:str) -> RequestTimer:
+        return RequestTimer(self, {**self.base_labels, "route": route})
+
+    def set_pool_stats(self, pool_stats:dict):
+        for pool in ["sync", "async"]:
+            for state in ["active", "idle", "requests"]:
+                if state in pool_stats.get(pool, {}):
+                    self.engine_pool.set(
+                        {**self.base_labels, "pool": pool, "state": state},
+                        pool_stats[pool][state]
+                    )
+
+    def record_warmup(self, warmup_stats:list):
+        for stat in warmup_stats:
+            self.warmup_latency.observe(
+                {**self.base_labels, "stream": str(stat["stream"]).lower(), "success": str(stat["success"]).lower()},
+                stat["latency"]
+            )
+            if stat.get("time_to_first_token") is not None:
+                self.warmup_time_to_first_token.observe(self.base_labels, stat["time_to_first_token"])
+
+    def set_admission_stats(self, admission_stats:dict):
+        for route, stats in admission_stats.items():
+            self.admission_queue_size.set({**self.base_labels, "route": route}, stats["queue_size"])
+
+    def render(self) -> str:
+        return self.registry.render()
+
+
+def get_output_tokens(response):
+    """completion tokens of a non-streaming response, if it reports usage"""
+    usage = response.get("usage") if isinstance(response, dict) else getattr(response, "usage", None)
+    if usage is None:
+        return None
+    if isinstance(usage, dict):
+        return usage.get("completion_tokens")
+    return getattr(usage, "completion_tokens", None)
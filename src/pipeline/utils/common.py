@@ -1,5 +1,6 @@
 import os
 import logging
+import tempfile
 import argparse
 import boto3
 
@@ -61,6 +62,27 @@ def upload_dir_to_s3_by_s5cmd(bucket_name, local_dir_name):
     assert os.system(f"./s5cmd cp {local_dir_name} {s3_path}") == 0
 
 
+def sync_files_to_s3_by_s5cmd(local_dir, bucket_name, s3_prefix, files, removed_files=()):
+    """Upload `files` (relative to `local_dir`) to `s3_prefix` and delete `removed_files`
+    from it, in one parallel s5cmd run."""
+    commands = [
+        f'cp "{os.path.join(local_dir, path)}" "s3://{bucket_name}/{s3_prefix}/{path}"'
+        for path in files
+    ] + [
+        f'rm "s3://{bucket_name}/{s3_prefix}/{path}"'
+        for path in removed_files
+    ]
+    if not commands:
+        return
+    logger.info(f"Uploading {len(files)} files to s3://{bucket_name}/{s3_prefix}, deleting {len(removed_files)} files")
+    with tempfile.NamedTemporaryFile("w", suffix=".s5cmd", delete=False) as f:
+        f.write("\n".join(commands) + "\n")
+    try:
+        assert os.system(f"./s5cmd run {f.name}") == 0
+    finally:
+        os.remove(f.name)
+
+
 def sync_s3_files_or_folders_to_local(s3_bucket, s3_key, local_path):
     logger.info("sync_s3_models_or_inputs_to_local start")
     s5cmd_command = f'./s5cmd sync s3://{s3_bucket}/{s3_key}/* {local_path}/'
@@ -0,0 +1,526 @@
+"""
+Parallel download of model files from Hugging Face, its mirrors, ModelScope and plain urls.
+
+The files of a repo are listed from all the endpoints at once, the first answer wins. The
+endpoints are then ranked by the throughput of a ranged GET of the largest file, and every
+file is downloaded from the fastest one. The files of all the repos and urls of a model are
+downloaded in parallel, within a global concurrency and an optional bandwidth budget. A
+partial file is kept next to its target (`<file>.emd_partial`) and resumed with a ranged
+GET, from the same or another endpoint: a file whose endpoint fails or stalls fails over
+to the next one instead of restarting the download of the repo. Large files are split into
+ranged parts downloaded over several connections, like hf_transfer, so that a model of one
+large file is not limited to the throughput of one connection. The parts done are recorded
+next to the partial file (`<file>.emd_parts`), so an interrupted download resumes them.
+
+Environment variables:
+    EMD_HUB_DOWNLOAD_CONCURRENCY: connections at once, over all the files and parts (default 8)
+    EMD_HUB_DOWNLOAD_MAX_MBPS: bandwidth budget of all the downloads in MiB/s (default unlimited)
+"""
+import json
+import logging
+import os
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from utils.model_fetcher import PARTIAL_SUFFIX, PARTS_SUFFIX
+from utils.model_manifest import file_sha256
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+DEFAULT_CONCURRENCY = 8
+CHUNK_SIZE = 1 * MB
+PROBE_SIZE = 1 * MB
+PROBE_TIMEOUT = 10
+# a read waiting longer than this fails the attempt
+READ_TIMEOUT = 30
+# an endpoint slower than STALL_MIN_RATE over STALL_WINDOW seconds is considered stalled
+STALL_WINDOW = 30
+STALL_MIN_RATE = 64 * 1024
+# attempts of a file on each of its endpoints
+MAX_ATTEMPTS = 3
+# files of at least RANGED_MIN_SIZE are downloaded in parts of PART_SIZE over several connections
+PART_SIZE = 64 * MB
+RANGED_MIN_SIZE = 2 * PART_SIZE
+MODELSCOPE_ENDPOINT = "https://www.modelscope.cn"
+
+
+class StalledError(IOError):
+    pass
+
+
+class RangeNotSupportedError(IOError):
+    pass
+
+
+class _RedirectHandler(urllib.request.HTTPRedirectHandler):
+    """Drops the token on redirects to another host, e.g. the CDN of Hugging Face."""
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        new_req = super().redirect_request(req, fp, code, msg, headers, newurl)
+        if new_req is not None and urllib.parse.urlsplit(newurl).netloc != urllib.parse.urlsplit(req.full_url).netloc:
+            new_req.remove_header("Authorization")
+        return new_req
+
+
+_opener = urllib.request.build_opener(_RedirectHandler)
+
+
+class RateLimiter:
+    """Token bucket shared by the downloads, `bytes_per_second` on average."""
+
+    def __init__(self, bytes_per_second:float):
+        self.bytes_per_second = bytes_per_second
+        self._available = bytes_per_second
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, size:int):
+        with self._lock:
+            now = time.monotonic()
+            self._available = min(
+                self.bytes_per_second,
+                self._available + (now - self._updated) * self.bytes_per_second
+            )
+            self._updated = now
+            self._available -= size
+            delay = -self._available / self.bytes_per_second if self._available < 0 else 0
+        if delay > 0:
+            time.sleep(delay)
+
+
+class DownloadJob:
+    """A file to download from the first of `urls` which works. An existing file is kept if
+    its size and sha256 match, unless `overwrite` is set and there is no sha256 to check."""
+
+    def __init__(
+            self,
+            urls:List[str],
+            path:str,
+            size:Optional[int] = None,
+            sha256:Optional[str] = None,
+            headers:Optional[Dict[str, str]] = None,
+            overwrite:bool = False
+        ):
+        self.urls = urls
+        self.path = path
+        self.size = size
+        self.sha256 = sha256
+        self.headers = headers or {}
+        self.overwrite = overwrite
+
+
+def probe_throughput(url:str, headers:Optional[Dict[str, str]] = None, timeout:float = PROBE_TIMEOUT) -> float:
+    """Bytes per second of a ranged GET of the first PROBE_SIZE bytes of `url`, 0 if it fails."""
+    request = urllib.request.Request(url, headers={**(headers or {}), "Range": f"bytes=0-{PROBE_SIZE - 1}"})
+    started = time.monotonic()
+    size = 0
+    try:
+        with _opener.open(request, timeout=timeout) as response:
+            while size < PROBE_SIZE:
+                chunk = response.read(64 * 1024)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if time.monotonic() - started > timeout:
+                    break
+    except Exception as e:
+        logger.warning(f"endpoint of {url} not reachable: {e}")
+        return 0.0
+    return size / max(time.monotonic() - started, 1e-3)
+
+
+def rank_endpoints(probe_urls:Dict[str, str], headers:Optional[Dict[str, str]] = None) -> List[str]:
+    """The endpoints, fastest first by the throughput of their probe url, probed at once.
+    Unreachable endpoints are last, they may still work for other files."""
+    if len(probe_urls) <= 1:
+        return list(probe_urls)
+    with ThreadPoolExecutor(max_workers=len(probe_urls)) as executor:
+        futures = {
+            endpoint: executor.submit(probe_throughput, url, headers)
+            for endpoint, url in probe_urls.items()
+        }
+        throughputs = {endpoint: future.result() for endpoint, future in futures.items()}
+    ranked = sorted(throughputs, key=lambda endpoint: -throughputs[endpoint])
+    logger.info("endpoints by throughput: " + ", ".join(
+        f"{endpoint} {throughputs[endpoint] / MB:.1f} MiB/s" for endpoint in ranked
+    ))
+    return ranked
+
+
+def race(calls:Dict[str, Callable]) -> Tuple[str, object]:
+    """The key and result of the first of `calls` to succeed, all run at once."""
+    executor = ThreadPoolExecutor(max_workers=len(calls))
+    try:
+        futures = {executor.submit(call): key for key, call in calls.items()}
+        error = None
+        for future in as_completed(futures):
+            try:
+                return futures[future], future.result()
+            except Exception as e:
+                logger.warning(f"{futures[future]} failed: {e}")
+                error = e
+        raise error
+    finally:
+        # the slower calls finish in the background
+        executor.shutdown(wait=False)
+
+
+class HubDownloader:
+    def __init__(
+            self,
+            max_concurrency:Optional[int] = None,
+            max_bytes_per_second:Optional[float] = None,
+            split_files:bool = True
+        ):
+        """
+        Args:
+            split_files: Download large files in ranged parts over several connections,
+                one connection per file otherwise.
+        """
+        self.max_concurrency = max_concurrency or int(os.environ.get("EMD_HUB_DOWNLOAD_CONCURRENCY") or DEFAULT_CONCURRENCY)
+        if max_bytes_per_second is None and os.environ.get("EMD_HUB_DOWNLOAD_MAX_MBPS"):
+            max_bytes_per_second = float(os.environ["EMD_HUB_DOWNLOAD_MAX_MBPS"]) * MB
+        self.rate_limiter = RateLimiter(max_bytes_per_second) if max_bytes_per_second else None
+        self.split_files = split_files
+        # the connections of all the files and parts
+        self._connections = threading.BoundedSemaphore(self.max_concurrency)
+        # endpoints ranked once for all the repos of a model
+        self._ranked_endpoints: Dict[tuple, List[str]] = {}
+
+    def _rank_endpoints(self, endpoints:List[str], probe_urls:Dict[str, str], headers:Dict[str, str]) -> List[str]:
+        key = tuple(endpoints)
+        if key not in self._ranked_endpoints:
+            ranked = rank_endpoints(probe_urls, headers)
+            # the endpoints without a probe url, e.g. which did not list the repo, last
+            self._ranked_endpoints[key] = ranked + [endpoint for endpoint in endpoints if endpoint not in ranked]
+        return self._ranked_endpoints[key]
+
+    def get_huggingface_jobs(
+            self,
+            repo_id:str,
+            local_dir:str,
+            endpoints:List[str],
+            revision:Optional[str] = None,
+            token:Optional[str] = None,
+            allow_patterns=None,
+            ignore_patterns=None,
+            **kwargs
+        ) -> Tuple[str, List[DownloadJob]]:
+        """The commit and the download jobs of the files of a Hugging Face repo."""
+        from huggingface_hub import HfApi, hf_hub_url
+        from huggingface_hub.utils import filter_repo_objects
+        if kwargs:
+            logger.warning(f"ignore unsupported download kwargs of {repo_id}: {list(kwargs)}")
+        if isinstance(endpoints, str):
+            endpoints = [endpoints]
+        if token is None:
+            try:
+                from huggingface_hub import get_token
+                token = get_token()
+            except ImportError:
+                pass
+        headers = {"Authorization": f"Bearer {token}"} if token else {}
+
+        endpoint, info = race({
+            endpoint: (lambda endpoint=endpoint: HfApi(endpoint=endpoint, token=token).model_info(
+                repo_id, revision=revision, files_metadata=True
+            ))
+            for endpoint in endpoints
+        })
+        logger.info(f"{repo_id} revision {info.sha} listed from {endpoint}")
+        siblings = {sibling.rfilename: sibling for sibling in info.siblings}
+        paths = list(filter_repo_objects(list(siblings), allow_patterns=allow_patterns, ignore_patterns=ignore_patterns))
+        if not paths:
+            return info.sha, []
+
+        largest = max(paths, key=lambda path: siblings[path].size or 0)
+        ranked = self._rank_endpoints(
+            endpoints,
+            {endpoint: hf_hub_url(repo_id, largest, revision=info.sha, endpoint=endpoint) for endpoint in endpoints},
+            headers
+        )
+        jobs = []
+        for path in paths:
+            sibling = siblings[path]
+            jobs.append(DownloadJob(
+                # the commit, not the branch, so that the endpoints serve the same content
+                urls=[hf_hub_url(repo_id, path, revision=info.sha, endpoint=endpoint) for endpoint in ranked],
+                path=os.path.join(local_dir, *path.split("/")),
+                size=sibling.size,
+                sha256=sibling.lfs.sha256 if sibling.lfs is not None else None,
+                headers=headers,
+                # the files asked for explicitly, e.g. the ones changed upstream
+                overwrite=allow_patterns is not None
+            ))
+        return info.sha, jobs
+
+    def get_modelscope_jobs(
+            self,
+            repo_id:str,
+            local_dir:str,
+            revision:str = "master",
+            allow_patterns=None,
+            ignore_patterns=None
+        ) -> List[DownloadJob]:
+        """The download jobs of the files of a ModelScope repo."""
+        from huggingface_hub.utils import filter_repo_objects
+        from modelscope.hub.api import HubApi
+        endpoint = os.environ.get("MODELSCOPE_DOMAIN")
+        endpoint = f"https://{endpoint}" if endpoint else MODELSCOPE_ENDPOINT
+        files = {
+            f["Path"]: f
+            for f in HubApi().get_model_files(repo_id, revision=revision, recursive=True)
+            if f.get("Type") != "tree"
+        }
+        jobs = []
+        for path in filter_repo_objects(list(files), allow_patterns=allow_patterns, ignore_patterns=ignore_patterns):
+            query = urllib.parse.urlencode({"Revision": revision, "FilePath": path})
+            jobs.append(DownloadJob(
+                urls=[f"{endpoint}/api/v1/models/{repo_id}/repo?{query}"],
+                path=os.path.join(local_dir, *path.split("/")),
+                size=files[path].get("Size"),
+                sha256=files[path].get("Sha256") or None,
+                overwrite=allow_patterns is not None
+            ))
+        return jobs
+
+    def get_url_job(self, url:str, local_dir:str, endpoints:Optional[List[str]] = None) -> DownloadJob:
+        """The download job of a url into `local_dir`, like `wget -P`. A url of one of the
+        Hugging Face `endpoints` can be downloaded from the others too."""
+        endpoints = [endpoint.rstrip("/") for endpoint in endpoints or []]
+        path = os.path.join(local_dir, os.path.basename(urllib.parse.urlsplit(url).path))
+        for endpoint in endpoints:
+            if url.startswith(endpoint + "/"):
+                relative_url = url[len(endpoint):]
+                ranked = self._rank_endpoints(
+                    endpoints,
+                    {other: other + relative_url for other in endpoints},
+                    {}
+                )
+                return DownloadJob(urls=[endpoint + relative_url for endpoint in ranked], path=path)
+        return DownloadJob(urls=[url], path=path)
+
+    def _fetch(self, url:str, job:DownloadJob, partial_path:str):
+        offset = os.path.getsize(partial_path) if os.path.exists(partial_path) else 0
+        if job.size is not None and offset > job.size:
+            offset = 0
+        if job.size is not None and offset == job.size:
+            return
+        headers = dict(job.headers)
+        if offset:
+            headers["Range"] = f"bytes={offset}-"
+        with self._connections:
+            try:
+                response = _opener.open(urllib.request.Request(url, headers=headers), timeout=READ_TIMEOUT)
+            except urllib.error.HTTPError as e:
+                if e.code == 416 and offset and job.size is None:
+                    # the partial file is complete
+                    return
+                raise
+            with response:
+                if offset and response.status != 206:
+                    # the endpoint does not support ranges, start over
+                    offset = 0
+                with open(partial_path, "ab" if offset else "wb") as f:
+                    self._copy(response, f, url)
+        if job.size is not None and os.path.getsize(partial_path) != job.size:
+            raise IOError(f"incomplete download of {url}: {os.path.getsize(partial_path)} of {job.size} bytes")
+
+    def _copy(self, response, f, url:str) -> int:
+        """Write the body of `response` to `f`. Returns the number of bytes written."""
+        written = 0
+        window_time, window_size = 0.0, 0
+        while True:
+            read_started = time.monotonic()
+            # what is received, not a full chunk, to tell a stalled endpoint
+            chunk = response.read1(CHUNK_SIZE)
+            # the time waiting for the rate limiter does not count
+            window_time += time.monotonic() - read_started
+            if not chunk:
+                return written
+            f.write(chunk)
+            written += len(chunk)
+            window_size += len(chunk)
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire(len(chunk))
+            if window_time >= STALL_WINDOW:
+                if window_size / window_time < STALL_MIN_RATE:
+                    raise StalledError(f"{window_size / window_time / 1024:.0f} KiB/s from {url}")
+                window_time, window_size = 0.0, 0
+
+    def _fetch_part(self, url:str, job:DownloadJob, partial_path:str, part:int):
+        start = part * PART_SIZE
+        end = min(job.size, start + PART_SIZE) - 1
+        headers = {**job.headers, "Range": f"bytes={start}-{end}"}
+        with self._connections:
+            with _opener.open(urllib.request.Request(url, headers=headers), timeout=READ_TIMEOUT) as response:
+                if response.status != 206:
+                    raise RangeNotSupportedError(f"{url} does not support ranged requests")
+                with open(partial_path, "r+b") as f:
+                    f.seek(start)
+                    written = self._copy(response, f, url)
+        if written != end - start + 1:
+            raise IOError(f"incomplete download of part {part} of {url}: {written} of {end - start + 1} bytes")
+
+    def _load_parts(self, job:DownloadJob, partial_path:str, parts_path:str) -> set:
+        """The parts already in the partial file."""
+        if not os.path.exists(partial_path):
+            return set()
+        if os.path.exists(parts_path):
+            try:
+                with open(parts_path) as f:
+                    parts = json.load(f)
+            except (OSError, ValueError):
+                return set()
+            if parts.get("size") == job.size and parts.get("part_size") == PART_SIZE:
+                return set(parts["done"])
+            return set()
+        # the partial file of a download over one connection, its complete parts are kept
+        size = os.path.getsize(partial_path)
+        return set(range(size // PART_SIZE)) if size <= job.size else set()
+
+    def _save_parts(self, job:DownloadJob, parts_path:str, done:set):
+        tmp_path = f"{parts_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"size": job.size, "part_size": PART_SIZE, "done": sorted(done)}, f)
+        os.replace(tmp_path, parts_path)
+
+    def _fetch_parts(self, url:str, job:DownloadJob, partial_path:str):
+        """Download the missing parts of the file from `url`, over several connections. The
+        parts done are kept when a part fails, the next attempt only downloads the others."""
+        parts_path = job.path + PARTS_SUFFIX
+        done = self._load_parts(job, partial_path, parts_path)
+        with open(partial_path, "r+b" if done else "wb") as f:
+            # sparse, the parts are written at their offsets
+            f.truncate(job.size)
+        self._save_parts(job, parts_path, done)
+        pending = [part for part in range(-(-job.size // PART_SIZE)) if part not in done]
+        if not pending:
+            return
+        error = None
+        with ThreadPoolExecutor(
+                max_workers=min(self.max_concurrency, len(pending)),
+                thread_name_prefix="emd-hub-download-part"
+            ) as executor:
+            futures = {executor.submit(self._fetch_part, url, job, partial_path, part): part for part in pending}
+            while futures:
+                finished, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    part = futures.pop(future)
+                    if future.cancelled():
+                        continue
+                    if future.exception() is not None:
+                        if error is None:
+                            error = future.exception()
+                            # the parts in flight are kept
+                            for other in futures:
+                                other.cancel()
+                        continue
+                    done.add(part)
+                    self._save_parts(job, parts_path, done)
+        if error is not None:
+            raise error
+
+    def _is_downloaded(self, job:DownloadJob) -> bool:
+        if not os.path.exists(job.path):
+            return False
+        if job.size is not None and os.path.getsize(job.path) != job.size:
+            return False
+        if job.sha256 is not None:
+            # the file may be of another revision with the same size
+            if file_sha256(job.path) == job.sha256:
+                return True
+            logger.info(f"sha256 mismatch of the existing {job.path}, download again")
+            return False
+        return not job.overwrite
+
+    @staticmethod
+    def _remove_partial(partial_path:str, parts_path:str):
+        for path in (partial_path, parts_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def download_file(self, job:DownloadJob):
+        if self._is_downloaded(job):
+            return
+        os.makedirs(os.path.dirname(job.path) or ".", exist_ok=True)
+        partial_path = job.path + PARTIAL_SUFFIX
+        parts_path = job.path + PARTS_SUFFIX
+        if job.overwrite and job.sha256 is None:
+            # may be a part of the previous revision, which can not be told apart without a hash
+            self._remove_partial(partial_path, parts_path)
+        ranged = self.split_files and job.size is not None and job.size >= RANGED_MIN_SIZE
+        if not ranged and os.path.exists(parts_path):
+            # the sparse partial file of a ranged download, not a prefix of the file
+            self._remove_partial(partial_path, parts_path)
+        started = time.monotonic()
+        for attempt in range(MAX_ATTEMPTS * len(job.urls)):
+            url = job.urls[attempt % len(job.urls)]
+            try:
+                if ranged:
+                    self._fetch_parts(url, job, partial_path)
+                else:
+                    self._fetch(url, job, partial_path)
+            except RangeNotSupportedError as e:
+                logger.info(f"{e}, download {job.path} over one connection")
+                ranged = False
+                # the sparse partial file can not be resumed over one connection
+                self._remove_partial(partial_path, parts_path)
+                continue
+            except Exception as e:
+                if attempt == MAX_ATTEMPTS * len(job.urls) - 1:
+                    raise
+                # the partial file is resumed from the next endpoint
+                next_url = job.urls[(attempt + 1) % len(job.urls)]
+                logger.warning(f"failed to download {url}, resume from {next_url}: {e}")
+                continue
+            if job.sha256 is not None:
+                if file_sha256(partial_path) != job.sha256:
+                    self._remove_partial(partial_path, parts_path)
+                    logger.warning(f"sha256 mismatch of {url}, download again")
+                    continue
+            break
+        else:
+            raise IOError(f"failed to download {job.path} from {job.urls}")
+        os.replace(partial_path, job.path)
+        if os.path.exists(parts_path):
+            os.remove(parts_path)
+        size = os.path.getsize(job.path)
+        elapsed = time.monotonic() - started
+        logger.info(f"downloaded {job.path} ({size / MB:.1f} MiB) in {elapsed:.1f}s, {size / MB / max(elapsed, 1e-3):.1f} MiB/s")
+
+    def download(self, jobs:Iterable[DownloadJob]):
+        """Download the jobs in parallel, the largest first. Raises the first error, the
+        partial files of the other jobs are resumed by the next download."""
+        jobs = sorted(jobs, key=lambda job: -(job.size or 0))
+        total_size = sum(job.size or 0 for job in jobs)
+        logger.info(f"downloading {len(jobs)} files ({total_size / MB:.0f} MiB) with {self.max_concurrency} connections")
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="emd-hub-download") as executor:
+            futures = {executor.submit(self.download_file, job) for job in jobs}
+            while futures:
+                done, futures = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    try:
+                        future.result()
+                    except BaseException:
+                        for other in futures:
+                            other.cancel()
+                        raise
+        logger.info(f"downloaded {len(jobs)} files in {time.monotonic() - started:.1f}s")
+
+    def download_huggingface_repo(self, repo_id:str, local_dir:str, endpoints:List[str], **kwargs) -> str:
+        """Download the files of a Hugging Face repo, see `get_huggingface_jobs`. Returns the commit."""
+        revision, jobs = self.get_huggingface_jobs(repo_id, local_dir, endpoints, **kwargs)
+        self.download(jobs)
+        return revision
+
+    def download_modelscope_repo(self, repo_id:str, local_dir:str, **kwargs):
+        """Download the files of a ModelScope repo, see `get_modelscope_jobs`."""
+        self.download(self.get_modelscope_jobs(repo_id, local_dir, **kwargs))
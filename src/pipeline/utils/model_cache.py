@@ -0,0 +1,208 @@
+"""
+Cache of model files on the host, shared by the containers of the host across restarts,
+tags and scale-out, e.g. the tasks of an ECS cluster on EC2 instances.
+
+The host directory `EMD_MODEL_CACHE_DIR` is mounted into the container. Each version of
+the model files (artifact) is downloaded once into an entry keyed by the hash of its
+files, their sha256 from the prepare_model manifest or their ETag otherwise:
+
+    <root>/entries/<key>/       the model files
+    <root>/entries/<key>.json   the S3 location, size and last use of the entry
+    <root>/locks/<key>.lock     flock: exclusive while downloading, shared while in use
+
+A container waiting for the lock of an entry another container is downloading uses the
+entry once it is complete, instead of downloading it again. Entries are evicted least
+recently used first when the cache would exceed `EMD_MODEL_CACHE_MAX_SIZE_GB`, except for
+the entries in use. The files are linked into the model dir of the container, weights as
+symlinks and the other files as copies, so that the model files modify hooks do not
+change the cache.
+"""
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+from typing import List, Optional
+
+from utils.model_fetcher import (
+    PARTIAL_SUFFIX,
+    PARTS_SUFFIX,
+    STATE_FILE_NAME,
+    ModelFetcher,
+    is_weight_file,
+    parse_s3_path,
+)
+
+logger = logging.getLogger(__name__)
+
+GB = 1024 ** 3
+DEFAULT_MAX_SIZE_GB = 100
+
+
+def get_artifact_key(files) -> str:
+    """The hash of the relative path, size and content hash (or ETag) of the files."""
+    digest = hashlib.sha256()
+    for task in sorted(files, key=lambda task: task.relative_path):
+        digest.update(f"{task.relative_path}\0{task.size}\0{task.sha256 or task.etag}\n".encode("utf-8"))
+    return digest.hexdigest()[:32]
+
+
+class ModelCache:
+    def __init__(self, root:str, max_bytes:int = DEFAULT_MAX_SIZE_GB * GB):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.entries_dir = os.path.join(root, "entries")
+        self.locks_dir = os.path.join(root, "locks")
+        os.makedirs(self.entries_dir, exist_ok=True)
+        os.makedirs(self.locks_dir, exist_ok=True)
+        # locks of the entries this process uses, held until it exits
+        self._held = {}
+
+    def _meta_path(self, key:str) -> str:
+        return os.path.join(self.entries_dir, f"{key}.json")
+
+    def _read_meta(self, key:str) -> Optional[dict]:
+        try:
+            with open(self._meta_path(key)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_meta(self, key:str, meta:dict):
+        path = self._meta_path(key)
+        # the containers sharing an entry all update its last use
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, path)
+
+    def _open_lock(self, key:str) -> int:
+        return os.open(os.path.join(self.locks_dir, f"{key}.lock"), os.O_RDWR | os.O_CREAT, 0o644)
+
+    def _list_entries(self) -> List[dict]:
+        entries = []
+        for name in os.listdir(self.entries_dir):
+            if not name.endswith(".json"):
+                continue
+            meta = self._read_meta(name[:-len(".json")])
+            if meta is not None:
+                entries.append(meta)
+        return entries
+
+    def _evict(self, needed:int, keep:str):
+        """Remove the least recently used entries not in use until `needed` bytes fit."""
+        fd = os.open(os.path.join(self.root, ".evict.lock"), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            entries = sorted(
+                (entry for entry in self._list_entries() if entry["key"] != keep),
+                key=lambda entry: entry.get("last_used", 0)
+            )
+            used = sum(entry["size"] for entry in entries)
+            for entry in entries:
+                if used + needed <= self.max_bytes:
+                    break
+                lock_fd = self._open_lock(entry["key"])
+                try:
+                    fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    # in use by another container
+                    os.close(lock_fd)
+                    continue
+                try:
+                    logger.info(f"evicting {entry['source']} ({entry['size'] / GB:.1f} GiB) from the model cache")
+                    os.remove(self._meta_path(entry["key"]))
+                    shutil.rmtree(os.path.join(self.entries_dir, entry["key"]), ignore_errors=True)
+                    used -= entry["size"]
+                finally:
+                    os.close(lock_fd)
+            if used + needed > self.max_bytes:
+                logger.warning(
+                    f"model cache over its budget of {self.max_bytes / GB:.0f} GiB: "
+                    f"{(used + needed) / GB:.1f} GiB, the other entries are in use"
+                )
+        finally:
+            os.close(fd)
+
+    def get(self, fetcher:ModelFetcher, bucket:str = None, prefix:str = None, s3_path:str = None) -> str:
+        """The cache entry of the model files under `s3_path` (or `bucket`/`prefix`),
+        downloaded by `fetcher` if it is not in the cache yet."""
+        if s3_path is not None:
+            bucket, prefix = parse_s3_path(s3_path)
+        prefix = (prefix or "").strip("/")
+        source = f"s3://{bucket}/{prefix}"
+        files = fetcher.list_files(bucket, prefix, self.entries_dir)
+        key = get_artifact_key(files)
+        entry_dir = os.path.join(self.entries_dir, key)
+        size = sum(task.size for task in files)
+
+        lock_fd = self._open_lock(key)
+        try:
+            fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            # in use, or being downloaded by another container
+            meta = self._read_meta(key)
+            if meta is None or not meta.get("complete"):
+                logger.info(f"waiting for another container downloading {source} into the model cache")
+            fcntl.flock(lock_fd, fcntl.LOCK_SH)
+            meta = self._read_meta(key)
+            if meta is None or not meta.get("complete"):
+                # the download failed or the entry was evicted meanwhile
+                fcntl.flock(lock_fd, fcntl.LOCK_EX)
+
+        meta = self._read_meta(key)
+        if meta is not None and meta.get("complete"):
+            logger.info(f"model cache hit: {source} in {entry_dir}")
+        else:
+            logger.info(f"model cache miss: downloading {source} ({size / GB:.1f} GiB) into {entry_dir}")
+            self._evict(size, keep=key)
+            meta = {"key": key, "source": source, "size": size, "complete": False}
+            self._write_meta(key, {**meta, "last_used": time.time()})
+            # resumes the download of a container which stopped before it completed
+            fetcher.fetch(entry_dir, bucket=bucket, prefix=prefix)
+            meta["complete"] = True
+        meta["last_used"] = time.time()
+        self._write_meta(key, meta)
+        # keeps the entry from being evicted while this container runs
+        fcntl.flock(lock_fd, fcntl.LOCK_SH)
+        self._held[key] = lock_fd
+        return entry_dir
+
+    def fetch(self, local_dir:str, fetcher:ModelFetcher, bucket:str = None, prefix:str = None, s3_path:str = None):
+        """`ModelFetcher.fetch` through the cache: the files are linked into `local_dir`."""
+        link_model_dir(self.get(fetcher, bucket=bucket, prefix=prefix, s3_path=s3_path), local_dir)
+
+
+def link_model_dir(entry_dir:str, local_dir:str):
+    """Symlinks to the weights of the cache entry and copies of its other files."""
+    for root, _, filenames in os.walk(entry_dir):
+        for filename in filenames:
+            if filename == STATE_FILE_NAME or filename.endswith((PARTS_SUFFIX, PARTIAL_SUFFIX)):
+                continue
+            source = os.path.join(root, filename)
+            relative_path = os.path.relpath(source, entry_dir)
+            target = os.path.join(local_dir, relative_path)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            if os.path.lexists(target):
+                os.remove(target)
+            if is_weight_file(relative_path):
+                os.symlink(source, target)
+            else:
+                shutil.copy2(source, target)
+
+
+_model_cache = None
+
+
+def get_model_cache() -> Optional[ModelCache]:
+    """The cache in `EMD_MODEL_CACHE_DIR`, None if it is not set."""
+    global _model_cache
+    root = os.environ.get("EMD_MODEL_CACHE_DIR")
+    if not root:
+        return None
+    if _model_cache is None:
+        max_size_gb = float(os.environ.get("EMD_MODEL_CACHE_MAX_SIZE_GB") or DEFAULT_MAX_SIZE_GB)
+        _model_cache = ModelCache(root, max_bytes=int(max_size_gb * GB))
+    return _model_cache
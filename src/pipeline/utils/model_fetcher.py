@@ -0,0 +1,522 @@
+"""
+Parallel, resumable download of the model files from S3 into the serving container.
+
+All objects under the model prefix, including nested directories, are split into parts
+which are fetched with ranged GETs by a pool of threads and written in place, so one
+large safetensors file is downloaded over many connections at once. The completed parts
+of each file are recorded next to it (`<file>.emd_parts`), so a restarted download only
+fetches the missing parts, and completed files are recorded in `.emd_fetch_state.json`.
+Files with a sha256 in the manifest written by prepare_model are verified before they are
+moved in place. Progress and throughput are logged every few seconds.
+
+In ordered mode, the config, tokenizer and index files are fetched first, then the weight
+shards in name order, the order transformers and vllm load them. `ModelFetcher.start` runs
+the download in the background and returns a `ModelFetch` that tells when each file is in
+place, so the engine can load the first shards while the last ones are still downloading.
+
+The concurrency, part size and verification are set by the `model_fetch_concurrency`,
+`model_fetch_part_size_mb` and `verify_model_files` engine params.
+"""
+import hashlib
+import json
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Dict, Iterable, List, Optional
+
+from botocore.config import Config
+
+from emd.constants import EMD_MODEL_MANIFEST_FILE_NAME
+from emd.utils.aws_client_factory import get_client
+from utils.model_manifest import read_manifest
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+DEFAULT_PART_SIZE = 64 * MB
+MIN_CONCURRENCY = 8
+MAX_CONCURRENCY = 64
+MAX_PART_ATTEMPTS = 5
+READ_CHUNK_SIZE = 1 * MB
+VERIFY_CONCURRENCY = 4
+PROGRESS_INTERVAL = 10
+
+# weights are fetched after the other files of the model, in name order
+WEIGHT_FILE_SUFFIXES = (".safetensors", ".bin", ".pt", ".pth", ".gguf", ".ckpt", ".h5", ".msgpack", ".onnx")
+
+PARTS_SUFFIX = ".emd_parts"
+PARTIAL_SUFFIX = ".emd_partial"
+STATE_FILE_NAME = ".emd_fetch_state.json"
+
+
+def get_default_concurrency(instance_type:Optional[str] = None) -> int:
+    """Parts fetched at once, 2 per vCPU of the instance: larger instances have more
+    network bandwidth and more cores for the TLS and checksums."""
+    vcpu = None
+    if instance_type:
+        try:
+            from emd.models import Instance
+            vcpu = Instance.get_instance_from_instance_type(instance_type).vcpu
+        except (ImportError, KeyError):
+            pass
+    vcpu = vcpu or os.cpu_count() or 4
+    return max(MIN_CONCURRENCY, min(MAX_CONCURRENCY, vcpu * 2))
+
+
+def parse_s3_path(s3_path:str):
+    bucket, _, key = s3_path[len("s3://"):].partition("/")
+    return bucket, key.rstrip("/")
+
+
+def is_weight_file(relative_path:str) -> bool:
+    return relative_path.endswith(WEIGHT_FILE_SUFFIXES)
+
+
+def get_fetch_order(relative_path:str, size:int):
+    """Sort key of the ordered mode: the small files the engine reads first (config,
+    tokenizer, shard index), then the shards in name order."""
+    if is_weight_file(relative_path):
+        return (1, 0, relative_path)
+    return (0, size, relative_path)
+
+
+class _FileTask:
+    def __init__(self, key:str, relative_path:str, local_path:str, size:int, etag:str, part_size:int, sha256:Optional[str]):
+        self.key = key
+        self.relative_path = relative_path
+        self.local_path = local_path
+        self.size = size
+        self.etag = etag
+        self.sha256 = sha256
+        self.part_size = part_size
+        # none for an empty object, whose file _prepare_file creates
+        self.num_parts = -(-size // part_size)
+        self.done_parts = set()
+
+    @property
+    def partial_path(self) -> str:
+        return self.local_path + PARTIAL_SUFFIX
+
+    @property
+    def parts_path(self) -> str:
+        return self.local_path + PARTS_SUFFIX
+
+    def load_parts(self):
+        """The parts of an interrupted download of the same object."""
+        try:
+            with open(self.parts_path) as f:
+                parts = json.load(f)
+        except (OSError, ValueError):
+            return
+        if (
+            parts.get("etag") == self.etag
+            and parts.get("part_size") == self.part_size
+            and os.path.exists(self.partial_path)
+            and os.path.getsize(self.partial_path) == self.size
+        ):
+            self.done_parts = set(parts["done"])
+
+    def save_parts(self):
+        tmp_path = f"{self.parts_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"etag": self.etag, "part_size": self.part_size, "done": sorted(self.done_parts)}, f)
+        os.replace(tmp_path, self.parts_path)
+
+    def get_range(self, part:int):
+        start = part * self.part_size
+        return start, min(self.size, start + self.part_size) - 1
+
+
+class ModelFetcher:
+    def __init__(
+            self,
+            s3_client=None,
+            max_concurrency:Optional[int] = None,
+            part_size:Optional[int] = None,
+            verify:bool = True,
+            instance_type:Optional[str] = None
+        ):
+        self.max_concurrency = max_concurrency or get_default_concurrency(instance_type)
+        self.part_size = part_size or DEFAULT_PART_SIZE
+        self.verify = verify
+        # the retries and keepalive of the shared clients, with a connection per part in flight
+        self.s3_client = s3_client or get_client(
+            "s3",
+            config=Config(max_pool_connections=self.max_concurrency + 8)
+        )
+        self._bytes_done = 0
+        self._bytes_lock = threading.Lock()
+
+    def list_files(self, bucket:str, prefix:str, local_dir:str) -> List[_FileTask]:
+        manifest = read_manifest(self.s3_client, bucket, prefix) or {}
+        manifest_files = manifest.get("files", {})
+        list_prefix = f"{prefix}/" if prefix else ""
+        tasks = []
+        paginator = self.s3_client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=bucket, Prefix=list_prefix):
+            for obj in page.get("Contents", []):
+                relative_path = obj["Key"][len(list_prefix):]
+                if not relative_path or relative_path.endswith("/") or relative_path == EMD_MODEL_MANIFEST_FILE_NAME:
+                    # the prefix itself, a folder placeholder or the manifest
+                    continue
+                tasks.append(_FileTask(
+                    key=obj["Key"],
+                    relative_path=relative_path,
+                    local_path=os.path.join(local_dir, *relative_path.split("/")),
+                    size=obj["Size"],
+                    etag=obj["ETag"].strip('"'),
+                    part_size=self.part_size,
+                    sha256=manifest_files.get(relative_path, {}).get("sha256")
+                ))
+        return tasks
+
+    def _read_state(self, local_dir:str) -> Dict[str, str]:
+        try:
+            with open(os.path.join(local_dir, STATE_FILE_NAME)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_state(self, local_dir:str, state:Dict[str, str]):
+        state_path = os.path.join(local_dir, STATE_FILE_NAME)
+        with open(f"{state_path}.tmp", "w") as f:
+            json.dump(state, f)
+        os.replace(f"{state_path}.tmp", state_path)
+
+    def _fetch_part(self, bucket:str, task:_FileTask, part:int):
+        start, end = task.get_range(part)
+        for attempt in range(MAX_PART_ATTEMPTS):
+            written = 0
+            try:
+                response = self.s3_client.get_object(
+                    Bucket=bucket,
+                    Key=task.key,
+                    Range=f"bytes={start}-{end}",
+                    # fails if the object is replaced during the download
+                    IfMatch=task.etag
+                )
+                body = response["Body"]
+                fd = os.open(task.partial_path, os.O_WRONLY)
+                try:
+                    while True:
+                        chunk = body.read(READ_CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        os.pwrite(fd, chunk, start + written)
+                        written += len(chunk)
+                        self._add_bytes(len(chunk))
+                finally:
+                    os.close(fd)
+                    body.close()
+                if written != end - start + 1:
+                    raise IOError(f"short read of {task.key} part {part}: {written} of {end - start + 1} bytes")
+                return
+            except Exception as e:
+                self._add_bytes(-written)
+                if attempt == MAX_PART_ATTEMPTS - 1:
+                    raise
+                delay = random.uniform(0, min(10, 0.5 * 2 ** attempt))
+                logger.warning(f"failed to fetch {task.key} part {part}, retry in {delay:.1f}s: {e}")
+                time.sleep(delay)
+
+    def _add_bytes(self, size:int):
+        with self._bytes_lock:
+            self._bytes_done += size
+
+    def _complete_file(self, task:_FileTask):
+        if self.verify and task.sha256:
+            digest = hashlib.sha256()
+            with open(task.partial_path, "rb") as f:
+                while True:
+                    chunk = f.read(8 * MB)
+                    if not chunk:
+                        break
+                    digest.update(chunk)
+            if digest.hexdigest() != task.sha256:
+                # downloaded again from scratch by the next attempt
+                os.remove(task.partial_path)
+                os.remove(task.parts_path)
+                raise IOError(f"sha256 mismatch of {task.relative_path}: {digest.hexdigest()} != {task.sha256}")
+        os.replace(task.partial_path, task.local_path)
+        try:
+            os.remove(task.parts_path)
+        except FileNotFoundError:
+            pass
+
+    def _prepare_file(self, task:_FileTask):
+        os.makedirs(os.path.dirname(task.local_path), exist_ok=True)
+        task.load_parts()
+        if not task.done_parts:
+            with open(task.partial_path, "wb") as f:
+                # sparse, the parts are written at their offsets, or empty for an empty object
+                f.truncate(task.size)
+        self._add_bytes(sum(
+            task.get_range(part)[1] - task.get_range(part)[0] + 1 for part in task.done_parts
+        ))
+
+    def _log_progress(self, total_bytes:int, started:float, stop:threading.Event, files_done:List[int], num_files:int):
+        while not stop.wait(PROGRESS_INTERVAL):
+            elapsed = time.monotonic() - started
+            done = self._bytes_done
+            logger.info(
+                f"fetched {done / MB:.0f}/{total_bytes / MB:.0f} MiB ({done / max(total_bytes, 1):.0%}), "
+                f"{files_done[0]}/{num_files} files, {done / MB / elapsed:.1f} MiB/s"
+            )
+
+    def fetch(
+            self,
+            local_dir:str,
+            bucket:str = None,
+            prefix:str = None,
+            s3_path:str = None,
+            ordered:bool = False,
+            on_listed:Callable[[List[str]], None] = None,
+            on_file_ready:Callable[[str], None] = None
+        ):
+        """Download the objects under `s3_path` (or `bucket`/`prefix`) into `local_dir`,
+        keeping the directory structure.
+
+        Args:
+            ordered: Fetch the files in `get_fetch_order`, listing order otherwise.
+            on_listed: Called with the relative paths of all the files once they are listed.
+            on_file_ready: Called with the relative path of each file once it is in place.
+        """
+        if s3_path is not None:
+            bucket, prefix = parse_s3_path(s3_path)
+        prefix = (prefix or "").strip("/")
+        os.makedirs(local_dir, exist_ok=True)
+        tasks = self.list_files(bucket, prefix, local_dir)
+        if ordered:
+            tasks.sort(key=lambda task: get_fetch_order(task.relative_path, task.size))
+        if on_listed is not None:
+            on_listed([task.relative_path for task in tasks])
+        state = self._read_state(local_dir)
+
+        pending = []
+        for task in tasks:
+            if (
+                state.get(task.relative_path) == task.etag
+                and os.path.exists(task.local_path)
+                and os.path.getsize(task.local_path) == task.size
+            ):
+                if on_file_ready is not None:
+                    on_file_ready(task.relative_path)
+                continue
+            pending.append(task)
+        total_bytes = sum(task.size for task in pending)
+        logger.info(
+            f"fetching {len(pending)} of {len(tasks)} files ({total_bytes / MB:.0f} MiB) from s3://{bucket}/{prefix} "
+            f"to {local_dir} with {self.max_concurrency} connections"
+        )
+        if not pending:
+            return
+
+        self._bytes_done = 0
+        started = time.monotonic()
+        stop = threading.Event()
+        files_done = [0]
+        progress = threading.Thread(
+            target=self._log_progress,
+            args=(total_bytes, started, stop, files_done, len(pending)),
+            daemon=True
+        )
+        progress.start()
+        try:
+            for task in pending:
+                self._prepare_file(task)
+            # files are verified and moved in place by their own threads, not queued behind the parts
+            with ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="emd-model-fetch") as executor, \
+                    ThreadPoolExecutor(max_workers=VERIFY_CONCURRENCY, thread_name_prefix="emd-model-verify") as verifier:
+                futures = {}
+                for task in pending:
+                    if len(task.done_parts) == task.num_parts:
+                        futures[verifier.submit(self._complete_file, task)] = (task, None)
+                        continue
+                    for part in range(task.num_parts):
+                        if part not in task.done_parts:
+                            futures[executor.submit(self._fetch_part, bucket, task, part)] = (task, part)
+                while futures:
+                    done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        task, part = futures.pop(future)
+                        try:
+                            future.result()
+                        except BaseException:
+                            # the remaining parts are resumed by the next attempt
+                            for other in futures:
+                                other.cancel()
+                            raise
+                        if part is None:
+                            self._file_done(local_dir, state, task, files_done)
+                            if on_file_ready is not None:
+                                on_file_ready(task.relative_path)
+                            continue
+                        task.done_parts.add(part)
+                        task.save_parts()
+                        if len(task.done_parts) == task.num_parts:
+                            # verified while the other files are still downloading
+                            futures[verifier.submit(self._complete_file, task)] = (task, None)
+        finally:
+            stop.set()
+
+        elapsed = time.monotonic() - started
+        logger.info(
+            f"fetched {len(pending)} files ({total_bytes / MB:.0f} MiB) in {elapsed:.1f}s, "
+            f"{total_bytes / MB / max(elapsed, 1e-3):.1f} MiB/s"
+        )
+
+    def _file_done(self, local_dir:str, state:Dict[str, str], task:_FileTask, files_done:List[int]):
+        state[task.relative_path] = task.etag
+        self._write_state(local_dir, state)
+        files_done[0] += 1
+
+    def start(self, local_dir:str, bucket:str = None, prefix:str = None, s3_path:str = None) -> "ModelFetch":
+        """Download in the background, in ordered mode."""
+        model_fetch = ModelFetch(local_dir)
+        model_fetch._thread = threading.Thread(
+            target=model_fetch._run,
+            args=(self, bucket, prefix, s3_path),
+            name="emd-model-fetch",
+            daemon=True
+        )
+        model_fetch._thread.start()
+        return model_fetch
+
+
+class ModelFetch:
+    """A download running in the background, see `ModelFetcher.start`. The `wait_*`
+    methods raise the error of the download if it failed."""
+
+    def __init__(self, local_dir:str):
+        self.local_dir = local_dir
+        self.files: List[str] = []
+        self.error: Optional[BaseException] = None
+        self._listed = threading.Event()
+        self._done = threading.Event()
+        self._ready: Dict[str, threading.Event] = {}
+        self._thread = None
+
+    def _run(self, fetcher:ModelFetcher, bucket:str, prefix:str, s3_path:str):
+        try:
+            fetcher.fetch(
+                self.local_dir,
+                bucket=bucket,
+                prefix=prefix,
+                s3_path=s3_path,
+                ordered=True,
+                on_listed=self._on_listed,
+                on_file_ready=self._on_file_ready
+            )
+        except BaseException as e:
+            logger.error(f"failed to download the model files to {self.local_dir}: {e}")
+            self.error = e
+        finally:
+            # wakes up the waiters of the files never fetched
+            self._listed.set()
+            for ready in self._ready.values():
+                ready.set()
+            self._done.set()
+
+    def _on_listed(self, files:List[str]):
+        self._ready = {path: threading.Event() for path in files}
+        self.files = files
+        self._listed.set()
+
+    def _on_file_ready(self, relative_path:str):
+        self._ready[relative_path].set()
+
+    def _raise_error(self):
+        if self.error is not None:
+            raise self.error
+
+    def wait_file(self, relative_path:str, timeout:Optional[float] = None) -> bool:
+        """Wait until the file is in place. Files which are not downloaded, e.g. not in S3,
+        are ready at once. Returns False on timeout."""
+        if not self._listed.wait(timeout):
+            return False
+        self._raise_error()
+        ready = self._ready.get(relative_path.replace(os.sep, "/"))
+        if ready is not None and not ready.wait(timeout):
+            return False
+        self._raise_error()
+        return True
+
+    def wait_files(self, relative_paths:Iterable[str]):
+        for relative_path in relative_paths:
+            self.wait_file(relative_path)
+
+    def wait_metadata(self):
+        """Wait for the files which are not weights: config, tokenizer, shard index, ..."""
+        self._listed.wait()
+        self._raise_error()
+        self.wait_files(path for path in self.files if not is_weight_file(path))
+
+    def wait(self, timeout:Optional[float] = None) -> bool:
+        """Wait until all the files are in place. Returns False on timeout."""
+        if not self._done.wait(timeout):
+            return False
+        self._raise_error()
+        return True
+
+
+def _get_model_fetcher(
+        bucket_name:str = None,
+        s3_key:str = None,
+        model_files_s3_path:str = None,
+        instance_type:str = None,
+        max_concurrency:int = None,
+        part_size_mb:int = None,
+        verify:bool = True
+    ) -> ModelFetcher:
+    if model_files_s3_path is None:
+        assert bucket_name and s3_key, (bucket_name, s3_key)
+    return ModelFetcher(
+        max_concurrency=max_concurrency,
+        part_size=part_size_mb * MB if part_size_mb else None,
+        verify=verify,
+        instance_type=instance_type
+    )
+
+
+def download_model_from_s3(
+        local_dir:str,
+        bucket_name:str = None,
+        s3_key:str = None,
+        model_files_s3_path:str = None,
+        ordered:bool = False,
+        **kwargs
+    ):
+    """Drop-in replacement of `download_dir_from_s3_by_s5cmd`, see `ModelFetcher`.
+    Goes through the host model cache if `EMD_MODEL_CACHE_DIR` is set."""
+    from utils.model_cache import get_model_cache
+    fetcher = _get_model_fetcher(bucket_name, s3_key, model_files_s3_path, **kwargs)
+    model_cache = get_model_cache()
+    if model_cache is not None:
+        model_cache.fetch(local_dir, fetcher, bucket=bucket_name, prefix=s3_key, s3_path=model_files_s3_path)
+        return
+    fetcher.fetch(
+        local_dir,
+        bucket=bucket_name,
+        prefix=s3_key,
+        s3_path=model_files_s3_path,
+        ordered=ordered
+    )
+
+
+def start_model_download_from_s3(
+        local_dir:str,
+        bucket_name:str = None,
+        s3_key:str = None,
+        model_files_s3_path:str = None,
+        **kwargs
+    ) -> ModelFetch:
+    """`download_model_from_s3` in the background, in ordered mode."""
+    return _get_model_fetcher(bucket_name, s3_key, model_files_s3_path, **kwargs).start(
+        local_dir,
+        bucket=bucket_name,
+        prefix=s3_key,
+        s3_path=model_files_s3_path
+    )
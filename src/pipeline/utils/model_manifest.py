@@ -0,0 +1,224 @@
+"""
+Manifest of the model files prepare_model uploads to `s3://{bucket}/emd_models/{model_id}`.
+
+The manifest (`.emd_manifest.json`, next to the files) records where the files come from,
+the upstream revision, and the size, sha256 / git blob id and S3 ETag of each file:
+
+{
+    "version": 1,
+    "model_id": "Qwen2.5-72B-Instruct",
+    "source": "huggingface",
+    "repo_id": "Qwen/Qwen2.5-72B-Instruct",
+    "revision": "d3d951150c1e5848237cd6a7ad11df4836aee842",
+    "files": {
+        "model-00001-of-00037.safetensors": {"size": 3968658944, "sha256": "...", "etag": "..."},
+        "config.json": {"size": 663, "blob_id": "...", "sha256": "...", "etag": "..."}
+    }
+}
+
+Comparing the files of the upstream revision with the manifest and the objects in S3 tells
+which files have to be downloaded and uploaded again, usually none.
+"""
+import hashlib
+import json
+import logging
+import os
+from typing import Dict, List, Optional, Tuple
+
+from botocore.exceptions import ClientError
+
+from emd.constants import EMD_MODEL_MANIFEST_FILE_NAME
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_VERSION = 1
+
+# files of the downloaders in the local dir, not part of the model
+LOCAL_IGNORED_DIRS = (".cache", ".git")
+
+
+def file_sha256(path:str, chunk_size:int = 8 * 1024 * 1024) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                return digest.hexdigest()
+            digest.update(chunk)
+
+
+def _filter_files(files:Dict[str, dict], allow_patterns=None, ignore_patterns=None) -> Dict[str, dict]:
+    from huggingface_hub.utils import filter_repo_objects
+    return {
+        path: files[path]
+        for path in filter_repo_objects(list(files), allow_patterns=allow_patterns, ignore_patterns=ignore_patterns)
+    }
+
+
+def get_huggingface_files(model) -> Tuple[str, Dict[str, dict]]:
+    """The revision and files of the model on the first reachable Hugging Face endpoint."""
+    from huggingface_hub import HfApi
+    download_kwargs = model.huggingface_model_download_kwargs
+    endpoints = model.huggingface_endpoints
+    if isinstance(endpoints, str):
+        endpoints = [endpoints]
+    error = None
+    for endpoint in endpoints:
+        try:
+            info = HfApi(endpoint=endpoint, token=download_kwargs.get("token")).model_info(
+                model.huggingface_model_id,
+                revision=download_kwargs.get("revision"),
+                files_metadata=True
+            )
+            break
+        except Exception as e:
+            logger.warning(f"failed to get the files of {model.huggingface_model_id} from {endpoint}: {e}")
+            error = e
+    else:
+        raise error or ValueError("no huggingface endpoint")
+    files = {}
+    for sibling in info.siblings:
+        entry = {"size": sibling.size}
+        if sibling.lfs is not None:
+            entry["sha256"] = sibling.lfs.sha256
+        else:
+            entry["blob_id"] = sibling.blob_id
+        files[sibling.rfilename] = entry
+    files = _filter_files(
+        files,
+        allow_patterns=download_kwargs.get("allow_patterns"),
+        ignore_patterns=download_kwargs.get("ignore_patterns")
+    )
+    return info.sha, files
+
+
+def get_modelscope_files(model) -> Tuple[str, Dict[str, dict]]:
+    """The revision and files of the model on ModelScope. ModelScope has no commit id
+    per revision, so the revision is the hash of the file list."""
+    from modelscope.hub.api import HubApi
+    model_files = HubApi().get_model_files(model.modelscope_model_id, recursive=True)
+    files = {
+        f["Path"]: {"size": f["Size"], "sha256": f.get("Sha256") or None}
+        for f in model_files
+        if f.get("Type") != "tree"
+    }
+    digest = hashlib.sha256(json.dumps(files, sort_keys=True).encode("utf-8"))
+    return f"files:{digest.hexdigest()}", files
+
+
+def get_local_files(local_dir:str) -> Dict[str, dict]:
+    """The files of a downloaded model with their size and sha256."""
+    files = {}
+    for root, dirs, filenames in os.walk(local_dir):
+        dirs[:] = [d for d in dirs if d not in LOCAL_IGNORED_DIRS]
+        for filename in filenames:
+            path = os.path.join(root, filename)
+            relative_path = os.path.relpath(path, local_dir).replace(os.sep, "/")
+            if relative_path == EMD_MODEL_MANIFEST_FILE_NAME:
+                continue
+            files[relative_path] = {"size": os.path.getsize(path), "sha256": file_sha256(path)}
+    return files
+
+
+def list_s3_files(s3_client, bucket:str, prefix:str) -> Dict[str, dict]:
+    """The objects under `prefix`/ with their size and ETag, keyed by their relative path."""
+    prefix = prefix.rstrip("/") + "/"
+    files = {}
+    paginator = s3_client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get("Contents", []):
+            relative_path = obj["Key"][len(prefix):]
+            if relative_path and relative_path != EMD_MODEL_MANIFEST_FILE_NAME:
+                files[relative_path] = {"size": obj["Size"], "etag": obj["ETag"].strip('"')}
+    return files
+
+
+def read_manifest(s3_client, bucket:str, prefix:str) -> Optional[dict]:
+    key = f"{prefix.rstrip('/')}/{EMD_MODEL_MANIFEST_FILE_NAME}"
+    try:
+        body = s3_client.get_object(Bucket=bucket, Key=key)["Body"].read()
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ("NoSuchKey", "404"):
+            return None
+        raise
+    try:
+        manifest = json.loads(body)
+    except ValueError:
+        logger.warning(f"ignore invalid manifest s3://{bucket}/{key}")
+        return None
+    if manifest.get("version") != MANIFEST_VERSION:
+        return None
+    return manifest
+
+
+def write_manifest(s3_client, bucket:str, prefix:str, manifest:dict):
+    key = f"{prefix.rstrip('/')}/{EMD_MODEL_MANIFEST_FILE_NAME}"
+    s3_client.put_object(
+        Bucket=bucket,
+        Key=key,
+        Body=json.dumps(manifest, indent=2, sort_keys=True).encode("utf-8"),
+        ContentType="application/json"
+    )
+    logger.info(f"manifest of {len(manifest['files'])} files written to s3://{bucket}/{key}")
+
+
+def is_same_file(expected:dict, actual:Optional[dict]) -> bool:
+    """Whether two entries describe the same content, by size and then by the hashes both have."""
+    if actual is None or expected.get("size") != actual.get("size"):
+        return False
+    for field in ("sha256", "blob_id"):
+        if expected.get(field) and actual.get(field):
+            return expected[field] == actual[field]
+    # no hash in common, e.g. a manifest of an older upload
+    return False
+
+
+def diff_files(
+        files:Dict[str, dict],
+        manifest:Optional[dict],
+        s3_files:Dict[str, dict]
+    ) -> Tuple[List[str], List[str]]:
+    """The files to upload, and the files of the manifest to delete, so that S3 has `files`.
+
+    A file is up to date if the manifest has the same content and the object in S3 still
+    has the size and ETag the manifest recorded.
+    """
+    manifest_files = (manifest or {}).get("files", {})
+    changed = []
+    for path, entry in files.items():
+        manifest_entry = manifest_files.get(path)
+        s3_entry = s3_files.get(path)
+        if (
+            not is_same_file(entry, manifest_entry)
+            or s3_entry is None
+            or s3_entry["size"] != manifest_entry.get("size")
+            or (manifest_entry.get("etag") and s3_entry["etag"] != manifest_entry["etag"])
+        ):
+            changed.append(path)
+    # only files emd uploaded are deleted
+    removed = [path for path in s3_files if path not in files and path in manifest_files]
+    return sorted(changed), sorted(removed)
+
+
+def build_manifest(
+        model_id:str,
+        source:str,
+        repo_id:str,
+        revision:Optional[str],
+        files:Dict[str, dict],
+        s3_files:Dict[str, dict]
+    ) -> dict:
+    manifest_files = {}
+    for path, entry in files.items():
+        manifest_entry = dict(entry)
+        if path in s3_files:
+            manifest_entry["etag"] = s3_files[path]["etag"]
+        manifest_files[path] = manifest_entry
+    return {
+        "version": MANIFEST_VERSION,
+        "model_id": model_id,
+        "source": source,
+        "repo_id": repo_id,
+        "revision": revision,
+        "files": manifest_files,
+    }
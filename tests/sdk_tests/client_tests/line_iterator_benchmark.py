@@ -0,0 +1,111 @@
+"""
+Benchmark of emd.utils.line_iterator against the BytesIO based LineIterator the sdk
+clients used before, on streams of 100k chunks:
+
+    python tests/sdk_tests/client_tests/line_iterator_benchmark.py
+"""
+import io
+import json
+import time
+import tracemalloc
+
+from emd.utils.line_iterator import LineIterator, iter_json_stream
+
+NUM_CHUNKS = 100_000
+
+
+class BytesIOLineIterator:
+    """The previous implementation, the buffer keeps the whole stream."""
+
+    def __init__(self, stream):
+        self.byte_iterator = iter(stream)
+        self.buffer = io.BytesIO()
+        self.read_pos = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        while True:
+            self.buffer.seek(self.read_pos)
+            line = self.buffer.readline()
+            if line and line[-1] == ord("\n"):
+                self.read_pos += len(line)
+                return line[:-1]
+            try:
+                chunk = next(self.byte_iterator)
+            except StopIteration:
+                if line:
+                    self.read_pos += len(line)
+                    return line
+                raise
+            if "PayloadPart" not in chunk:
+                continue
+            self.buffer.seek(0, io.SEEK_END)
+            self.buffer.write(chunk["PayloadPart"]["Bytes"])
+
+
+def chat_chunk(i):
+    return json.dumps({
+        "id": "chatcmpl-0",
+        "object": "chat.completion.chunk",
+        "choices": [{"index": 0, "delta": {"content": f"token{i} "}}]
+    }).encode("utf-8")
+
+
+def whole_lines():
+    """One document per PayloadPart, the common case."""
+    return [{"PayloadPart": {"Bytes": chat_chunk(i) + b"\n"}} for i in range(NUM_CHUNKS)]
+
+
+def split_lines():
+    """Documents split across PayloadParts."""
+    data = b"".join(chat_chunk(i) + b"\n" for i in range(NUM_CHUNKS))
+    size = len(data) // NUM_CHUNKS + 7
+    return [{"PayloadPart": {"Bytes": data[i:i + size]}} for i in range(0, len(data), size)]
+
+
+def long_line():
+    """A single line arriving in many small parts, e.g. a large non-streamed document."""
+    return [{"PayloadPart": {"Bytes": b"x" * 16}} for _ in range(NUM_CHUNKS)] + \
+        [{"PayloadPart": {"Bytes": b"\n"}}]
+
+
+def sse_events():
+    """Server-sent events of the ECS services, as raw http chunks."""
+    return [b"data: " + chat_chunk(i) + b"\n\n" for i in range(NUM_CHUNKS)] + [b"data: [DONE]\n\n"]
+
+
+def measure(name, func):
+    t0 = time.perf_counter()
+    count = func()
+    elapsed = time.perf_counter() - t0
+    # measured in a second run, tracing slows down the first one a lot
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"  {name:<12} {elapsed * 1000:9.1f} ms  peak {peak / 1024 / 1024:7.2f} MiB  ({count} items)")
+    return count
+
+
+def main():
+    for stream_name, create_stream in [
+        ("whole lines", whole_lines),
+        ("split lines", split_lines),
+        ("long line", long_line),
+    ]:
+        stream = create_stream()
+        print(f"{stream_name}: {len(stream)} chunks")
+        old = measure("BytesIO", lambda: sum(1 for _ in BytesIOLineIterator(stream)))
+        new = measure("LineBuffer", lambda: sum(1 for _ in LineIterator(stream)))
+        assert old == new, (old, new)
+
+    stream = sse_events()
+    print(f"sse events: {len(stream)} chunks")
+    documents = measure("json decode", lambda: sum(1 for _ in iter_json_stream(stream)))
+    assert documents == NUM_CHUNKS, documents
+
+
+if __name__ == "__main__":
+    main()